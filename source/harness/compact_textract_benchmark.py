@@ -0,0 +1,145 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmark of the compact raw Textract format against json.dumps(blocks).
+#
+# Reports the stored size of both formats (and of gzip'd JSON), the time to get
+# the document text out of each, and what the lazy reader fetches from the
+# local S3 stand-in to read one page, a range of lines with their geometry, or
+# every block back.
+#
+# Usage (from the source folder):
+#   python -m harness.compact_textract_benchmark [--pages 50] [--lines-per-page 40]
+
+import argparse
+import gzip
+import json
+import random
+import time
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+from harness import stand_ins
+import compact_textract
+from textract_document import TextractDocument
+
+WORDS = ['invoice', 'device', 'serial', 'number', 'shipped', 'customer', 'warranty', 'battery', 'replacement',
+         'model', 'order', 'total', 'date', 'address', 'quantity', 'unit', 'price']
+
+
+# DetectDocumentText blocks with the full precision geometry and confidences Textract returns
+def build_blocks(pages, lines_per_page, seed=0):
+    generator = random.Random(seed)
+    text = '\f'.join('\n'.join(' '.join(generator.choice(WORDS) for _ in range(generator.randint(3, 10)))
+                               for _ in range(lines_per_page)) for _ in range(pages))
+    blocks = stand_ins.text_to_blocks(text)
+    for block in blocks:
+        if 'Confidence' in block:
+            block['Confidence'] = generator.uniform(90, 100)
+        for point in block['Geometry']['Polygon']:
+            point['X'] += generator.uniform(-0.001, 0.001)
+            point['Y'] += generator.uniform(-0.001, 0.001)
+        for key in block['Geometry']['BoundingBox']:
+            block['Geometry']['BoundingBox'][key] += generator.uniform(0, 0.001)
+    return blocks
+
+
+def write_compact(blocks):
+    writer = compact_textract.CompactBlocksWriter()
+    for block in blocks:
+        writer.add(block)
+    return writer.to_bytes()
+
+
+
+def time_call(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the compact raw Textract format against JSON')
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--lines-per-page', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    blocks = build_blocks(args.pages, args.lines_per_page)
+    json_data = json.dumps(blocks).encode('utf-8')
+    gzip_data = gzip.compress(json_data)
+
+    write_time, compact_data = time_call(lambda: write_compact(blocks), args.repeat)
+
+    s3 = stand_ins.LocalS3()
+    s3.put_object(Bucket='bucket', Key='raw.json', Body=json_data)
+    s3.put_object(Bucket='bucket', Key='raw.compact', Body=compact_data)
+
+    def json_text():
+        return TextractDocument(json.loads(s3.get_object(Bucket='bucket', Key='raw.json')['Body'].read())).text
+
+    def json_blocks():
+        return json.loads(s3.get_object(Bucket='bucket', Key='raw.json')['Body'].read())
+
+    def compact(function):
+        reader = compact_textract.CompactTextractReader.from_s3(s3, 'bucket', 'raw.compact')
+        result = function(reader)
+        return reader.source, result
+
+    json_text_time, text = time_call(json_text, args.repeat)
+    json_blocks_time, _ = time_call(json_blocks, args.repeat)
+    compact_text_time, (text_source, compact_text) = time_call(lambda: compact(lambda reader: reader.text()),
+                                                               args.repeat)
+    assert compact_text == text, 'the compact text differs from the JSON text'
+    page_time, (page_source, _) = time_call(lambda: compact(lambda reader: reader.page_text(args.pages // 2 + 1)),
+                                            args.repeat)
+    lines_time, (lines_source, _) = time_call(
+        lambda: compact(lambda reader: reader.lines(args.lines_per_page * 3, args.lines_per_page * 3 + 10,
+                                                    geometry=True)), args.repeat)
+    blocks_time, (blocks_source, compact_blocks) = time_call(lambda: compact(lambda reader: list(reader.iter_blocks())),
+                                                             args.repeat)
+    assert len(compact_blocks) == len(blocks)
+
+    print(f'Blocks:                  {len(blocks)} ({args.pages} pages)')
+    print(f'JSON size:               {len(json_data) / 1024:10.1f} KB')
+    print(f'gzip JSON size:          {len(gzip_data) / 1024:10.1f} KB')
+    print(f'Compact size:            {len(compact_data) / 1024:10.1f} KB ({len(json_data) / len(compact_data):.1f}x '
+          f'smaller than JSON), written in {write_time * 1000:.2f} ms')
+    print(f'{"":25}{"time ms":>10} {"GETs":>6} {"KB fetched":>11}')
+    for name, elapsed, source in [('JSON text', json_text_time, None),
+                                  ('JSON blocks', json_blocks_time, None),
+                                  ('Compact text', compact_text_time, text_source),
+                                  ('Compact one page text', page_time, page_source),
+                                  ('Compact 10 lines+geometry', lines_time, lines_source),
+                                  ('Compact blocks', blocks_time, blocks_source)]:
+        requests = 1 if source is None else source.requests
+        fetched = len(json_data) if source is None else source.bytes_fetched
+        print(f'{name:25}{elapsed * 1000:>10.2f} {requests:>6} {fetched / 1024:>11.1f}')
+
+
+if __name__ == '__main__':
+    main()
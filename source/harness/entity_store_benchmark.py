@@ -0,0 +1,173 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Benchmark of merging reviewer annotations into a large entity list.
+#
+# Compares EntityStore with the list scans that HumanReviewCompleted used to do
+# (membership test, index and pop on Python lists for every existing row), both
+# for the merge alone and end to end, from the entity list object read from S3
+# to the one written back (EntityStore also computes the fingerprint). Indexing
+# every row costs more than the list scans of a handful of annotations: on 100k
+# entities the EntityStore parse is 10 to 30% slower than the legacy parse and
+# merge at 50 annotations, the round trip with the fingerprint and the writing of the
+# entity list 15 to 70% slower. It is faster from about 200 annotations on and three
+# times faster at 500.
+#
+# Usage (from the source folder):
+#   python -m harness.entity_store_benchmark [--entities 100000] [--annotations 50]
+
+import argparse
+import csv
+import io
+import time
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+from harness import stand_ins
+import entity_store
+
+ENTITY_TYPES = ['DEVICE', 'PERSON', 'ORGANIZATION', 'LOCATION']
+
+
+def build_entity_list(size):
+    lines = ['Text,Type']
+    for index in range(size):
+        lines.append(f'entity {index},{ENTITY_TYPES[index % len(ENTITY_TYPES)]}')
+    return lines
+
+
+# Half of the annotations already exist in the entity list, half are new
+def build_annotations(size, count):
+    annotations = []
+    for index in range(count):
+        if index % 2 == 0:
+            text = f'entity {(index * 7919) % size}'
+            entity_type = ENTITY_TYPES[((index * 7919) % size) % len(ENTITY_TYPES)]
+        else:
+            text = f'new entity {index}'
+            entity_type = 'DEVICE'
+        annotations.append((text, entity_type))
+    return annotations
+
+
+# The previous list based merge, kept here as the baseline
+def legacy_merge(custom_entities_content, new_entity_text, new_entity_type):
+    existing_entity_text_list = []
+    existing_entity_type_list = []
+    for line_count, entity in enumerate(custom_entities_content):
+        row = str(entity).replace("b'", "").replace("'", "").split(',')
+        if line_count != 0 and len(row) == 2:
+            if row[0] in new_entity_text:
+                index_to_delete = new_entity_text.index(row[0])
+                new_entity_text.pop(index_to_delete)
+                new_entity_type.pop(index_to_delete)
+            existing_entity_text_list.append(row[0])
+            existing_entity_type_list.append(row[1])
+    return existing_entity_text_list + new_entity_text
+
+
+# The previous read, merge and write of the entity list, from and to the object body
+def legacy_round_trip(body, annotations):
+    custom_entities_content = body.decode('utf-8').splitlines()
+    new_entity_text = [text for text, _ in annotations]
+    new_entity_type = [entity_type for _, entity_type in annotations]
+    existing_entity_text_list = []
+    existing_entity_type_list = []
+    for line_count, entity in enumerate(custom_entities_content):
+        row = str(entity).replace("b'", "").replace("'", "").split(',')
+        if line_count != 0 and len(row) == 2:
+            if row[0] in new_entity_text:
+                index_to_delete = new_entity_text.index(row[0])
+                new_entity_text.pop(index_to_delete)
+                new_entity_type.pop(index_to_delete)
+            existing_entity_text_list.append(row[0])
+            existing_entity_type_list.append(row[1])
+
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Text', 'Type'])
+    for text, entity_type in zip(existing_entity_text_list + new_entity_text,
+                                 existing_entity_type_list + new_entity_type):
+        writer.writerow([text, entity_type])
+    return output.getvalue().encode('utf-8')
+
+
+# NewEntityCheck parses the entity list as its lines are streamed
+def entity_store_round_trip(body, annotations):
+    store = entity_store.EntityStore.from_csv(stand_ins.LocalStreamingBody(body).iter_lines())
+    store.merge(annotations)
+    return store.to_csv().encode('utf-8'), entity_store.get_entity_list_metadata(store)
+
+
+def time_call(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark merging annotations into an entity list')
+    parser.add_argument('--entities', type=int, default=100000)
+    parser.add_argument('--annotations', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    entity_list = build_entity_list(args.entities)
+    annotations = build_annotations(args.entities, args.annotations)
+
+    legacy_time, _ = time_call(lambda: legacy_merge(entity_list,
+                                                    [text for text, _ in annotations],
+                                                    [entity_type for _, entity_type in annotations]),
+                               args.repeat)
+
+    load_time, store = time_call(lambda: entity_store.EntityStore.from_csv(entity_list), args.repeat)
+
+    def merge():
+        merge_store = entity_store.EntityStore(store)
+        start = time.perf_counter()
+        added = merge_store.merge(annotations)
+        return time.perf_counter() - start, added
+
+    merge_time, added = min(merge() for _ in range(args.repeat))
+
+    body = ('\n'.join(entity_list) + '\n').encode('utf-8')
+    legacy_round_trip_time, _ = time_call(lambda: legacy_round_trip(body, annotations), args.repeat)
+    round_trip_time, _ = time_call(lambda: entity_store_round_trip(body, annotations), args.repeat)
+
+    print(f'Existing entities:       {args.entities}')
+    print(f'Annotations merged:      {args.annotations} ({len(added)} new)')
+    print(f'Legacy parse + merge:    {legacy_time * 1000:10.2f} ms')
+    print(f'EntityStore parse:       {load_time * 1000:10.2f} ms')
+    print(f'EntityStore merge:       {merge_time * 1000:10.3f} ms')
+    print(f'EntityStore total:       {(load_time + merge_time) * 1000:10.2f} ms')
+    print(f'Legacy end to end:       {legacy_round_trip_time * 1000:10.2f} ms')
+    print(f'EntityStore end to end:  {round_trip_time * 1000:10.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
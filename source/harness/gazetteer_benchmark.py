@@ -0,0 +1,112 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmark of the gazetteer matching the entity list against processed texts.
+#
+# Reports the time to build the Aho-Corasick automaton from an entity list and
+# the matching throughput in MB/s, next to the throughput of one case
+# insensitive regular expression per entity (with fewer entities, as it is
+# linear in their number).
+#
+# Usage (from the source folder):
+#   python -m harness.gazetteer_benchmark [--entities 10000] [--megabytes 2]
+
+import argparse
+import random
+import re
+import time
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+import entity_store
+import gazetteer
+
+ENTITY_TYPES = ['DEVICE', 'PERSON', 'ORGANIZATION', 'LOCATION']
+
+WORDS = ['the', 'device', 'was', 'shipped', 'to', 'our', 'customer', 'with', 'a', 'replacement', 'battery',
+         'and', 'warranty', 'for', 'two', 'years', 'serial', 'number', 'model', 'order']
+
+
+def build_entity_list(size):
+    lines = ['Text,Type']
+    for index in range(size):
+        lines.append(f'Model X{index} Pro,{ENTITY_TYPES[index % len(ENTITY_TYPES)]}')
+    return lines
+
+
+# Processed text of about megabytes MB, one word out of twenty starts an entity of the list
+def build_processed_text(entities, megabytes, seed=0):
+    generator = random.Random(seed)
+    words = []
+    length = 0
+    while length < megabytes * 2 ** 20:
+        word = generator.choice(entities)[0] if generator.random() < 0.05 else generator.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+        if generator.random() < 0.1:
+            words.append('\n')
+    return ' '.join(words)
+
+
+def time_call(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the gazetteer matching of the entity list')
+    parser.add_argument('--entities', type=int, default=10000)
+    parser.add_argument('--megabytes', type=float, default=2)
+    parser.add_argument('--regex-entities', type=int, default=20,
+                        help='entities matched by the one regular expression per entity baseline')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    store = entity_store.EntityStore.from_csv(build_entity_list(args.entities))
+    entities = list(store)
+    processed_text = build_processed_text(entities, args.megabytes)
+    megabytes = len(processed_text.encode('utf-8')) / 2 ** 20
+
+    build_time, matcher = time_call(lambda: gazetteer.Gazetteer.from_entity_store(store), args.repeat)
+    match_time, hits = time_call(lambda: matcher.find(processed_text), args.repeat)
+
+    patterns = [re.compile(r'\b' + re.escape(text) + r'\b', re.IGNORECASE) for text, _ in
+                entities[:args.regex_entities]]
+    regex_time, _ = time_call(lambda: [pattern.findall(processed_text) for pattern in patterns], 1)
+
+    print(f'Entities:                {args.entities}')
+    print(f'Text:                    {megabytes:10.2f} MB ({len(hits)} hits)')
+    print(f'Automaton build:         {build_time * 1000:10.2f} ms')
+    print(f'Gazetteer match:         {match_time * 1000:10.2f} ms ({megabytes / match_time:.2f} MB/s)')
+    print(f'Regex per entity ({len(patterns)}): {regex_time * 1000:10.2f} ms '
+          f'({megabytes / regex_time:.2f} MB/s, {megabytes / regex_time * len(patterns) / args.entities:.4f} MB/s '
+          f'extrapolated to {args.entities} entities)')
+
+
+if __name__ == '__main__':
+    main()
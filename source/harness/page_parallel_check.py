@@ -0,0 +1,125 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Check of the page-parallel text detection of multi-page documents (textract_pages).
+#
+# The same synthetic multi-page documents are run through TextractComprehend
+# with an asynchronous Textract job per document and with their pages detected
+# in parallel, for both raw Textract formats. The processed texts and raw
+# Textract outputs written by the two runs must be byte for byte identical
+# (the stand-in gives a page the same block Ids whether it is detected alone
+# or not). The Textract stand-in takes --page-latency seconds to detect a page,
+# and the page-parallel run must take less time than the sequential one. The
+# renaming of colliding block Ids is checked on its own. Exits with status 1 on
+# the first difference.
+#
+# Usage (from the source folder):
+#   python -m harness.page_parallel_check [--documents 20] [--pages 8] [--page-latency 0.05]
+
+import argparse
+import sys
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+from harness import pipeline
+
+
+# Returns: DICTIONARY key -> (body, metadata) of the objects written under textract-output/
+def run_text_extraction(corpus, raw_textract_format, page_parallel, page_latency):
+    run = pipeline.Pipeline(corpus, trace_memory=False, page_parallel=page_parallel)
+    run.aws.textract.page_latency = page_latency
+    run.load_handlers()
+    sys.modules['01-TextractComprehend'].RAW_TEXTRACT_FORMAT = raw_textract_format
+    run.upload_inputs()
+    with run.aws.patched_boto3():
+        run.run_stage('TextractComprehend', run.textract_comprehend)
+    return {key: (stored['Body'], stored.get('Metadata')) for (bucket, key), stored in run.aws.s3.objects.items()
+            if bucket == pipeline.BUCKET and key.startswith('textract-output/')}, run.results['TextractComprehend']
+
+
+# Returns: LIST of error messages, empty if colliding block Ids are renamed consistently
+def check_id_collisions():
+    import textract_pages
+    page_blocks = [{'BlockType': 'PAGE', 'Id': 'page', 'Relationships': [{'Type': 'CHILD', 'Ids': ['line']}]},
+                   {'BlockType': 'LINE', 'Id': 'line', 'Text': 'text', 'Relationships': [{'Type': 'CHILD',
+                                                                                          'Ids': ['word']}]},
+                   {'BlockType': 'WORD', 'Id': 'word', 'Text': 'text'}]
+    merged_blocks = textract_pages.merge_page_blocks([page_blocks, page_blocks, page_blocks])
+    errors = []
+    ids = [block['Id'] for block in merged_blocks]
+    if len(set(ids)) != len(ids):
+        errors.append(f'block Ids are not unique: {ids}')
+    if ids[:3] != ['page', 'line', 'word']:
+        errors.append('the block Ids of the first page were renamed')
+    for page_number in (1, 2, 3):
+        page, line, word = merged_blocks[3 * (page_number - 1):3 * page_number]
+        if any(block['Page'] != page_number for block in (page, line, word)):
+            errors.append(f'the blocks of page {page_number} do not have its page number')
+        if page['Relationships'][0]['Ids'] != [line['Id']] or line['Relationships'][0]['Ids'] != [word['Id']]:
+            errors.append(f'the relationships of page {page_number} do not follow the renamed block Ids')
+    if textract_pages.merge_page_blocks([page_blocks, page_blocks]) != merged_blocks[:6]:
+        errors.append('the renamed block Ids are not deterministic')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the page-parallel text detection of multi-page documents')
+    parser.add_argument('--documents', type=int, default=20)
+    parser.add_argument('--pages', type=int, default=8)
+    parser.add_argument('--lines-per-page', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--page-latency', type=float, default=0.05, help='seconds Textract takes per page')
+    args = parser.parse_args()
+
+    errors = []
+    corpus = pipeline.build_corpus(args.documents, args.pages, args.lines_per_page, args.seed)
+    for raw_textract_format in ('compact', 'json'):
+        sequential_objects, sequential_results = run_text_extraction(corpus, raw_textract_format, False,
+                                                                     args.page_latency)
+        parallel_objects, parallel_results = run_text_extraction(corpus, raw_textract_format, True,
+                                                                 args.page_latency)
+        if sorted(sequential_objects) != sorted(parallel_objects):
+            errors.append(f'{raw_textract_format}: different keys written, '
+                          f'{sorted(set(sequential_objects) ^ set(parallel_objects))[:5]}')
+        for key in sorted(set(sequential_objects) & set(parallel_objects)):
+            if sequential_objects[key] != parallel_objects[key]:
+                errors.append(f'{raw_textract_format}: {key} differs')
+        print(f"{raw_textract_format:8} sequential {sequential_results['wall_seconds']:.3f} s "
+              f"({sequential_results['api_calls'].get('textract.GetDocumentTextDetection', 0)} "
+              f"GetDocumentTextDetection), page-parallel {parallel_results['wall_seconds']:.3f} s "
+              f"({parallel_results['api_calls'].get('textract.DetectDocumentText', 0)} DetectDocumentText), "
+              f"{len(sequential_objects)} objects compared")
+        if parallel_results['wall_seconds'] >= sequential_results['wall_seconds']:
+            errors.append(f"{raw_textract_format}: page-parallel is not faster than sequential "
+                          f"({parallel_results['wall_seconds']:.3f} s >= {sequential_results['wall_seconds']:.3f} s)")
+
+    errors.extend(check_id_collisions())
+    for error in errors:
+        print(error)
+    if errors:
+        sys.exit(1)
+    print('The page-parallel text detection is faster and writes the same processed texts and raw outputs')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,611 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Offline end-to-end run of the five Lambda functions over a synthetic corpus.
+#
+# The handlers are loaded from ./lambda_handlers/ and invoked in the order the
+# deployed stack chains them, with boto3 clients replaced by the stand-ins of
+# harness.stand_ins:
+#   1. TextractComprehend    S3 upload events, Textract completion messages and
+#                            the scheduled flush of the Comprehend batches
+#   2. ComprehendA2I         one S3 event per Comprehend output archive
+#   3. HumanReviewCompleted  one A2I status change per human loop, answered by a
+#                            simulated reviewer that also annotates unknown entities
+#                            (--review-batch: and one scheduled batch run)
+#   4. NewEntityCheck        the daily run
+#   5. CERTrainingCompleteCheck
+#
+# With --queue the uploads reach TextractComprehend through a local ingestion
+# queue, consumed like the SQS event source mapping does (batches of
+# --records-per-event messages, the failed ones received again after their
+# visibility timeout) on a simulated clock, so the retry delays take no time.
+# --textract-tps sets the quota of the Textract stand-in, which throttles the
+# calls beyond it, and the call budgets of the handler to the same value;
+# --unreadable uploads documents that Textract rejects, to be dead-lettered.
+#
+# --review-workers answers every human loop with several simulated workers who
+# each miss some of the entities and annotate some filler words by mistake, and
+# --review-consolidation picks how HumanReviewCompleted consolidates them.
+#
+# Every stage reports its wall time, API calls per operation, S3 bytes read and
+# written and its peak Python memory (tracemalloc, which slows the handlers down
+# several times: use --no-memory to time large corpora). A run can be saved as a
+# baseline and later runs compared against it.
+#
+# Usage (from the source folder):
+#   python -m harness.pipeline --documents 1000 --pages 1
+#   python -m harness.pipeline --documents 200 --pages 5 --save-baseline baseline.json
+#   python -m harness.pipeline --documents 200 --pages 5 --compare baseline.json
+#   python -m harness.pipeline --documents 200 --queue --textract-tps 20 --unreadable 5
+#   python -m harness.pipeline --documents 500 --review-batch --review-workers 3
+
+import argparse
+import collections
+import contextlib
+import importlib
+import io
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+from harness import stand_ins
+
+BUCKET = 'tca2i-bucket'
+COMPREHEND_TEMPORARY_BUCKET = 'tca2i-comprehend-temporary'
+ENTITY_LIST_KEY = 'comprehend-data/entity-list.csv'
+TRAINING_DATASET_KEY = 'comprehend-data/training-documents.txt'
+FLOW_DEFINITION_ARN = 'arn:aws:sagemaker:us-east-1:123456789012:flow-definition/tca2i'
+RECOGNIZER_ARN = 'arn:aws:comprehend:us-east-1:123456789012:entity-recognizer/tca2i-initial'
+COMPLETION_CHECK_RULE_ARN = 'arn:aws:events:us-east-1:123456789012:rule/tca2i-training-completion-check'
+A2I_OUTPUT_PATH = f's3://{BUCKET}/a2i-output'
+INGESTION_QUEUE_NAME = 'tca2i-ingestion'
+INGESTION_DEAD_LETTER_QUEUE_NAME = 'tca2i-ingestion-dead-letter'
+INGESTION_VISIBILITY_TIMEOUT = 1080
+
+# Entities the initial recognizer knows, and entities only the human reviewers know
+KNOWN_ENTITIES = {'iPhone': 'DEVICE', 'Galaxy Tab': 'DEVICE', 'Pixel': 'DEVICE', 'ThinkPad': 'DEVICE'}
+UNKNOWN_ENTITIES = {'Surface Duo': 'DEVICE', 'Kindle': 'DEVICE', 'Walkman': 'DEVICE'}
+
+# Probability that a simulated worker (of several) misses an entity, or annotates a filler word
+REVIEWER_ERROR_RATE = 0.1
+
+FILLER_WORDS = ('the', 'screen', 'of', 'my', 'stopped', 'working', 'after', 'an', 'update', 'and', 'battery',
+                'drains', 'quickly', 'when', 'charging', 'please', 'replace', 'warranty', 'order', 'number')
+
+STAGES = ('TextractComprehend', 'ComprehendA2I', 'HumanReviewCompleted', 'NewEntityCheck',
+          'CERTrainingCompleteCheck')
+
+# Environment of the deployed functions, with the limits that only make sense in AWS relaxed
+HANDLER_ENVIRONMENT = {
+    'COMPREHEND_BATCH_MAX_DOCUMENTS': '25',
+    'COMPREHEND_BATCH_WINDOW_SECONDS': '0',
+    'HUMAN_LOOP_SUBMISSION_RATE': '100000',
+    'HUMAN_LOOP_SUBMISSION_BURST': '100000',
+    'INGESTION_MAX_CONCURRENCY': '1',
+    'TEXTRACT_DETECT_DOCUMENT_TEXT_TPS': '100000',
+    'TEXTRACT_START_DOCUMENT_TEXT_DETECTION_TPS': '100000',
+    'TEXTRACT_GET_DOCUMENT_TEXT_DETECTION_TPS': '100000',
+    'COMPREHEND_DETECT_ENTITIES_TPS': '100000',
+    'COMPREHEND_START_ENTITIES_DETECTION_JOB_TPS': '100000',
+    'RETIRED_RECOGNIZER_GRACE_SECONDS': '0',
+    'GAZETTEER_ENABLED': 'true',
+}
+
+
+# Deterministic synthetic documents: pages of short lines mixing filler words
+# with known and unknown entities
+def build_corpus(documents, pages, lines_per_page, seed):
+    generator = random.Random(seed)
+    entities = list(KNOWN_ENTITIES) + list(UNKNOWN_ENTITIES)
+    corpus = {}
+    for document_number in range(documents):
+        document_pages = []
+        for _ in range(pages):
+            lines = []
+            for _ in range(lines_per_page):
+                words = generator.sample(FILLER_WORDS, 6)
+                if generator.random() < 0.3:
+                    words.insert(generator.randrange(len(words)), generator.choice(entities))
+                lines.append(' '.join(words))
+            document_pages.append('\n'.join(lines))
+        extension = 'png' if pages == 1 else 'pdf'
+        corpus[f'input/document-{document_number:06d}.{extension}'] = '\f'.join(document_pages)
+    return corpus
+
+
+def get_initial_parameters(realtime_endpoint):
+    return {
+        'S3BucketName-TCA2I': BUCKET,
+        'FlowDefARN-TCA2I': FLOW_DEFINITION_ARN,
+        'CustomEntityRecognizerARN-TCA2I': RECOGNIZER_ARN,
+        'TrainingCustomEntityRecognizerARN-TCA2I': 'NotActive',
+        'RetiredCustomEntityRecognizerARNs-TCA2I': 'NotActive',
+        'CustomEntityRecognizerEndpointARN-TCA2I': realtime_endpoint or 'NotActive',
+        'ComprehendExecutionRole-TCA2I': 'arn:aws:iam::123456789012:role/tca2i-comprehend',
+        'ComprehendTemporaryDataStoreBucketName-TCA2I': COMPREHEND_TEMPORARY_BUCKET,
+        'TextractCompletionTopicARN-TCA2I': 'arn:aws:sns:us-east-1:123456789012:tca2i-textract-completion',
+        'TextractPublishRoleARN-TCA2I': 'arn:aws:iam::123456789012:role/tca2i-textract-publish',
+        'CustomEntityTrainingListS3URI-TCA2I': f's3://{BUCKET}/{ENTITY_LIST_KEY}',
+        'CustomEntityTrainingDatasetS3URI-TCA2I': f's3://{BUCKET}/{TRAINING_DATASET_KEY}',
+        'CERTrainingCompletionCheckRuleARN-TCA2I': COMPLETION_CHECK_RULE_ARN,
+    }
+
+
+class LocalAWS:
+
+    def __init__(self, realtime_endpoint=None):
+        self.s3 = stand_ins.LocalS3()
+        self.ssm = stand_ins.LocalSSM(get_initial_parameters(realtime_endpoint))
+        self.textract = stand_ins.LocalTextract(self.s3)
+        self.comprehend = stand_ins.LocalComprehend(self.s3, KNOWN_ENTITIES)
+        self.a2i = stand_ins.LocalA2I()
+        self.events = stand_ins.LocalEvents()
+        self.sqs = stand_ins.LocalSQS()
+        self.sagemaker = stand_ins.LocalSageMaker({FLOW_DEFINITION_ARN: A2I_OUTPUT_PATH})
+        self.clients = {'s3': self.s3, 'ssm': self.ssm, 'textract': self.textract, 'comprehend': self.comprehend,
+                        'sagemaker-a2i-runtime': self.a2i, 'events': self.events, 'sqs': self.sqs,
+                        'sagemaker': self.sagemaker}
+
+    def client(self, service_name, *args, **kwargs):
+        return self.clients[service_name]
+
+    def resource(self, service_name, *args, **kwargs):
+        if service_name != 's3':
+            raise ValueError(f'No local stand-in for the {service_name} resource')
+        return stand_ins.LocalS3Resource(self.s3)
+
+    # Returns: DICTIONARY of 'service.Operation' -> number of calls so far, and of
+    # 'service.Operation:Throttled' -> number of those calls that were throttled
+    def api_calls(self):
+        calls = {}
+        for service_name, service in self.clients.items():
+            for operation_name, count in service.call_counts.items():
+                calls[f'{service_name}.{operation_name}'] = count
+            for operation_name, count in service.throttled_counts.items():
+                calls[f'{service_name}.{operation_name}:Throttled'] = count
+        return calls
+
+    # Replace boto3.client and boto3.resource while the handlers run
+    @contextlib.contextmanager
+    def patched_boto3(self):
+        import boto3
+        original_client, original_resource = boto3.client, boto3.resource
+        boto3.client, boto3.resource = self.client, self.resource
+        try:
+            yield
+        finally:
+            boto3.client, boto3.resource = original_client, original_resource
+
+
+def s3_put_event(bucket, key, size, etag=None):
+    s3_object = {'key': key, 'size': size}
+    if etag is not None:
+        s3_object['eTag'] = etag.strip('"')
+    return {'eventSource': 'aws:s3', 'eventName': 'ObjectCreated:Put',
+            's3': {'bucket': {'name': bucket}, 'object': s3_object}}
+
+
+def human_loop_completed_event(human_loop_name, output_uri):
+    return {'detail-type': 'SageMaker A2I HumanLoop Status Change',
+            'detail': {'flowDefinitionArn': FLOW_DEFINITION_ARN, 'humanLoopStatus': 'Completed',
+                       'humanLoopName': human_loop_name, 'humanLoopOutput': {'outputS3Uri': output_uri}}}
+
+
+# Answer of a reviewer who keeps the pre-annotated entities and adds the unknown ones. With
+# a generator, the reviewer misses entities and annotates filler words at REVIEWER_ERROR_RATE
+def review_human_loop(input_content, generator=None):
+    original_text = input_content['originalText']
+    entities = [dict(entity) for entity in input_content['initialValue']]
+    for entity_text, entity_type in UNKNOWN_ENTITIES.items():
+        begin = original_text.find(entity_text)
+        while begin != -1:
+            entities.append({'label': entity_type.lower(), 'startOffset': begin, 'endOffset': begin + len(entity_text)})
+            begin = original_text.find(entity_text, begin + len(entity_text))
+    if generator is None:
+        return entities
+
+    entities = [entity for entity in entities if generator.random() >= REVIEWER_ERROR_RATE]
+    if generator.random() < REVIEWER_ERROR_RATE:
+        filler_word = generator.choice(FILLER_WORDS)
+        begin = original_text.find(' ' + filler_word + ' ')
+        if begin != -1:
+            entities.append({'label': 'device', 'startOffset': begin + 1, 'endOffset': begin + 1 + len(filler_word)})
+    return entities
+
+
+# Key A2I writes the output of a human loop to, under the output path of the flow definition
+def get_a2i_output_key(human_loop_name, creation_time):
+    output_prefix = A2I_OUTPUT_PATH.replace(f's3://{BUCKET}/', '')
+    return (f"{output_prefix}/{FLOW_DEFINITION_ARN.split('/')[-1]}/{creation_time:%Y/%m/%d/%H/%M/%S}/"
+            f"{human_loop_name}/output.json")
+
+
+class Pipeline:
+
+    def __init__(self, corpus, records_per_event=10, realtime_endpoint=None, trace_memory=True, verbose=False,
+                 reuploads=0, page_parallel=False, queue=False, textract_tps=None, unreadable=0, review_batch=False,
+                 review_workers=1, review_consolidation='majority'):
+        self.corpus = corpus
+        self.records_per_event = records_per_event
+        self.reuploads = reuploads
+        self.page_parallel = page_parallel
+        self.queue = queue
+        self.textract_tps = textract_tps
+        # Documents Textract cannot read, uploaded next to the corpus
+        self.unreadable_keys = [f'input/unreadable-{number:06d}.png' for number in range(unreadable)]
+        self.review_batch = review_batch
+        self.review_workers = review_workers
+        self.review_consolidation = review_consolidation
+        self.trace_memory = trace_memory
+        self.verbose = verbose
+        self.aws = LocalAWS(realtime_endpoint)
+        self.handlers = {}
+        self.results = collections.OrderedDict()
+
+    def load_handlers(self):
+        for name, value in HANDLER_ENVIRONMENT.items():
+            os.environ.setdefault(name, value)
+        modules = ('01-TextractComprehend', '02-ComprehendA2I', '03-HumanReviewCompleted', '04-NewEntityCheck',
+                   '05-CERTrainingCompleteCheck')
+        for stage, module_name in zip(STAGES, modules):
+            self.handlers[stage] = importlib.import_module(module_name).lambda_handler
+
+        # The synthetic multi-page documents are split on their form feeds instead of with pypdf
+        import textract_pages
+        textract_pages.PAGE_SPLITTERS['pdf'] = (stand_ins.split_text_pages, True)
+        sys.modules['01-TextractComprehend'].PAGE_PARALLEL_TEXTRACT = self.page_parallel
+
+        import human_reviews
+        human_reviews.HUMAN_REVIEW_BATCH_MODE = self.review_batch
+        human_reviews.HUMAN_ANSWER_CONSOLIDATION = self.review_consolidation
+
+        # The Textract quotas of the stand-in, and the call budgets that keep the handler under them
+        import api_budgets
+        if self.textract_tps:
+            for operation in api_budgets.API_QUOTAS:
+                if operation.startswith('textract.'):
+                    self.aws.textract.set_quota(operation.split('.', 1)[1], self.textract_tps)
+                    api_budgets.budgets[operation] = api_budgets.create_budget(self.textract_tps, 1)
+
+        if self.queue:
+            import ingestion_queue
+            dead_letter_queue_url = self.aws.sqs.create_queue(QueueName=INGESTION_DEAD_LETTER_QUEUE_NAME)['QueueUrl']
+            dead_letter_queue_arn = self.aws.sqs.get_queue_attributes(
+                QueueUrl=dead_letter_queue_url)['Attributes']['QueueArn']
+            ingestion_queue.INGESTION_QUEUE_URL = self.aws.sqs.create_queue(
+                QueueName=INGESTION_QUEUE_NAME,
+                Attributes={'VisibilityTimeout': str(INGESTION_VISIBILITY_TIMEOUT),
+                            'RedrivePolicy': json.dumps({'deadLetterTargetArn': dead_letter_queue_arn,
+                                                         'maxReceiveCount': 5})})['QueueUrl']
+            ingestion_queue.INGESTION_DEAD_LETTER_QUEUE_URL = dead_letter_queue_url
+
+        # Warm containers keep their parameter cache, a new run starts from a cold one
+        import tca2i_config
+        tca2i_config.parameter_cache.reset()
+        tca2i_config.parameter_cache.ssm_client = self.aws.ssm
+
+    def upload_inputs(self):
+        entity_list = 'Text,Type\n' + ''.join(f'{text},{entity_type}\n' for text, entity_type in KNOWN_ENTITIES.items())
+        self.aws.s3.put_object(Bucket=BUCKET, Key=ENTITY_LIST_KEY, Body=entity_list)
+        self.aws.s3.put_object(Bucket=BUCKET, Key=TRAINING_DATASET_KEY, Body='\n'.join(self.corpus.values()))
+        for key, text in self.corpus.items():
+            self.aws.s3.put_object(Bucket=BUCKET, Key=key, Body=text)
+        for key in self.unreadable_keys:
+            self.aws.s3.put_object(Bucket=BUCKET, Key=key, Body=b'\x89PNG\r\n\x1a\n\xff\xfe')
+
+    def run(self):
+        self.load_handlers()
+        self.upload_inputs()
+
+        if self.trace_memory:
+            tracemalloc.start()
+        try:
+            with self.aws.patched_boto3():
+                self.run_stage('TextractComprehend', self.textract_comprehend)
+                if self.queue:
+                    self.results['TextractComprehend']['ingestion'] = self.ingestion_summary()
+                self.run_stage('ComprehendA2I', self.comprehend_a2i)
+                if self.reuploads:
+                    self.run_stage('ReuploadedDocuments', self.reupload_documents)
+                self.run_stage('HumanReviewCompleted', self.human_review_completed)
+                self.run_stage('NewEntityCheck', self.new_entity_check)
+                self.run_stage('CERTrainingCompleteCheck', self.training_complete_check)
+        finally:
+            if self.trace_memory:
+                tracemalloc.stop()
+        return self.results
+
+    def run_stage(self, stage, function):
+        calls_before = collections.Counter(self.aws.api_calls())
+        bytes_read, bytes_written = self.aws.s3.bytes_read, self.aws.s3.bytes_written
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+
+        output = io.StringIO()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if self.verbose else output):
+            invocations = function()
+        wall_seconds = time.perf_counter() - start
+
+        api_calls = collections.Counter(self.aws.api_calls())
+        api_calls.subtract(calls_before)
+        self.results[stage] = {
+            'invocations': invocations,
+            'wall_seconds': round(wall_seconds, 4),
+            'api_calls': {operation: count for operation, count in sorted(api_calls.items()) if count},
+            'bytes_read': self.aws.s3.bytes_read - bytes_read,
+            'bytes_written': self.aws.s3.bytes_written - bytes_written,
+            'peak_memory_bytes': tracemalloc.get_traced_memory()[1] - memory_before if self.trace_memory else None,
+        }
+
+    # Returns: INTEGER number of handler invocations of the stage
+    def textract_comprehend(self, keys=None):
+        handler = self.handlers['TextractComprehend']
+        records = [s3_put_event(BUCKET, key, len(self.aws.s3.objects[(BUCKET, key)]['Body']),
+                                self.aws.s3.objects[(BUCKET, key)]['ETag'])
+                   for key in keys or list(self.corpus) + self.unreadable_keys]
+        invocations = 0
+        if self.queue:
+            # S3 sends one notification per upload to the ingestion queue
+            for record in records:
+                self.aws.sqs.send_message(QueueUrl=self.ingestion_queue_url(),
+                                          MessageBody=json.dumps({'Records': [record]}))
+            invocations += self.drain_ingestion_queue(handler)
+        else:
+            for start in range(0, len(records), self.records_per_event):
+                handler({'Records': records[start:start + self.records_per_event]}, None)
+                invocations += 1
+
+        # Completion messages of the asynchronous Textract jobs. With the ingestion queue, the
+        # failed ones are retried through the queue, whose retries can start new jobs
+        while self.aws.textract.notifications:
+            notifications = self.aws.textract.notifications[:self.records_per_event]
+            del self.aws.textract.notifications[:self.records_per_event]
+            handler({'Records': notifications}, None)
+            invocations += 1
+            if self.queue and not self.aws.textract.notifications:
+                invocations += self.drain_ingestion_queue(handler)
+
+        # Scheduled flush of the partially filled Comprehend batches
+        handler({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, None)
+        return invocations + 1
+
+    @staticmethod
+    def ingestion_queue_url():
+        import ingestion_queue
+        return ingestion_queue.INGESTION_QUEUE_URL
+
+    # Invoke the handler with the messages of the ingestion queue until it is empty, moving
+    # the simulated clock forward to the next delayed or invisible message when none is visible
+    # Returns: INTEGER number of handler invocations
+    def drain_ingestion_queue(self, handler):
+        queue_url = self.ingestion_queue_url()
+        queue_arn = self.aws.sqs.get_queue_attributes(QueueUrl=queue_url)['Attributes']['QueueArn']
+        invocations = 0
+        while True:
+            messages = self.aws.sqs.receive_message(QueueUrl=queue_url,
+                                                    MaxNumberOfMessages=self.records_per_event).get('Messages', [])
+            if not messages:
+                next_visible_time = self.aws.sqs.next_visible_time(queue_url)
+                if next_visible_time is None:
+                    return invocations
+                self.aws.sqs.advance(max(0.0, next_visible_time - self.aws.sqs.now))
+                continue
+
+            response = handler(stand_ins.sqs_lambda_event(queue_arn, messages), None)
+            invocations += 1
+            failed_message_ids = {item['itemIdentifier'] for item in response['batchItemFailures']}
+            for message in messages:
+                if message['MessageId'] not in failed_message_ids:
+                    self.aws.sqs.delete_message(QueueUrl=queue_url, ReceiptHandle=message['ReceiptHandle'])
+
+    # Returns: DICTIONARY of the documents sent back to the ingestion queue and of the dead-lettered ones
+    def ingestion_summary(self):
+        import ingestion_queue
+        sent_bodies = [json.loads(body) for queue_url, body in self.aws.sqs.sent_messages
+                       if queue_url == ingestion_queue.INGESTION_QUEUE_URL]
+        requeued = [body[ingestion_queue.RETRY_STATE_KEY] for body in sent_bodies
+                    if ingestion_queue.RETRY_STATE_KEY in body]
+        dead_letters = [json.loads(message['Body']) for message
+                        in self.aws.sqs.queues[ingestion_queue.INGESTION_DEAD_LETTER_QUEUE_URL]['Messages']]
+        return {'requeued': len(requeued),
+                'deferred': sum(1 for retry_state in requeued if retry_state['Deferrals']),
+                'dead_lettered': sorted(body['Records'][0]['s3']['object']['key'] for body in dead_letters),
+                'simulated_seconds': self.aws.sqs.now}
+
+    # The first documents of the corpus uploaded again under new names, once their entities are known
+    def reupload_documents(self):
+        keys = []
+        for key in list(self.corpus)[:self.reuploads]:
+            folder, name = key.split('/', 1)
+            keys.append(folder + '/reupload-' + name)
+            self.aws.s3.copy_object(CopySource={'Bucket': BUCKET, 'Key': key}, Bucket=BUCKET, Key=keys[-1])
+        return self.textract_comprehend(keys)
+
+    def comprehend_a2i(self):
+        handler = self.handlers['ComprehendA2I']
+        output_keys = sorted(key for bucket, key in self.aws.s3.objects
+                             if bucket == COMPREHEND_TEMPORARY_BUCKET and key.endswith('/output/output.tar.gz'))
+        for key in output_keys:
+            handler({'Records': [s3_put_event(COMPREHEND_TEMPORARY_BUCKET, key,
+                                              len(self.aws.s3.objects[(COMPREHEND_TEMPORARY_BUCKET, key)]['Body']))]},
+                    None)
+        return len(output_keys)
+
+    # The status change events are sent in both modes, the batch mode leaves them to the scheduled run
+    def human_review_completed(self):
+        handler = self.handlers['HumanReviewCompleted']
+        for human_loop_name, human_loop in sorted(self.aws.a2i.human_loops.items()):
+            input_content = json.loads(human_loop['InputContent'])
+            output_key = get_a2i_output_key(human_loop_name, human_loop['CreationTime'])
+            generators = ([random.Random(f'{human_loop_name}/{worker}') for worker in range(self.review_workers)]
+                          if self.review_workers > 1 else [None])
+            self.aws.s3.put_object(Bucket=BUCKET, Key=output_key, Body=json.dumps({
+                'humanLoopName': human_loop_name,
+                'inputContent': input_content,
+                'humanAnswers': [{'answerContent': {'crowd-entity-annotation': {
+                    'entities': review_human_loop(input_content, generator)}}} for generator in generators]}))
+            human_loop['HumanLoopStatus'] = 'Completed'
+            handler(human_loop_completed_event(human_loop_name, f's3://{BUCKET}/{output_key}'), None)
+        if not self.review_batch:
+            return len(self.aws.a2i.human_loops)
+
+        self.handlers['HumanReviewCompleted']({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, None)
+        return len(self.aws.a2i.human_loops) + 1
+
+    def new_entity_check(self):
+        self.handlers['NewEntityCheck']({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, None)
+        return 1
+
+    def training_complete_check(self):
+        self.handlers['CERTrainingCompleteCheck']({'source': 'aws.events', 'detail-type': 'Scheduled Event'}, None)
+        return 1
+
+
+# Regressions of the current run against a baseline, for the metrics that
+# grew by more than their tolerance
+# Returns: LIST of STRING descriptions
+def compare_with_baseline(results, baseline, time_tolerance, count_tolerance):
+    regressions = []
+    for stage, stage_results in results.items():
+        baseline_stage = baseline['stages'].get(stage)
+        if baseline_stage is None:
+            continue
+        checks = [('wall_seconds', stage_results['wall_seconds'], baseline_stage['wall_seconds'], time_tolerance),
+                  ('peak_memory_bytes', stage_results['peak_memory_bytes'], baseline_stage['peak_memory_bytes'],
+                   time_tolerance),
+                  ('bytes_read', stage_results['bytes_read'], baseline_stage['bytes_read'], count_tolerance),
+                  ('bytes_written', stage_results['bytes_written'], baseline_stage['bytes_written'], count_tolerance),
+                  ('api_calls', sum(stage_results['api_calls'].values()), sum(baseline_stage['api_calls'].values()),
+                   count_tolerance)]
+        for metric, value, baseline_value, tolerance in checks:
+            if value is None or baseline_value is None:
+                continue
+            if value > baseline_value * (1 + tolerance) and value - baseline_value > 0:
+                regressions.append(f'{stage}.{metric}: {value} (baseline {baseline_value})')
+    return regressions
+
+
+def print_results(results):
+    print(f"{'stage':26} {'calls':>7} {'wall s':>9} {'API calls':>10} {'read KB':>10} {'written KB':>11} "
+          f"{'peak MB':>9}")
+    for stage, stage_results in results.items():
+        peak_memory = stage_results['peak_memory_bytes']
+        print(f"{stage:26} {stage_results['invocations']:>7} {stage_results['wall_seconds']:>9.3f} "
+              f"{sum(stage_results['api_calls'].values()):>10} {stage_results['bytes_read'] / 1024:>10.1f} "
+              f"{stage_results['bytes_written'] / 1024:>11.1f} "
+              f"{'-' if peak_memory is None else format(peak_memory / 2 ** 20, '.2f'):>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the five Lambda functions offline over a synthetic corpus')
+    parser.add_argument('--documents', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=1, help='pages per document, multi-page documents are PDFs')
+    parser.add_argument('--lines-per-page', type=int, default=20)
+    parser.add_argument('--records-per-event', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--realtime-endpoint', help='ARN of a (simulated) real-time Comprehend endpoint')
+    parser.add_argument('--reuploads', type=int, default=0,
+                        help='number of documents uploaded again under a new name after ComprehendA2I')
+    parser.add_argument('--page-parallel', action='store_true',
+                        help='detect the pages of multi-page documents in parallel instead of with a Textract job')
+    parser.add_argument('--queue', action='store_true', help='send the uploads through the ingestion queue')
+    parser.add_argument('--textract-tps', type=float,
+                        help='calls per second the Textract stand-in accepts per operation (and the call budgets)')
+    parser.add_argument('--unreadable', type=int, default=0,
+                        help='number of documents Textract cannot read, uploaded with the corpus (requires --queue)')
+    parser.add_argument('--review-batch', action='store_true',
+                        help='process the completed human loops in one scheduled batch instead of one by one')
+    parser.add_argument('--review-workers', type=int, default=1,
+                        help='number of simulated workers answering every human loop')
+    parser.add_argument('--review-consolidation', choices=('majority', 'union'), default='majority',
+                        help='rule consolidating the answers of the workers of a human loop')
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH', help='baseline to compare the run against')
+    parser.add_argument('--time-tolerance', type=float, default=0.25,
+                        help='allowed relative growth of wall time and peak memory')
+    parser.add_argument('--count-tolerance', type=float, default=0.0,
+                        help='allowed relative growth of API calls and bytes')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace the peak memory (faster)')
+    parser.add_argument('--api-calls', action='store_true', help='print the API calls of every stage')
+    parser.add_argument('--verbose', action='store_true', help='show the output of the handlers')
+    args = parser.parse_args(argv)
+    if args.unreadable and not args.queue:
+        parser.error('--unreadable requires --queue, the failed documents are only retried through the queue')
+
+    corpus = build_corpus(args.documents, args.pages, args.lines_per_page, args.seed)
+    pipeline = Pipeline(corpus, args.records_per_event, args.realtime_endpoint, not args.no_memory, args.verbose,
+                        args.reuploads, args.page_parallel, args.queue, args.textract_tps, args.unreadable,
+                        args.review_batch, args.review_workers, args.review_consolidation)
+    results = pipeline.run()
+
+    print_results(results)
+    if args.api_calls:
+        for stage, stage_results in results.items():
+            print(f'{stage}: {json.dumps(stage_results["api_calls"], sort_keys=True)}')
+    throttled = {operation: count for stage_results in results.values()
+                 for operation, count in stage_results['api_calls'].items() if operation.endswith(':Throttled')}
+    if throttled:
+        print(f'Throttled calls: {json.dumps(throttled, sort_keys=True)}')
+    if 'ingestion' in results.get('TextractComprehend', {}):
+        ingestion = results['TextractComprehend']['ingestion']
+        print(f"Ingestion queue: {ingestion['requeued']} documents requeued ({ingestion['deferred']} deferred), "
+              f"{len(ingestion['dead_lettered'])} dead-lettered, {ingestion['simulated_seconds']:.0f}s simulated")
+
+    run = {'parameters': {'documents': args.documents, 'pages': args.pages, 'lines_per_page': args.lines_per_page,
+                          'records_per_event': args.records_per_event, 'seed': args.seed,
+                          'realtime_endpoint': args.realtime_endpoint, 'reuploads': args.reuploads,
+                          'page_parallel': args.page_parallel, 'queue': args.queue,
+                          'textract_tps': args.textract_tps, 'unreadable': args.unreadable,
+                          'review_batch': args.review_batch, 'review_workers': args.review_workers,
+                          'review_consolidation': args.review_consolidation},
+           'stages': results}
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as baseline_file:
+            json.dump(run, baseline_file, indent=2, sort_keys=True)
+        print(f'Baseline saved to {args.save_baseline}')
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['parameters'] != run['parameters']:
+            print(f"Warning: the baseline was recorded with {baseline['parameters']}")
+        regressions = compare_with_baseline(results, baseline, args.time_tolerance, args.count_tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            return 1
+        print(f'No regression against {args.compare}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
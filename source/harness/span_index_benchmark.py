@@ -0,0 +1,100 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmark of the span index resolving entity spans to their Textract blocks.
+#
+# Resolves random entity spans of a multi-page document to the page and
+# bounding boxes of their WORD blocks with the stored span index, and with the
+# raw Textract JSON parsed again for every document. Checks that both return
+# the same blocks and reports the size of the index next to the processed text.
+#
+# Usage (from the source folder):
+#   python -m harness.span_index_benchmark [--pages 50] [--lines-per-page 40] [--entities 1000]
+
+import argparse
+import json
+import random
+import time
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+from harness.compact_textract_benchmark import build_blocks, time_call
+import processed_data
+from textract_document import TextractDocument
+
+
+# Random [begin, end) spans of one to three words of the text
+def build_entity_spans(document, count, seed=0):
+    generator = random.Random(seed)
+    spans = []
+    for _ in range(count):
+        first = generator.randrange(len(document.words))
+        last = min(first + generator.randint(0, 2), len(document.words) - 1)
+        spans.append((document.words[first].start, document.words[last].end))
+    return spans
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the span index against parsing the raw Textract JSON')
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--lines-per-page', type=int, default=40)
+    parser.add_argument('--entities', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    raw_json = json.dumps(build_blocks(args.pages, args.lines_per_page))
+    document = TextractDocument(json.loads(raw_json))
+    index_json = processed_data.SpanIndex.from_document(document).to_json()
+    spans = build_entity_spans(document, args.entities)
+
+    def resolve_from_raw_json():
+        raw_document = TextractDocument(json.loads(raw_json))
+        return [[(word.id, word.page, word.bounding_box) for word in raw_document.words_in_span(begin, end)]
+                for begin, end in spans]
+
+    def resolve_from_index():
+        span_index = processed_data.SpanIndex.from_json(index_json)
+        return [[(block['BlockId'], block['Page'], tuple(block['BoundingBox'][key] for key in
+                                                          ('Left', 'Top', 'Width', 'Height')))
+                 for block in span_index.words_in_span(begin, end)] for begin, end in spans]
+
+    raw_time, raw_blocks = time_call(resolve_from_raw_json, args.repeat)
+    index_time, index_blocks = time_call(resolve_from_index, args.repeat)
+    span_index = processed_data.SpanIndex.from_json(index_json)
+    lookup_time, _ = time_call(lambda: [span_index.words_in_span(begin, end) for begin, end in spans], args.repeat)
+
+    print(f'Document:                {args.pages} pages, {len(document.words)} words, '
+          f'{len(document.text.encode("utf-8")) / 1024:.1f} KB of text')
+    print(f'Raw Textract JSON:       {len(raw_json) / 1024:10.1f} KB')
+    print(f'Span index:              {len(index_json) / 1024:10.1f} KB')
+    print(f'Parse raw JSON + resolve {raw_time * 1000:10.2f} ms for {len(spans)} entities')
+    print(f'Load index + resolve     {index_time * 1000:10.2f} ms for {len(spans)} entities')
+    print(f'Index lookups only       {lookup_time * 1000:10.2f} ms '
+          f'({lookup_time / len(spans) * 1e6:.2f} us per entity)')
+    if raw_blocks != index_blocks:
+        raise SystemExit('The span index resolves different blocks than the raw Textract JSON')
+    print('Both resolve the same blocks')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,741 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Local stand-ins for the AWS service clients used by the Lambda functions.
+#
+# Each stand-in implements only the calls (and response fields) that the
+# handlers use, keeps its state in memory and counts the calls made to it so
+# that callers can assert on API usage.
+
+import collections
+import datetime
+import hashlib
+import io
+import itertools
+import json
+import tarfile
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+from rate_limiting import TokenBucket
+
+
+def client_error(operation_name, code, message=''):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation_name)
+
+
+class LocalService:
+
+    def __init__(self):
+        self.call_counts = collections.Counter()
+        # Operation name -> TokenBucket of the calls per second the service accepts
+        self.quotas = {}
+        self.throttled_counts = collections.Counter()
+
+    # Throttle the calls to an operation beyond calls_per_second, the way the AWS quotas do
+    def set_quota(self, operation_name, calls_per_second):
+        self.quotas[operation_name] = TokenBucket(calls_per_second, max(1.0, calls_per_second))
+
+    def _count(self, operation_name):
+        self.call_counts[operation_name] += 1
+        quota = self.quotas.get(operation_name)
+        if quota is not None and not quota.acquire(timeout=0):
+            self.throttled_counts[operation_name] += 1
+            raise client_error(operation_name, 'ThrottlingException', 'Rate exceeded')
+
+
+class LocalSSM(LocalService):
+
+    def __init__(self, parameters=None):
+        super().__init__()
+        # Parameter Name -> {'Value', 'Type', 'Version'}
+        self.parameters = {}
+        for name, value in (parameters or {}).items():
+            self.put_parameter(Name=name, Type='String', Value=value)
+        self.call_counts.clear()
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self._count('GetParameters')
+        response = {'Parameters': [], 'InvalidParameters': []}
+        for name in Names:
+            if name in self.parameters:
+                response['Parameters'].append(self._describe(name))
+            else:
+                response['InvalidParameters'].append(name)
+        return response
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self._count('GetParameter')
+        if Name not in self.parameters:
+            raise client_error('GetParameter', 'ParameterNotFound', Name)
+        return {'Parameter': self._describe(Name)}
+
+    def put_parameter(self, Name, Value, Type='String', Overwrite=False, **kwargs):
+        self._count('PutParameter')
+        existing = self.parameters.get(Name)
+        if existing is not None and not Overwrite:
+            raise client_error('PutParameter', 'ParameterAlreadyExists', Name)
+        version = existing['Version'] + 1 if existing is not None else 1
+        self.parameters[Name] = {'Value': Value, 'Type': Type, 'Version': version}
+        return {'Version': version}
+
+    def delete_parameter(self, Name):
+        self._count('DeleteParameter')
+        if self.parameters.pop(Name, None) is None:
+            raise client_error('DeleteParameter', 'ParameterNotFound', Name)
+        return {}
+
+    def _describe(self, name):
+        parameter = self.parameters[name]
+        return {'Name': name, 'Type': parameter['Type'], 'Value': parameter['Value'], 'Version': parameter['Version']}
+
+
+class LocalStreamingBody:
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+        self._length = len(data)
+
+    def read(self, amt=None):
+        return self._stream.read() if amt is None else self._stream.read(amt)
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            chunk = self._stream.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_lines(self, chunk_size=1024, keepends=False):
+        for line in self._stream:
+            yield line if keepends else line.rstrip(b'\r\n')
+
+    def close(self):
+        self._stream.close()
+
+
+class LocalS3(LocalService):
+
+    def __init__(self):
+        super().__init__()
+        # (Bucket, Key) -> {'Body', 'Metadata', 'ETag', 'ContentType', 'LastModified'}
+        self.objects = {}
+        # UploadId -> {'Bucket', 'Key', 'Parts': PartNumber -> Body}
+        self.multipart_uploads = {}
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def put_object(self, Bucket, Key, Body=b'', Metadata=None, ContentType=None, **kwargs):
+        self._count('PutObject')
+        return self._store(Bucket, Key, Body, Metadata, ContentType)
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self._count('GetObject')
+        stored = self._get(Bucket, Key, 'GetObject')
+        body = stored['Body']
+        response = {}
+        if Range is not None:
+            byte_range = self._parse_range(Range, len(body))
+            response['ContentRange'] = f"bytes {byte_range.start}-{byte_range.stop - 1}/{len(body)}"
+            body = body[byte_range]
+        self.bytes_read += len(body)
+        response.update({'Body': LocalStreamingBody(body), 'ContentLength': len(body), 'ETag': stored['ETag'],
+                         'Metadata': dict(stored['Metadata']), 'ContentType': stored['ContentType']})
+        return response
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._count('HeadObject')
+        stored = self._get(Bucket, Key, 'HeadObject')
+        return {'ContentLength': len(stored['Body']), 'ETag': stored['ETag'], 'Metadata': dict(stored['Metadata']),
+                'ContentType': stored['ContentType']}
+
+    def copy_object(self, CopySource, Bucket, Key, Metadata=None, MetadataDirective='COPY', **kwargs):
+        self._count('CopyObject')
+        source = self._get(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        metadata = source['Metadata'] if MetadataDirective == 'COPY' else Metadata
+        self.objects[(Bucket, Key)] = dict(source, Metadata=dict(metadata or {}),
+                                           LastModified=datetime.datetime.now(datetime.timezone.utc))
+        return {'CopyObjectResult': {'ETag': source['ETag']}}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._count('DeleteObject')
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self._count('DeleteObjects')
+        for deleted_object in Delete['Objects']:
+            self.objects.pop((Bucket, deleted_object['Key']), None)
+        return {'Deleted': [{'Key': deleted_object['Key']} for deleted_object in Delete['Objects']]}
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None, StartAfter='', MaxKeys=1000, ContinuationToken=None,
+                        **kwargs):
+        self._count('ListObjectsV2')
+        start_after = ContinuationToken or StartAfter
+        keys = sorted(key for (bucket, key) in self.objects
+                      if bucket == Bucket and key.startswith(Prefix) and key > start_after)
+        if Delimiter:
+            # Keys below a delimiter are rolled up into their common prefix
+            entries = []
+            for key in keys:
+                delimiter_index = key.find(Delimiter, len(Prefix))
+                entry = key if delimiter_index == -1 else key[:delimiter_index + len(Delimiter)]
+                if not entries or entries[-1] != entry:
+                    entries.append(entry)
+        else:
+            entries = keys
+        page = entries[:MaxKeys]
+        page_keys = [entry for entry in page if not (Delimiter and entry.endswith(Delimiter))]
+        common_prefixes = [entry for entry in page if Delimiter and entry.endswith(Delimiter)]
+        response = {'KeyCount': len(page), 'IsTruncated': len(entries) > MaxKeys,
+                    'Contents': [{'Key': key, 'Size': len(self.objects[(Bucket, key)]['Body']),
+                                  'ETag': self.objects[(Bucket, key)]['ETag'],
+                                  'LastModified': self.objects[(Bucket, key)]['LastModified']} for key in page_keys]}
+        if common_prefixes:
+            response['CommonPrefixes'] = [{'Prefix': common_prefix} for common_prefix in common_prefixes]
+        if response['IsTruncated']:
+            # Continue after every key of the last common prefix
+            response['NextContinuationToken'] = page[-1] + '\uffff' if page[-1] in common_prefixes else page[-1]
+        if not page_keys:
+            del response['Contents']
+        return response
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self._count('CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        self.multipart_uploads[upload_id] = {'Bucket': Bucket, 'Key': Key, 'Parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        self._count('UploadPart')
+        if UploadId not in self.multipart_uploads:
+            raise client_error('UploadPart', 'NoSuchUpload', UploadId)
+        body = bytes(Body)
+        self.multipart_uploads[UploadId]['Parts'][PartNumber] = body
+        return {'ETag': '"%s"' % hashlib.md5(body).hexdigest()}
+
+    # The object is written, and its bytes counted, when the upload is completed
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        self._count('CompleteMultipartUpload')
+        upload = self.multipart_uploads.pop(UploadId, None)
+        if upload is None:
+            raise client_error('CompleteMultipartUpload', 'NoSuchUpload', UploadId)
+        part_numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        if part_numbers != sorted(upload['Parts']):
+            raise client_error('CompleteMultipartUpload', 'InvalidPart', UploadId)
+        return self._store(Bucket, Key, b''.join(upload['Parts'][part_number] for part_number in part_numbers),
+                           None, None)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self._count('AbortMultipartUpload')
+        self.multipart_uploads.pop(UploadId, None)
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None, **kwargs):
+        self._count('UploadFileobj')
+        extra_args = ExtraArgs or {}
+        self._store(Bucket, Key, Fileobj.read(), extra_args.get('Metadata'), extra_args.get('ContentType'))
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, **kwargs):
+        with open(Filename, 'rb') as file_object:
+            self.upload_fileobj(file_object, Bucket, Key, ExtraArgs)
+
+    def _store(self, bucket, key, body, metadata, content_type):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        elif not isinstance(body, (bytes, bytearray)):
+            body = body.read()
+        body = bytes(body)
+        self.bytes_written += len(body)
+        etag = '"%s"' % uuid.uuid5(uuid.NAMESPACE_OID, body.hex()).hex
+        self.objects[(bucket, key)] = {'Body': body, 'Metadata': dict(metadata or {}), 'ETag': etag,
+                                       'ContentType': content_type or 'binary/octet-stream',
+                                       'LastModified': datetime.datetime.now(datetime.timezone.utc)}
+        return {'ETag': etag}
+
+    def _get(self, bucket, key, operation_name):
+        if (bucket, key) not in self.objects:
+            raise client_error(operation_name, 'NoSuchKey', bucket + '/' + key)
+        return self.objects[(bucket, key)]
+
+    @staticmethod
+    def _parse_range(range_header, length):
+        first, last = range_header.replace('bytes=', '').split('-')
+        if first == '':
+            return slice(max(length - int(last), 0), length)
+        return slice(int(first), length if last == '' else int(last) + 1)
+
+
+# Stand-in for boto3.resource('s3'), limited to the Bucket calls used by the handlers
+class LocalS3Resource:
+
+    def __init__(self, s3):
+        self.s3 = s3
+
+    def Bucket(self, name):
+        return LocalS3Bucket(self.s3, name)
+
+
+class LocalS3Bucket:
+
+    def __init__(self, s3, name):
+        self.s3 = s3
+        self.name = name
+
+    def copy(self, CopySource, Key, **kwargs):
+        self.s3.copy_object(CopySource=CopySource, Bucket=self.name, Key=Key)
+
+    def upload_file(self, Filename, Key, **kwargs):
+        self.s3.upload_file(Filename, self.name, Key)
+
+
+# Namespace of the block Ids, which are derived from the text of their page and their
+# position in it so that a page gets the same Ids whether it is detected alone or not
+BLOCK_ID_NAMESPACE = uuid.UUID('0b9c1d4e-7a51-4f7e-9d2c-5e8f3a6b1c20')
+
+
+# Turn a synthetic document (UTF-8 text, one line of the "scan" per line,
+# pages separated by form feeds) into DetectDocumentText blocks: a PAGE block
+# followed by its LINE blocks and then their WORD blocks.
+def text_to_blocks(text, first_page=1):
+    blocks = []
+    for page_offset, page_text in enumerate(text.split('\f')):
+        page_digest = hashlib.sha256(page_text.encode('utf-8')).hexdigest()
+        block_ids = (str(uuid.uuid5(BLOCK_ID_NAMESPACE, f'{page_digest}/{index}')) for index in itertools.count())
+        lines = [line.strip() for line in page_text.splitlines() if line.strip()]
+        page_block = {'BlockType': 'PAGE', 'Id': next(block_ids), 'Page': first_page + page_offset,
+                      'Geometry': _geometry(0.0, 0.0, 1.0, 1.0), 'Relationships': [{'Type': 'CHILD', 'Ids': []}]}
+        line_blocks = []
+        word_blocks = []
+        for line_number, line in enumerate(lines):
+            top = (line_number + 1.0) / (len(lines) + 2.0)
+            line_block = {'BlockType': 'LINE', 'Id': next(block_ids), 'Confidence': 99.0, 'Text': line,
+                          'Page': page_block['Page'], 'Geometry': _geometry(0.05, top, 0.9, 0.02),
+                          'Relationships': [{'Type': 'CHILD', 'Ids': []}]}
+            for word_number, word in enumerate(line.split()):
+                word_block = {'BlockType': 'WORD', 'Id': next(block_ids), 'Confidence': 99.0, 'Text': word,
+                              'TextType': 'PRINTED', 'Page': page_block['Page'],
+                              'Geometry': _geometry(0.05 + 0.05 * word_number, top, 0.04, 0.02)}
+                line_block['Relationships'][0]['Ids'].append(word_block['Id'])
+                word_blocks.append(word_block)
+            page_block['Relationships'][0]['Ids'].append(line_block['Id'])
+            line_blocks.append(line_block)
+        blocks.append(page_block)
+        blocks.extend(line_blocks)
+        blocks.extend(word_blocks)
+    return blocks
+
+
+# Split a synthetic multi-page document into its single-page documents, the
+# way textract_pages splits a PDF or TIFF
+def split_text_pages(document_bytes):
+    return [page_text.encode('utf-8') for page_text in document_bytes.decode('utf-8').split('\f')]
+
+
+def _geometry(left, top, width, height):
+    return {'BoundingBox': {'Width': width, 'Height': height, 'Left': left, 'Top': top},
+            'Polygon': [{'X': left, 'Y': top}, {'X': left + width, 'Y': top},
+                        {'X': left + width, 'Y': top + height}, {'X': left, 'Y': top + height}]}
+
+
+class LocalTextract(LocalService):
+
+    def __init__(self, s3, page_size=1000, page_latency=0.0, sleep=time.sleep):
+        super().__init__()
+        self.s3 = s3
+        # Number of blocks returned per get_document_text_detection call
+        self.page_size = page_size
+        # Seconds taken to detect the text of a page: detect_document_text waits for its page,
+        # the first get_document_text_detection of a job for the pages of the job, one after another
+        self.page_latency = page_latency
+        self.sleep = sleep
+        # JobId -> blocks of the asynchronous text detection jobs
+        self.text_detection_jobs = {}
+        # JobId -> number of pages of the jobs whose results were not fetched yet
+        self.pending_job_pages = {}
+        # SNS messages that Textract would have published for completed jobs
+        self.notifications = []
+
+    def detect_document_text(self, Document):
+        self._count('DetectDocumentText')
+        blocks = text_to_blocks(self._read_document(Document))
+        if self.page_latency:
+            self.sleep(self.page_latency)
+        return {'DocumentMetadata': {'Pages': 1}, 'Blocks': blocks}
+
+    # Jobs complete as soon as they are started and their completion message
+    # is queued on self.notifications as an SNS record
+    def start_document_text_detection(self, DocumentLocation, NotificationChannel=None, **kwargs):
+        self._count('StartDocumentTextDetection')
+        job_id = uuid.uuid4().hex
+        self.text_detection_jobs[job_id] = text_to_blocks(self._read_document(DocumentLocation))
+        self.pending_job_pages[job_id] = len([block for block in self.text_detection_jobs[job_id]
+                                              if block['BlockType'] == 'PAGE'])
+        s3_object = DocumentLocation['S3Object']
+        message = {'JobId': job_id, 'Status': 'SUCCEEDED', 'API': 'StartDocumentTextDetection',
+                   'DocumentLocation': {'S3ObjectName': s3_object['Name'], 'S3Bucket': s3_object['Bucket']}}
+        self.notifications.append({'EventSource': 'aws:sns',
+                                   'Sns': {'TopicArn': (NotificationChannel or {}).get('SNSTopicArn'),
+                                           'Message': json.dumps(message)}})
+        return {'JobId': job_id}
+
+    def get_document_text_detection(self, JobId, MaxResults=1000, NextToken=None):
+        self._count('GetDocumentTextDetection')
+        blocks = self.text_detection_jobs[JobId]
+        pages = self.pending_job_pages.pop(JobId, 0)
+        if self.page_latency and pages:
+            self.sleep(pages * self.page_latency)
+        start = int(NextToken or 0)
+        end = start + min(MaxResults, self.page_size)
+        response = {'JobStatus': 'SUCCEEDED', 'Blocks': blocks[start:end],
+                    'DocumentMetadata': {'Pages': len([block for block in blocks if block['BlockType'] == 'PAGE'])}}
+        if end < len(blocks):
+            response['NextToken'] = str(end)
+        return response
+
+    # Synthetic documents are UTF-8 text, anything else is rejected like a document Textract cannot read
+    def _read_document(self, document):
+        if 'Bytes' in document:
+            document_bytes = document['Bytes']
+        else:
+            s3_object = document['S3Object']
+            if (s3_object['Bucket'], s3_object['Name']) not in self.s3.objects:
+                raise client_error('DetectDocumentText', 'InvalidS3ObjectException', s3_object['Name'])
+            document_bytes = self.s3.objects[(s3_object['Bucket'], s3_object['Name'])]['Body']
+        try:
+            return document_bytes.decode('utf-8')
+        except UnicodeDecodeError:
+            raise client_error('DetectDocumentText', 'UnsupportedDocumentException', 'Unsupported document format')
+
+
+# Find every occurrence of the known entity texts in a document, the way a
+# perfectly trained custom entity recognizer would report them
+def find_entities(text, known_entities, score=0.99):
+    entities = []
+    for entity_text, entity_type in known_entities.items():
+        begin = text.find(entity_text)
+        while begin != -1:
+            entities.append({'BeginOffset': begin, 'EndOffset': begin + len(entity_text), 'Score': score,
+                             'Text': entity_text, 'Type': entity_type})
+            begin = text.find(entity_text, begin + len(entity_text))
+    return sorted(entities, key=lambda entity: entity['BeginOffset'])
+
+
+class LocalComprehend(LocalService):
+
+    def __init__(self, s3, known_entities=None, account_id='123456789012'):
+        super().__init__()
+        self.s3 = s3
+        self.known_entities = dict(known_entities or {})
+        self.account_id = account_id
+        # JobId -> job properties
+        self.entities_detection_jobs = {}
+        # EntityRecognizerArn -> recognizer properties
+        self.entity_recognizers = {}
+        self.deleted_recognizers = []
+
+    # Stand-in for a custom entity recognizer's real-time endpoint
+    def detect_entities(self, Text, EndpointArn=None, LanguageCode=None):
+        self._count('DetectEntities')
+        return {'Entities': find_entities(Text, self.known_entities)}
+
+    # Jobs complete as soon as they are started: the output archive is written
+    # to the output location the same way Comprehend lays it out
+    def start_entities_detection_job(self, InputDataConfig, OutputDataConfig, DataAccessRoleArn, LanguageCode,
+                                     EntityRecognizerArn=None, JobName=None, ClientRequestToken=None, **kwargs):
+        self._count('StartEntitiesDetectionJob')
+        for job in self.entities_detection_jobs.values():
+            if ClientRequestToken is not None and job['ClientRequestToken'] == ClientRequestToken:
+                return {'JobId': job['JobId'], 'JobStatus': job['JobStatus']}
+
+        job_id = uuid.uuid4().hex
+        input_bucket, input_prefix = _split_s3_uri(InputDataConfig['S3Uri'])
+        output_bucket, output_prefix = _split_s3_uri(OutputDataConfig['S3Uri'])
+        output_key = output_prefix + self.account_id + '-NER-' + job_id + '/output/output.tar.gz'
+
+        output_lines = []
+        for (bucket, key), stored in sorted(self.s3.objects.items()):
+            if bucket != input_bucket or not key.startswith(input_prefix):
+                continue
+            text = stored['Body'].decode('utf-8')
+            if InputDataConfig.get('InputFormat') == 'ONE_DOC_PER_LINE':
+                for line_number, line in enumerate(text.split('\n')):
+                    output_lines.append({'Entities': find_entities(line, self.known_entities),
+                                         'File': key.split('/')[-1], 'Line': line_number})
+            else:
+                output_lines.append({'Entities': find_entities(text, self.known_entities),
+                                     'File': key.split('/')[-1]})
+
+        self.s3.put_object(Bucket=output_bucket, Key=output_key,
+                           Body=_tar_gz({'output': ''.join(json.dumps(line) + '\n' for line in output_lines)}))
+        self.entities_detection_jobs[job_id] = {'JobId': job_id, 'JobName': JobName, 'JobStatus': 'COMPLETED',
+                                                'EntityRecognizerArn': EntityRecognizerArn,
+                                                'InputDataConfig': InputDataConfig,
+                                                'OutputDataConfig': dict(OutputDataConfig, S3Uri='s3://' +
+                                                                         output_bucket + '/' + output_key),
+                                                'ClientRequestToken': ClientRequestToken}
+        return {'JobId': job_id, 'JobStatus': 'SUBMITTED'}
+
+    def list_entities_detection_jobs(self, Filter=None, NextToken=None, MaxResults=100):
+        self._count('ListEntitiesDetectionJobs')
+        jobs = [dict(job) for job in self.entities_detection_jobs.values()
+                if Filter is None or Filter.get('JobStatus') in (None, job['JobStatus'])]
+        start = int(NextToken or 0)
+        response = {'EntitiesDetectionJobPropertiesList': jobs[start:start + MaxResults]}
+        if start + MaxResults < len(jobs):
+            response['NextToken'] = str(start + MaxResults)
+        return response
+
+    # Recognizers are trained as soon as they are created
+    def create_entity_recognizer(self, RecognizerName, DataAccessRoleArn, InputDataConfig, LanguageCode, **kwargs):
+        self._count('CreateEntityRecognizer')
+        recognizer_arn = f'arn:aws:comprehend:us-east-1:{self.account_id}:entity-recognizer/{RecognizerName}'
+        now = datetime.datetime.now(datetime.timezone.utc)
+        self.entity_recognizers[recognizer_arn] = {'EntityRecognizerArn': recognizer_arn, 'Status': 'TRAINED',
+                                                   'InputDataConfig': InputDataConfig, 'LanguageCode': LanguageCode,
+                                                   'SubmitTime': now, 'EndTime': now}
+        return {'EntityRecognizerArn': recognizer_arn}
+
+    def describe_entity_recognizer(self, EntityRecognizerArn):
+        self._count('DescribeEntityRecognizer')
+        if EntityRecognizerArn not in self.entity_recognizers:
+            raise client_error('DescribeEntityRecognizer', 'ResourceNotFoundException', EntityRecognizerArn)
+        return {'EntityRecognizerProperties': dict(self.entity_recognizers[EntityRecognizerArn])}
+
+    def delete_entity_recognizer(self, EntityRecognizerArn):
+        self._count('DeleteEntityRecognizer')
+        if EntityRecognizerArn in self.deleted_recognizers:
+            raise client_error('DeleteEntityRecognizer', 'ResourceNotFoundException', EntityRecognizerArn)
+        self.deleted_recognizers.append(EntityRecognizerArn)
+        self.entity_recognizers.pop(EntityRecognizerArn, None)
+        return {}
+
+
+# Stand-in for the custom entity recognizer training calls, replaying a status
+# timeline: a list of (seconds after submission, status) pairs. The status
+# returned by DescribeEntityRecognizer is the last one reached at clock() time.
+class ReplayComprehend(LocalService):
+
+    TERMINAL_STATUSES = ('TRAINED', 'IN_ERROR', 'STOPPED')
+
+    def __init__(self, timeline, clock, submit_time=None,
+                 recognizer_arn='arn:aws:comprehend:us-east-1:123456789012:entity-recognizer/replay'):
+        super().__init__()
+        self.timeline = sorted(timeline)
+        self.clock = clock
+        self.submit_time = clock() if submit_time is None else submit_time
+        self.recognizer_arn = recognizer_arn
+
+    def describe_entity_recognizer(self, EntityRecognizerArn):
+        self._count('DescribeEntityRecognizer')
+        elapsed = self.clock() - self.submit_time
+        status = 'SUBMITTED'
+        end_offset = None
+        for offset, timeline_status in self.timeline:
+            if offset > elapsed:
+                break
+            status = timeline_status
+            end_offset = offset if timeline_status in self.TERMINAL_STATUSES else None
+
+        properties = {'EntityRecognizerArn': EntityRecognizerArn, 'Status': status,
+                      'SubmitTime': _to_datetime(self.submit_time)}
+        if end_offset is not None:
+            properties['EndTime'] = _to_datetime(self.submit_time + end_offset)
+        return {'EntityRecognizerProperties': properties}
+
+
+class LocalEvents(LocalService):
+
+    def __init__(self):
+        super().__init__()
+        # Rule Name -> {'ScheduleExpression', 'State'}
+        self.rules = {}
+
+    def put_rule(self, Name, ScheduleExpression=None, State='ENABLED', **kwargs):
+        self._count('PutRule')
+        self.rules[Name] = {'ScheduleExpression': ScheduleExpression, 'State': State}
+        return {'RuleArn': 'arn:aws:events:us-east-1:123456789012:rule/' + Name}
+
+    def enable_rule(self, Name):
+        self._count('EnableRule')
+        self.rules.setdefault(Name, {'ScheduleExpression': None})['State'] = 'ENABLED'
+        return {}
+
+    def disable_rule(self, Name):
+        self._count('DisableRule')
+        self.rules.setdefault(Name, {'ScheduleExpression': None})['State'] = 'DISABLED'
+        return {}
+
+
+def _to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def _split_s3_uri(s3_uri):
+    bucket_and_key = s3_uri.replace('s3://', '', 1)
+    bucket, _, key = bucket_and_key.partition('/')
+    return bucket, key
+
+
+def _tar_gz(members):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+        for name, content in members.items():
+            data = content.encode('utf-8')
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+    return archive.getvalue()
+
+
+# Stand-in for SQS. Delays and visibility timeouts run on a simulated clock
+# (self.now, in seconds) that the caller advances, and a queue with a
+# RedrivePolicy moves a message to its dead-letter queue once it has been
+# received more than maxReceiveCount times.
+class LocalSQS(LocalService):
+
+    def __init__(self, region='us-east-1', account_id='123456789012'):
+        super().__init__()
+        self.region = region
+        self.account_id = account_id
+        self.now = 0.0
+        # QueueUrl -> {'Arn', 'Attributes', 'Messages': LIST of messages in sending order}
+        self.queues = {}
+        # (QueueUrl, MessageBody) of every message sent
+        self.sent_messages = []
+
+    def create_queue(self, QueueName, Attributes=None):
+        self._count('CreateQueue')
+        queue_url = f'https://sqs.{self.region}.amazonaws.com/{self.account_id}/{QueueName}'
+        self.queues.setdefault(queue_url, {'Arn': f'arn:aws:sqs:{self.region}:{self.account_id}:{QueueName}',
+                                           'Attributes': dict(Attributes or {}), 'Messages': []})
+        return {'QueueUrl': queue_url}
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds=0, **kwargs):
+        self._count('SendMessage')
+        message_id = str(uuid.uuid4())
+        self.sent_messages.append((QueueUrl, MessageBody))
+        self._queue(QueueUrl)['Messages'].append({'MessageId': message_id, 'Body': MessageBody, 'ReceiveCount': 0,
+                                                  'VisibleAt': self.now + DelaySeconds, 'ReceiptHandle': None})
+        return {'MessageId': message_id}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, VisibilityTimeout=None, **kwargs):
+        self._count('ReceiveMessage')
+        queue = self._queue(QueueUrl)
+        visibility_timeout = int(VisibilityTimeout if VisibilityTimeout is not None
+                                 else queue['Attributes'].get('VisibilityTimeout', 30))
+        redrive_policy = json.loads(queue['Attributes'].get('RedrivePolicy', 'null'))
+
+        received = []
+        for message in list(queue['Messages']):
+            if len(received) == MaxNumberOfMessages:
+                break
+            if message['VisibleAt'] > self.now:
+                continue
+            if redrive_policy and message['ReceiveCount'] >= int(redrive_policy['maxReceiveCount']):
+                queue['Messages'].remove(message)
+                self._queue_by_arn(redrive_policy['deadLetterTargetArn'])['Messages'].append(
+                    dict(message, ReceiveCount=0, VisibleAt=self.now, ReceiptHandle=None))
+                continue
+            message['ReceiveCount'] += 1
+            message['VisibleAt'] = self.now + visibility_timeout
+            message['ReceiptHandle'] = str(uuid.uuid4())
+            received.append({'MessageId': message['MessageId'], 'ReceiptHandle': message['ReceiptHandle'],
+                             'Body': message['Body'],
+                             'Attributes': {'ApproximateReceiveCount': str(message['ReceiveCount'])}})
+        return {'Messages': received} if received else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self._count('DeleteMessage')
+        queue = self._queue(QueueUrl)
+        queue['Messages'] = [message for message in queue['Messages'] if message['ReceiptHandle'] != ReceiptHandle]
+        return {}
+
+    def get_queue_attributes(self, QueueUrl, AttributeNames=None):
+        self._count('GetQueueAttributes')
+        queue = self._queue(QueueUrl)
+        visible = sum(1 for message in queue['Messages'] if message['VisibleAt'] <= self.now)
+        return {'Attributes': dict(queue['Attributes'], QueueArn=queue['Arn'],
+                                   ApproximateNumberOfMessages=str(visible),
+                                   ApproximateNumberOfMessagesNotVisible=str(len(queue['Messages']) - visible))}
+
+    # Returns: FLOAT time at which the next message of a queue becomes visible, or None if it is empty
+    def next_visible_time(self, queue_url):
+        return min((message['VisibleAt'] for message in self._queue(queue_url)['Messages']), default=None)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def _queue(self, queue_url):
+        if queue_url not in self.queues:
+            raise client_error('SendMessage', 'AWS.SimpleQueueService.NonExistentQueue', queue_url)
+        return self.queues[queue_url]
+
+    def _queue_by_arn(self, queue_arn):
+        return next(queue for queue in self.queues.values() if queue['Arn'] == queue_arn)
+
+
+# Lambda event of the messages received from a queue by an SQS event source mapping
+def sqs_lambda_event(queue_arn, messages):
+    return {'Records': [{'messageId': message['MessageId'], 'receiptHandle': message['ReceiptHandle'],
+                         'body': message['Body'], 'attributes': message['Attributes'], 'messageAttributes': {},
+                         'eventSource': 'aws:sqs', 'eventSourceARN': queue_arn} for message in messages]}
+
+
+# Stand-in for the SageMaker flow definitions, under whose output path A2I writes the loop outputs
+class LocalSageMaker(LocalService):
+
+    def __init__(self, flow_definition_output_paths):
+        super().__init__()
+        # FlowDefinitionArn -> S3OutputPath
+        self.flow_definition_output_paths = dict(flow_definition_output_paths)
+
+    def describe_flow_definition(self, FlowDefinitionName):
+        self._count('DescribeFlowDefinition')
+        for flow_definition_arn, output_path in self.flow_definition_output_paths.items():
+            if flow_definition_arn.split('/')[-1] == FlowDefinitionName:
+                return {'FlowDefinitionArn': flow_definition_arn, 'FlowDefinitionName': FlowDefinitionName,
+                        'FlowDefinitionStatus': 'Active', 'OutputConfig': {'S3OutputPath': output_path}}
+        raise client_error('DescribeFlowDefinition', 'ResourceNotFound', FlowDefinitionName)
+
+
+class LocalA2I(LocalService):
+
+    def __init__(self):
+        super().__init__()
+        # HumanLoopName -> {'FlowDefinitionArn', 'InputContent', 'HumanLoopStatus', 'CreationTime'}
+        self.human_loops = {}
+
+    def start_human_loop(self, HumanLoopName, FlowDefinitionArn, HumanLoopInput, **kwargs):
+        self._count('StartHumanLoop')
+        if HumanLoopName in self.human_loops:
+            raise client_error('StartHumanLoop', 'ConflictException', HumanLoopName)
+        self.human_loops[HumanLoopName] = {'FlowDefinitionArn': FlowDefinitionArn,
+                                           'InputContent': HumanLoopInput['InputContent'],
+                                           'HumanLoopStatus': 'InProgress',
+                                           'CreationTime': datetime.datetime.now(datetime.timezone.utc)}
+        return {'HumanLoopArn': FlowDefinitionArn.replace(':flow-definition/', ':human-loop/') + '/' + HumanLoopName}
@@ -0,0 +1,131 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Check of the entity detection in overlapping windows (text_chunking).
+#
+# Random processed texts (with non-ASCII characters and line breaks) are
+# detected whole and in windows by the local stand-in of the real-time
+# endpoint. For every combination of window length and overlap (in UTF-8
+# bytes, like the DetectEntities limit) the
+# windowed entities must be exactly the entities of the whole text, and the
+# offsets of every entity must slice its Text out of the processed text.
+# Exits with status 1 on the first mismatch.
+#
+# Usage (from the source folder):
+#   python -m harness.text_chunking_check [--texts 50] [--characters 20000]
+
+import argparse
+import random
+import sys
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+import text_chunking
+from harness.stand_ins import find_entities
+
+WORDS = ['the', 'device', 'was', 'shipped', 'to', 'our', 'customer', 'with', 'a', 'replacement', 'battery',
+         'naïve', 'Zürich', 'café', 'München', '東京', 'emoji 🚀', 'serial', 'number', 'model', 'order']
+
+KNOWN_ENTITIES = {f'Model X{index} Pro': 'DEVICE' for index in range(40)}
+KNOWN_ENTITIES.update({'Zürich Office': 'LOCATION', '東京 Branch': 'LOCATION'})
+
+# (window length, overlap)
+WINDOW_SETTINGS = [(200, 40), (500, 60), (1000, 100), (5000, 200)]
+
+
+# Processed text of about characters characters made of words, entities, sentence ends and line breaks
+def build_processed_text(characters, generator):
+    entities = list(KNOWN_ENTITIES)
+    words = []
+    length = 0
+    while length < characters:
+        word = generator.choice(entities) if generator.random() < 0.08 else generator.choice(WORDS)
+        roll = generator.random()
+        if roll < 0.05:
+            word += '.'
+        elif roll < 0.08:
+            word += '\n'
+        words.append(word)
+        length += len(word) + 1
+    return ' '.join(words)
+
+
+def detect(text):
+    return find_entities(text, KNOWN_ENTITIES)
+
+
+# Returns: LIST of error messages, empty if the windowed entities match
+def check_text(processed_text, window_length, overlap, max_workers):
+    windows = text_chunking.split_into_windows(processed_text, window_length, overlap)
+    errors = []
+    if windows[0][0] != 0 or windows[-1][1] != len(processed_text):
+        errors.append(f'windows {windows[0]}..{windows[-1]} do not cover the text')
+    for (start, end), (next_start, next_end) in zip(windows, windows[1:]):
+        if not start < next_start <= end:
+            errors.append(f'window {(next_start, next_end)} does not overlap {(start, end)}')
+    if any(len(processed_text[start:end].encode('utf-8')) > window_length for start, end in windows):
+        errors.append('a window is longer than the window length in UTF-8 bytes')
+
+    expected = text_chunking.deduplicate_entities(detect(processed_text))
+    entities = text_chunking.detect_entities_in_windows(detect, processed_text, windows, max_workers)
+    for entity in entities:
+        if processed_text[entity['BeginOffset']:entity['EndOffset']] != entity['Text']:
+            errors.append(f'entity {entity} does not match the text at its offsets')
+
+    def spans(found):
+        return [(entity['BeginOffset'], entity['EndOffset'], entity['Type']) for entity in found]
+
+    if spans(entities) != spans(expected):
+        missing = sorted(set(spans(expected)) - set(spans(entities)))
+        extra = sorted(set(spans(entities)) - set(spans(expected)))
+        errors.append(f'{len(missing)} missing entities {missing[:5]}, {len(extra)} extra entities {extra[:5]}')
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the entity detection in overlapping windows')
+    parser.add_argument('--texts', type=int, default=50)
+    parser.add_argument('--characters', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    checked = 0
+    for index in range(args.texts):
+        processed_text = build_processed_text(generator.randint(1, args.characters), generator)
+        for window_length, overlap in WINDOW_SETTINGS:
+            errors = check_text(processed_text, window_length, overlap, args.workers)
+            if errors:
+                print(f'Text {index} ({len(processed_text)} characters), windows of {window_length} '
+                      f'overlapping by {overlap}:')
+                for error in errors:
+                    print('  ' + error)
+                sys.exit(1)
+            checked += 1
+
+    print(f'{checked} texts and window settings checked, the windowed entities match the whole text')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Simulation of the adaptive training completion checks against replayed trainings.
+#
+# Each scenario is a status timeline replayed by ReplayComprehend. The checks are
+# scheduled the way NewEntityCheck and CERTrainingCompleteCheck schedule them
+# (rounded to whole minutes, like the CloudWatch Events rule) and compared with
+# the previous fixed rate(10 minutes) rule. Completed trainings are recorded in
+# the history, so later scenarios are scheduled from the earlier ones.
+#
+# Usage (from the source folder):
+#   python -m harness.training_schedule_simulation
+
+import datetime
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+import training_scheduler
+from harness.stand_ins import ReplayComprehend
+
+FIXED_POLL_SECONDS = 600
+
+# (name, entity count, status timeline)
+SCENARIOS = [
+    ('first training', 1000, [(120, 'TRAINING'), (40 * 60, 'TRAINED')]),
+    ('same size', 1100, [(90, 'TRAINING'), (42 * 60, 'TRAINED')]),
+    ('same size, early failure', 1050, [(60, 'TRAINING'), (4 * 60, 'IN_ERROR')]),
+    ('same size, slow', 1200, [(60, 'TRAINING'), (75 * 60, 'TRAINED')]),
+    ('larger list', 9000, [(120, 'TRAINING'), (95 * 60, 'TRAINED')]),
+]
+
+
+class SimulatedClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def round_to_rule(delay_seconds):
+    return 60 * max(1, int(round(delay_seconds / 60)))
+
+
+# Returns: TUPLE (number of checks, seconds between the end of the training and the check that saw it)
+def run_checks(timeline, next_delay):
+    clock = SimulatedClock()
+    comprehend = ReplayComprehend(timeline, clock)
+    checks = 0
+    while True:
+        clock.now += next_delay(clock.now)
+        checks += 1
+        properties = comprehend.describe_entity_recognizer(
+            EntityRecognizerArn=comprehend.recognizer_arn)['EntityRecognizerProperties']
+        if properties['Status'] in ReplayComprehend.TERMINAL_STATUSES:
+            end_seconds = (properties['EndTime'] - properties['SubmitTime']).total_seconds()
+            return checks, clock.now - end_seconds, properties
+
+
+def main():
+    history = training_scheduler.TrainingHistory()
+    totals = [0, 0, 0, 0]
+    print(f"{'scenario':28} {'expected':>9} {'fixed checks':>13} {'fixed lag':>12} "
+          f"{'adaptive checks':>16} {'adaptive lag':>15}")
+
+    for name, entity_count, timeline in SCENARIOS:
+        expected_seconds = history.expected_duration(entity_count)
+
+        def adaptive_delay(elapsed_seconds):
+            return round_to_rule(training_scheduler.get_next_poll_delay(elapsed_seconds, expected_seconds))
+
+        fixed_checks, fixed_latency, _ = run_checks(timeline, lambda elapsed_seconds: FIXED_POLL_SECONDS)
+        adaptive_checks, adaptive_latency, properties = run_checks(timeline, adaptive_delay)
+
+        totals = [total + value for total, value in
+                  zip(totals, (fixed_checks, fixed_latency, adaptive_checks, adaptive_latency))]
+        if properties['Status'] == 'TRAINED':
+            history.record(entity_count, training_scheduler.get_training_seconds(properties))
+
+        print(f"{name:28} {str(datetime.timedelta(seconds=expected_seconds)):>9} {fixed_checks:>13} "
+              f"{fixed_latency:>11.0f}s {adaptive_checks:>16} {adaptive_latency:>14.0f}s")
+
+    print(f"{'total':28} {'':>9} {totals[0]:>13} {totals[1]:>11.0f}s {totals[2]:>16} {totals[3]:>14.0f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Benchmark and check of the training-set builder of NewEntityCheck.
+#
+# Builds a synthetic training dataset in which some documents are exact or
+# near (one word changed) copies of other documents, and entities range from common to
+# appearing in a single document. Reports the size and build time of the
+# training set against the unsampled dataset, and fails if a distinct document
+# was dropped as a duplicate, if fewer than 95% of the copies were found, or if
+# an entity of the dataset is missing from the training set.
+#
+# Usage (from the source folder):
+#   python -m harness.training_set_benchmark [--documents 20000] [--max-documents 5000]
+
+import argparse
+import random
+import sys
+import time
+
+import harness  # noqa: F401 - puts lambda_handlers on sys.path
+from harness import stand_ins
+import entity_store
+import training_set
+
+BUCKET = 'bucket'
+DATASET_KEY = 'comprehend-data/training-documents.txt'
+ENTITY_TYPES = ('DEVICE', 'BRAND', 'PART', 'ERROR_CODE')
+WORDS = ['invoice', 'device', 'serial', 'number', 'shipped', 'customer', 'warranty', 'battery', 'replacement',
+         'model', 'order', 'total', 'date', 'address', 'quantity', 'unit', 'price', 'screen', 'broken', 'after',
+         'update', 'charging', 'please', 'replace', 'stopped', 'working', 'drains', 'quickly', 'when', 'the']
+
+
+# Returns: TUPLE (LIST of documents, LIST of entities, SET of the indexes of the duplicated documents)
+def build_dataset(documents, entities_per_type, duplicate_rate, seed=0):
+    generator = random.Random(seed)
+    entities = [(f'{entity_type.lower()}{number}', entity_type)
+                for entity_type in ENTITY_TYPES for number in range(entities_per_type)]
+    # Zipf-like popularity: the first entities of a type are common, the last ones rare
+    weights = [1 / (number + 1) for _ in ENTITY_TYPES for number in range(entities_per_type)]
+
+    dataset, originals, duplicates = [], [], set()
+    for _ in range(documents):
+        if originals and generator.random() < duplicate_rate:
+            words = generator.choice(originals).split()
+            if generator.random() < 0.5:
+                words[generator.randrange(len(words))] = generator.choice(WORDS)
+            duplicates.add(len(dataset))
+            dataset.append(' '.join(words))
+            continue
+        words = [generator.choice(WORDS) for _ in range(generator.randint(40, 80))]
+        for text, _ in generator.choices(entities, weights, k=generator.randint(0, 3)):
+            words.insert(generator.randrange(len(words)), text)
+        originals.append(' '.join(words))
+        dataset.append(originals[-1])
+    return dataset, entities, duplicates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the training-set builder against the unsampled dataset')
+    parser.add_argument('--documents', type=int, default=20000)
+    parser.add_argument('--entities-per-type', type=int, default=500)
+    parser.add_argument('--duplicate-rate', type=float, default=0.2)
+    parser.add_argument('--max-documents', type=int, default=5000)
+    args = parser.parse_args()
+
+    dataset, entities, duplicates = build_dataset(args.documents, args.entities_per_type, args.duplicate_rate)
+    store = entity_store.EntityStore(entities)
+    s3 = stand_ins.LocalS3()
+    s3.put_object(Bucket=BUCKET, Key=DATASET_KEY, Body='\n'.join(dataset))
+
+    start = time.perf_counter()
+    s3.get_object(Bucket=BUCKET, Key=DATASET_KEY)['Body'].read()
+    read_seconds = time.perf_counter() - start
+    training_set_uri, report = training_set.build_training_set(s3, f's3://{BUCKET}/{DATASET_KEY}', store,
+                                                               args.max_documents)
+    training_documents = s3.get_object(Bucket=BUCKET, Key=training_set_uri.split('/', 3)[3])['Body'].read() \
+        .decode('utf-8').split('\n')
+
+    # Entities of the dataset (not only of the list) against those of the training set
+    entity_gazetteer = training_set.gazetteer.Gazetteer.from_entity_store(store)
+    dataset_entities = set().union(*(training_set.find_document_entities(entity_gazetteer, document)
+                                     for document in dataset))
+    sampled_entities = set().union(*(training_set.find_document_entities(entity_gazetteer, document)
+                                     for document in training_documents))
+    kept, _, _ = training_set.deduplicate(dataset)
+    found_duplicates = len(duplicates) - len(duplicates.intersection(kept))
+    dropped_originals = args.documents - len(duplicates) - len(set(kept) - duplicates)
+
+    print(f"Dataset:        {report['InputDocuments']:>7} documents {report['InputBytes'] / 2 ** 20:>8.2f} MB, "
+          f"read in {read_seconds * 1000:.1f} ms")
+    print(f"Duplicates:     {report['ExactDuplicates']:>7} exact, {report['NearDuplicates']} near "
+          f"({found_duplicates} of the {len(duplicates)} copies found, {dropped_originals} distinct documents dropped)")
+    print(f"Training set:   {report['TrainingDocuments']:>7} documents {report['TrainingBytes'] / 2 ** 20:>8.2f} MB "
+          f"({report['SizeRatio']:.1%} of the dataset), built in {report['BuildSeconds'] * 1000:.1f} ms")
+    print(f"Entities:       {len(sampled_entities)} of the {len(dataset_entities)} found in the dataset "
+          f"({report['Entities']} in the list, {report['Entities'] - report['EntitiesCovered']} never found)")
+
+    failures = []
+    if dropped_originals:
+        failures.append(f'{dropped_originals} distinct documents were dropped as duplicates')
+    if found_duplicates < 0.95 * len(duplicates):
+        failures.append('fewer than 95% of the copies were found')
+    if dataset_entities - sampled_entities:
+        failures.append(f'{len(dataset_entities - sampled_entities)} entities of the dataset are not in the training set')
+    if report['TrainingDocuments'] > args.max_documents:
+        failures.append('the training set is larger than --max-documents')
+    for failure in failures:
+        print(f'FAILED: {failure}')
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
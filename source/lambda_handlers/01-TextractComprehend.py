@@ -23,93 +23,606 @@
 # SOFTWARE.
 
 from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
-import boto3
+import os
+import tempfile
 import re
+import tca2i_config
+import api_budgets
+import gazetteer
+import human_loops
+import ingestion_queue
+import instrumentation
+import result_cache
+import compact_textract
+import processed_data
+import text_chunking
+import textract_pages
+from comprehend_batching import DocumentBatcher
+from textract_document import TextractDocument
+from botocore.exceptions import ClientError
 
+# Maximum number of S3 records from the same event that are processed concurrently
+RECORD_PROCESSING_CONCURRENCY = int(os.environ.get('RECORD_PROCESSING_CONCURRENCY', '4'))
+
+# Documents of these types, or larger than the synchronous limit, are sent to the
+# asynchronous (multi-page) Textract API instead of detect_document_text
+ASYNC_TEXTRACT_FILE_EXTENSIONS = ('pdf', 'tif', 'tiff')
+SYNC_TEXTRACT_MAX_BYTES = int(os.environ.get('SYNC_TEXTRACT_MAX_BYTES', str(5 * 1024 * 1024)))
+
+# Multi-page PDF/TIFF documents of up to PAGE_PARALLEL_MAX_BYTES are split into pages that are
+# sent to detect_document_text concurrently instead of an asynchronous Textract job
+PAGE_PARALLEL_TEXTRACT = os.environ.get('PAGE_PARALLEL_TEXTRACT', 'false').lower() == 'true'
+PAGE_PARALLEL_MAX_BYTES = int(os.environ.get('PAGE_PARALLEL_MAX_BYTES', str(50 * 1024 * 1024)))
+
+# Number of documents per Custom Entity Recognition Job (1 starts one job per document)
+# and maximum number of seconds a document waits for its batch to fill up
+COMPREHEND_BATCH_MAX_DOCUMENTS = int(os.environ.get('COMPREHEND_BATCH_MAX_DOCUMENTS', '1'))
+COMPREHEND_BATCH_WINDOW_SECONDS = int(os.environ.get('COMPREHEND_BATCH_WINDOW_SECONDS', '300'))
+
+# Format of the raw Textract output written to textract-output/raw/: 'json' (the list of blocks as
+# returned by Textract) or 'compact' (see compact_textract)
+RAW_TEXTRACT_FORMAT = os.environ.get('RAW_TEXTRACT_FORMAT', 'json').lower()
+
+# Documents with at most this many characters are sent to the Custom Entity Recognizer's
+# real-time endpoint (when one is configured) instead of an asynchronous job
+REALTIME_MAX_TEXT_LENGTH = int(os.environ.get('REALTIME_MAX_TEXT_LENGTH', '20000'))
+
+# Texts longer than one request are sent to the real-time endpoint in windows of at most
+# REALTIME_WINDOW_LENGTH UTF-8 bytes (the DetectEntities limit) overlapping by
+# REALTIME_WINDOW_OVERLAP bytes, REALTIME_WINDOW_CONCURRENCY windows at a time
+REALTIME_WINDOW_LENGTH = int(os.environ.get('REALTIME_WINDOW_LENGTH', '5000'))
+REALTIME_WINDOW_OVERLAP = int(os.environ.get('REALTIME_WINDOW_OVERLAP', '200'))
+REALTIME_WINDOW_CONCURRENCY = int(os.environ.get('REALTIME_WINDOW_CONCURRENCY', '4'))
 
-def lambda_handler(event, context):
-    # Create an SSM Client
-    ssm_client = boto3.client('ssm')
 
+# Raised once every record of an event has been processed, if any of them failed, so that
+# Lambda retries the asynchronous invocation (and then sends it to its on-failure destination)
+class RecordsFailedError(Exception):
+
+    def __init__(self, failed_records):
+        super().__init__(f"{len(failed_records)} records failed, first: {failed_records[0]['bucket']}/"
+                         f"{failed_records[0]['key']}: {failed_records[0]['error']}")
+        self.failed_records = failed_records
+
+
+@instrumentation.instrumented('TextractComprehend')
+def lambda_handler(event, context):
     # Create an S3 Client
-    s3_client = boto3.client('s3')
-
-    # Create a Textract Client
-    textract_client = boto3.client('textract')
-
-    # Create a Comprehend Client
-    comprehend_client = boto3.client('comprehend')
-
-    # Get the Custom Entity Recognizer's ARN from SSM Parameter Store
-    comprehend_parameters = ssm_client.get_parameters(Names=['CustomEntityRecognizerARN-TCA2I',
-                                                             'ComprehendExecutionRole-TCA2I',
-                                                             'ComprehendTemporaryDataStoreBucketName-TCA2I'],
-                                                      WithDecryption=True)
-
-    for parameter in comprehend_parameters['Parameters']:
-        if parameter['Name'] == 'CustomEntityRecognizerARN-TCA2I':
-            customer_recognizer_arn = parameter['Value']
-        elif parameter['Name'] == 'ComprehendExecutionRole-TCA2I':
-            comprehend_execution_role_arn = parameter['Value']
-        elif parameter['Name'] == 'ComprehendTemporaryDataStoreBucketName-TCA2I':
-            comprehend_output_bucket = parameter['Value']
-
-    # Iterate over all S3 Put records that have been passed to this lambda function.
-    for record in event['Records']:
-        bucket = record['s3']['bucket']['name']
-        key = unquote_plus(record['s3']['object']['key'])
-
-        # Send S3 Object to Textract
-        response = textract_client.detect_document_text(
-            Document={'S3Object': {'Bucket': bucket, 'Name': key}})
-
-        # Get just the filename (without input/ or trailing filetype)
-        filename = ".".join(key.split(".")[:-1])
-        filename = "/".join(filename.split("/")[1:])
-
-        # Get the text blocks
-        blocks = response['Blocks']
-
-        # Save the JSON response from Textract to a folder in the S3 bucket
-        raw_textract_data_response = s3_client.put_object(
+    s3_client = instrumentation.client('s3')
+
+    # Create a Textract Client, whose calls share the Textract quotas with the other containers
+    textract_client = api_budgets.budgeted(instrumentation.client('textract'), 'textract')
+
+    # Create a Comprehend Client, whose calls share the Comprehend quotas with the other containers
+    comprehend_client = api_budgets.budgeted(instrumentation.client('comprehend'), 'comprehend')
+
+    # Create an A2I Client
+    a2i_client = instrumentation.client('sagemaker-a2i-runtime')
+
+    clients = {'s3': s3_client, 'textract': textract_client, 'comprehend': comprehend_client, 'a2i': a2i_client}
+
+    # Get the Custom Entity Recognizer's ARN from SSM Parameter Store (cached across warm invocations)
+    comprehend_parameters = tca2i_config.get_parameters(['CustomEntityRecognizerARN-TCA2I',
+                                                         'ComprehendExecutionRole-TCA2I',
+                                                         'ComprehendTemporaryDataStoreBucketName-TCA2I',
+                                                         'TextractCompletionTopicARN-TCA2I',
+                                                         'TextractPublishRoleARN-TCA2I',
+                                                         'S3BucketName-TCA2I',
+                                                         'CustomEntityRecognizerEndpointARN-TCA2I',
+                                                         'CustomEntityTrainingListS3URI-TCA2I',
+                                                         'FlowDefARN-TCA2I'])
+
+    if COMPREHEND_BATCH_MAX_DOCUMENTS > 1:
+        clients['batcher'] = DocumentBatcher(s3_client, comprehend_client,
+                                             comprehend_parameters['S3BucketName-TCA2I'],
+                                             comprehend_parameters['ComprehendTemporaryDataStoreBucketName-TCA2I'],
+                                             comprehend_parameters['CustomEntityRecognizerARN-TCA2I'],
+                                             comprehend_parameters['ComprehendExecutionRole-TCA2I'],
+                                             COMPREHEND_BATCH_MAX_DOCUMENTS, COMPREHEND_BATCH_WINDOW_SECONDS)
+
+    # Scheduled invocations only start the jobs for batches whose window has expired
+    if 'Records' not in event:
+        if 'batcher' in clients:
+            clients['batcher'].flush_all()
+        return {'results': [], 'failed': []}
+
+    # Human Loops of documents sent to the real-time endpoint
+    clients['human_loop_submitter'] = human_loops.HumanLoopSubmitter(a2i_client,
+                                                                     comprehend_parameters['FlowDefARN-TCA2I'])
+
+    # Uploads arrive through the ingestion queue, each message holding an S3 event notification
+    records = event['Records']
+    ingestion_documents = None
+    if ingestion_queue.is_ingestion_event(event):
+        ingestion_documents = ingestion_queue.get_documents(event['Records'])
+        records = [document['Record'] for document in ingestion_documents]
+
+    # Process all S3 Put records (and Textract completion notifications) that have been passed to this lambda function.
+    try:
+        results = process_records(records, clients, comprehend_parameters, RECORD_PROCESSING_CONCURRENCY)
+    finally:
+        submission_results = clients['human_loop_submitter'].wait()
+        clients['human_loop_submitter'].shutdown()
+
+    # A record whose Human Loop could not be started has to be retried
+    failed_human_loops = set(result['HumanLoopName'] for result in submission_results if result['Status'] == 'FAILED')
+    for result in results:
+        if result.get('human_loop_name') in failed_human_loops:
+            result['status'] = 'FAILED'
+            result['error'] = 'Failed to start human loop ' + result['human_loop_name']
+
+    failed_records = [result for result in results if result['status'] == 'FAILED']
+    print(f'Processed {len(results)} records, {len(failed_records)} failed')
+
+    # Start the jobs for the batches that this invocation has filled up
+    if 'batcher' in clients:
+        try:
+            clients['batcher'].flush_all()
+        except api_budgets.BudgetExhausted as e:
+            # The documents stay pending until the next flush
+            print(f'Comprehend batches not flushed: {e}')
+
+    # Failed documents of the ingestion queue are retried or dead-lettered with their retry state
+    if ingestion_documents is not None:
+        return {'batchItemFailures': ingestion_queue.settle(instrumentation.client('sqs'), ingestion_documents,
+                                                            results)}
+
+    # Failed Textract completion notifications are retried, or dead-lettered, through the ingestion queue
+    if failed_records:
+        failed_records = ingestion_queue.requeue_failed_records(instrumentation.client('sqs'), failed_records)
+
+    # Only records that could not be requeued are left. Lambda retries the whole event, the
+    # records that succeeded included: their results are reused from the result cache, and
+    # their jobs and human loops are idempotent, so starting them again is a no-op
+    if failed_records:
+        raise RecordsFailedError(failed_records)
+    return {'results': results, 'failed': failed_records}
+
+
+# Process S3 records on a bounded thread pool. A record that raises an error
+# is reported as FAILED without aborting the other records of the batch.
+# Returns: LIST of per-record results in the same order as the records
+def process_records(records, clients, parameters, concurrency=RECORD_PROCESSING_CONCURRENCY):
+    if concurrency <= 1 or len(records) <= 1:
+        return [process_record_safely(record, clients, parameters) for record in records]
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(records))) as executor:
+        return list(executor.map(lambda record: process_record_safely(record, clients, parameters), records))
+
+
+def process_record_safely(record, clients, parameters):
+    bucket, key = get_record_location(record)
+    result = {'bucket': bucket, 'key': key, 'record': record}
+    try:
+        result.update(process_record(record, clients, parameters))
+    except Exception as e:
+        print(f"Failed to process {bucket}/{key}: {e!r}")
+        result['status'] = 'FAILED'
+        result['error'] = repr(e)
+        if isinstance(e, ClientError):
+            result['error_code'] = e.response['Error']['Code']
+        elif isinstance(e, api_budgets.BudgetExhausted):
+            result['error_code'] = ingestion_queue.BUDGET_EXHAUSTED_ERROR_CODE
+    return result
+
+
+# Get the bucket and key of the document a record refers to, for S3 Put
+# records as well as Textract completion notifications delivered through SNS
+def get_record_location(record):
+    if 'Sns' in record:
+        document_location = json.loads(record['Sns']['Message'])['DocumentLocation']
+        return document_location['S3Bucket'], document_location['S3ObjectName']
+    return record['s3']['bucket']['name'], unquote_plus(record['s3']['object']['key'])
+
+
+# Extract the text of a single uploaded document and start the Custom Entity Recognition Job for it
+# Returns: DICTIONARY with the 'status' of the record (SUBMITTED when the asynchronous Textract
+# job has been started) and the 'human_loop_name' when a Human Loop was submitted for it
+def process_record(record, clients, parameters):
+    if 'Sns' in record:
+        return process_text_detection_completion(record, clients, parameters)
+
+    s3_client = clients['s3']
+    textract_client = clients['textract']
+
+    bucket, key = get_record_location(record)
+    correlation_id = instrumentation.get_correlation_id(bucket, key)
+
+    object_size = record['s3']['object'].get('size')
+    etag = record['s3']['object'].get('eTag')
+    if object_size is None or (etag is None and result_cache.RESULT_CACHE_ENABLED):
+        object_head = s3_client.head_object(Bucket=bucket, Key=key)
+        object_size, etag = object_head['ContentLength'], object_head['ETag']
+
+    # A document with the same content as one already processed reuses its results
+    cache_key = get_result_cache_key(parameters, etag, object_size)
+    if cache_key is not None:
+        cache_entry = result_cache.get_entry(s3_client, bucket, cache_key)
+        if cache_entry is not None:
+            return process_cached_record(clients, parameters, bucket, get_filename(key), cache_entry, correlation_id)
+
+    # Multi-page and large documents are processed by an asynchronous Textract job,
+    # which calls this function back through SNS once the text has been detected
+    if uses_async_text_detection(key, object_size):
+        # unless their pages can be detected in parallel straight away
+        if uses_page_parallel_text_detection(key, object_size):
+            document_bytes = s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+            pages = textract_pages.split_pages(document_bytes, key.split('.')[-1])
+            if pages is not None:
+                blocks = textract_pages.detect_pages_text(textract_client, pages)
+                filename = get_filename(key)
+                document = write_raw_data(s3_client, bucket, filename, blocks)
+                instrumentation.log_event('Page-Parallel Text Extraction Complete', correlation_id, key=key,
+                                          pages=len(pages))
+                return start_entity_detection(clients, parameters, bucket, filename, document.text, correlation_id,
+                                              cache_key, processed_data.SpanIndex.from_document(document))
+
+        response = textract_client.start_document_text_detection(
+            DocumentLocation={'S3Object': {'Bucket': bucket, 'Name': key}},
+            NotificationChannel={
+                'SNSTopicArn': parameters['TextractCompletionTopicARN-TCA2I'],
+                'RoleArn': parameters['TextractPublishRoleARN-TCA2I']
+            })
+        instrumentation.log_event('Asynchronous Text Extraction Job Started', correlation_id,
+                                  key=key, textract_job_id=response['JobId'])
+        return {'status': 'SUBMITTED'}
+
+    # Send S3 Object to Textract
+    response = textract_client.detect_document_text(
+        Document={'S3Object': {'Bucket': bucket, 'Name': key}})
+
+    # Get just the filename (without input/ or trailing filetype)
+    filename = get_filename(key)
+
+    # Get the text blocks
+    blocks = response['Blocks']
+
+    # Save the response from Textract to a folder in the S3 bucket
+    document = write_raw_data(s3_client, bucket, filename, blocks)
+    print(f'Text Extraction Complete for {bucket}/{key}')
+
+    # Recreate the raw text from the Textract Output
+    raw_text = document.text
+
+    return start_entity_detection(clients, parameters, bucket, filename, raw_text, correlation_id, cache_key,
+                                  processed_data.SpanIndex.from_document(document))
+
+
+# Save the Textract blocks of a document to a folder in the S3 bucket
+# Returns: TextractDocument of the blocks
+def write_raw_data(s3_client, bucket, filename, blocks):
+    if RAW_TEXTRACT_FORMAT == 'compact':
+        compact_blocks_writer = compact_textract.CompactBlocksWriter()
+        document = TextractDocument(compact_blocks_writer.collect(blocks))
+        s3_client.put_object(
+            Bucket=bucket,
+            Key=get_raw_data_key(filename),
+            Body=compact_blocks_writer.to_bytes(),
+            ContentType=compact_textract.CONTENT_TYPE
+        )
+    else:
+        document = TextractDocument(blocks)
+        s3_client.put_object(
             Bucket=bucket,
-            Key='textract-output/raw/' + filename + '.json',
+            Key=get_raw_data_key(filename),
             Body=json.dumps(blocks)
         )
-        print(f'Text Extraction Complete for {bucket}/{key}')
+    return document
 
-        # Recreate the raw text from the Textract Output
-        raw_text = ""
-        for block in blocks[1:]:
-            if (block['BlockType'] == "WORD"):
-                break
-            raw_text = raw_text + block['Text'] + " "
 
-        # Store it in an S3 bucket
-        processed_data_key = 'textract-output/processed/' + filename + '.txt'
+# Callback stage for the asynchronous Textract path: page through the detected
+# blocks, writing them to S3 as they arrive, then continue like the synchronous path
+def process_text_detection_completion(record, clients, parameters):
+    s3_client = clients['s3']
+    textract_client = clients['textract']
 
-        # Store Processed Data in S3 Bucket
-        processed_textract_data_response = s3_client.put_object(
-            Bucket=bucket,
-            Key=processed_data_key,
-            Body=json.dumps(raw_text)
-        )
+    notification = json.loads(record['Sns']['Message'])
+    bucket, key = get_record_location(record)
+    if notification['Status'] != 'SUCCEEDED':
+        raise RuntimeError(f"Text detection job {notification['JobId']} finished with status {notification['Status']}")
 
-        # Start the Custom Entity Recognition Job
-        response = comprehend_client.start_entities_detection_job(
-            InputDataConfig={
-                'S3Uri': 's3://' + bucket + '/' + processed_data_key,
-                'InputFormat': 'ONE_DOC_PER_FILE'
-            },
-            OutputDataConfig={
-                'S3Uri': 's3://' + comprehend_output_bucket + '/comprehend-output/raw/'
-            },
-            DataAccessRoleArn=comprehend_execution_role_arn,
-            JobName= re.sub(r'\W+', '', filename) + '-TextractComprehendA2I',
-            EntityRecognizerArn=customer_recognizer_arn,
-            LanguageCode='en'
-        )
+    filename = get_filename(key)
+    blocks = iter_text_detection_blocks(textract_client, notification['JobId'])
+
+    # Only the columns of the compact format are held in memory while the blocks are paginated
+    if RAW_TEXTRACT_FORMAT == 'compact':
+        compact_blocks_writer = compact_textract.CompactBlocksWriter()
+        document = TextractDocument(compact_blocks_writer.collect(blocks))
+        s3_client.put_object(Bucket=bucket, Key=get_raw_data_key(filename), Body=compact_blocks_writer.to_bytes(),
+                             ContentType=compact_textract.CONTENT_TYPE)
+    else:
+        # Stream the blocks into a temporary file (in the same format as json.dumps(blocks))
+        # so that only the compact document model is held in memory
+        with tempfile.TemporaryFile() as raw_blocks_file:
+            raw_blocks_file.write(b'[')
+            document = TextractDocument(write_blocks(blocks, raw_blocks_file))
+            raw_blocks_file.write(b']')
+            raw_blocks_file.seek(0)
+
+            # Save the JSON response from Textract to a folder in the S3 bucket
+            s3_client.upload_fileobj(raw_blocks_file, bucket, get_raw_data_key(filename))
+    print(f'Text Extraction Complete for {bucket}/{key}')
+
+    # Recreate the raw text from the Textract Output
+    raw_text = document.text
+
+    cache_key = None
+    if result_cache.RESULT_CACHE_ENABLED:
+        object_head = s3_client.head_object(Bucket=bucket, Key=key)
+        cache_key = get_result_cache_key(parameters, object_head['ETag'], object_head['ContentLength'])
+
+    return start_entity_detection(clients, parameters, bucket, filename, raw_text,
+                                  instrumentation.get_correlation_id(bucket, key), cache_key,
+                                  processed_data.SpanIndex.from_document(document))
+
+
+# Key of the raw Textract output of a document, in the format written by this function
+def get_raw_data_key(filename, raw_textract_format=None):
+    raw_textract_format = raw_textract_format or RAW_TEXTRACT_FORMAT
+    extension = compact_textract.FILE_EXTENSION if raw_textract_format == 'compact' else '.json'
+    return 'textract-output/raw/' + filename + extension
+
+
+# Key of the result cache entry of an uploaded object, None when the result cache is disabled
+def get_result_cache_key(parameters, etag, object_size):
+    if not result_cache.RESULT_CACHE_ENABLED:
+        return None
+    return result_cache.get_cache_key(etag, object_size, parameters['CustomEntityRecognizerARN-TCA2I'])
+
+
+# Reuse the results of a document with the same content that was already processed. Its
+# Textract blocks and processed text are copied to the keys of this document, and its
+# entities are routed like ComprehendA2I routes the results of a job. When the first
+# document is already in a human review, its review also covers this document.
+# Returns: DICTIONARY result of the record
+def process_cached_record(clients, parameters, bucket, filename, cache_entry, correlation_id=None):
+    s3_client = clients['s3']
+    cached_processed_data_key = cache_entry['ProcessedDataKey']
+    cached_filename = human_loops.get_document_name(cached_processed_data_key)
+    instrumentation.log_event('Result Cache Hit', correlation_id, cached_processed_data_key=cached_processed_data_key,
+                              cached_correlation_id=cache_entry['CorrelationId'])
+
+    copy_raw_data(s3_client, bucket, cached_filename, filename)
+
+    # Comprehend has not returned the entities of the first document yet, only Textract is skipped
+    if cache_entry['Entities'] is None:
+        processed_text_object = s3_client.get_object(Bucket=bucket, Key=cached_processed_data_key)
+        raw_text = processed_data.decode(processed_text_object['Body'].read(), processed_text_object.get('Metadata'))
+        return start_entity_detection(clients, parameters, bucket, filename, raw_text, correlation_id,
+                                      span_index=processed_data.get_span_index(s3_client, bucket,
+                                                                               cached_processed_data_key))
+
+    # The copy keeps the text format of the cached processed text, and its span index
+    processed_data_key = 'textract-output/processed/' + filename + '.txt'
+    cached_metadata = s3_client.head_object(Bucket=bucket, Key=cached_processed_data_key).get('Metadata', {})
+    metadata = {key: value for key, value in cached_metadata.items()
+                if key == processed_data.TEXT_FORMAT_METADATA_KEY}
+    if correlation_id:
+        metadata[instrumentation.CORRELATION_ID_METADATA_KEY] = correlation_id
+    s3_client.copy_object(CopySource={'Bucket': bucket, 'Key': cached_processed_data_key},
+                          Bucket=bucket, Key=processed_data_key, MetadataDirective='REPLACE', Metadata=metadata)
+    processed_data.copy_span_index(s3_client, bucket, cached_processed_data_key, processed_data_key)
+
+    if cache_entry['HumanLoopName']:
+        instrumentation.log_event('Human Loop Shared with a Duplicate Document', correlation_id,
+                                  human_loop_name=cache_entry['HumanLoopName'])
+        return {'status': 'SUCCEEDED', 'duplicate_of': cache_entry['HumanLoopName']}
+
+    processed_text = s3_client.get_object(Bucket=bucket, Key=processed_data_key)['Body'].read().decode('utf-8')
+    route = human_loops.route_document(s3_client, clients['human_loop_submitter'], bucket, processed_data_key,
+                                       processed_text, cache_entry['Entities'],
+                                       human_loops.ReviewPolicy.from_environment(), correlation_id)
+    if route == 'HUMAN_LOOP':
+        return {'status': 'SUCCEEDED', 'human_loop_name': human_loops.get_human_loop_name(processed_data_key,
+                                                                                          processed_text)}
+    return {'status': 'SUCCEEDED'}
+
+
+# Copy the raw Textract output of a document to another document, in the format it was written in
+def copy_raw_data(s3_client, bucket, source_filename, filename):
+    raw_textract_formats = [RAW_TEXTRACT_FORMAT] + [raw_textract_format for raw_textract_format in ('compact', 'json')
+                                                    if raw_textract_format != RAW_TEXTRACT_FORMAT]
+    for raw_textract_format in raw_textract_formats:
+        try:
+            return s3_client.copy_object(
+                CopySource={'Bucket': bucket, 'Key': get_raw_data_key(source_filename, raw_textract_format)},
+                Bucket=bucket, Key=get_raw_data_key(filename, raw_textract_format))
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound') \
+                    or raw_textract_format == raw_textract_formats[-1]:
+                raise
+
+
+# Generator over the blocks of an asynchronous text detection job, following NextToken
+def iter_text_detection_blocks(textract_client, job_id):
+    request = {'JobId': job_id, 'MaxResults': 1000}
+    while True:
+        response = textract_client.get_document_text_detection(**request)
+        for block in response['Blocks']:
+            yield block
+
+        if 'NextToken' not in response:
+            return
+        request['NextToken'] = response['NextToken']
+
+
+# Write each block to a file object as a JSON list item while passing it on
+def write_blocks(blocks, file_object):
+    for block_number, block in enumerate(blocks):
+        if block_number > 0:
+            file_object.write(b', ')
+        file_object.write(json.dumps(block).encode('utf-8'))
+        yield block
+
+
+# Decide between the synchronous and the asynchronous Textract API
+# Returns: BOOLEAN
+def uses_async_text_detection(key, object_size):
+    return key.split('.')[-1].lower() in ASYNC_TEXTRACT_FILE_EXTENSIONS or object_size > SYNC_TEXTRACT_MAX_BYTES
+
+
+# Decide whether the pages of an asynchronous document are detected in parallel by this function
+# Returns: BOOLEAN
+def uses_page_parallel_text_detection(key, object_size):
+    return (PAGE_PARALLEL_TEXTRACT and object_size <= PAGE_PARALLEL_MAX_BYTES
+            and textract_pages.can_split_pages(key.split('.')[-1]))
+
+
+# Get just the filename of an input object key (without input/ or trailing filetype)
+def get_filename(key):
+    filename = ".".join(key.split(".")[:-1])
+    return "/".join(filename.split("/")[1:])
+
+
+# Store the text recreated from the Textract output (and the span index of its blocks)
+# and start the Custom Entity Recognition Job on it.
+# With a cache_key, the document is added to the result cache.
+# Returns: DICTIONARY result of the record
+def start_entity_detection(clients, parameters, bucket, filename, raw_text, correlation_id=None, cache_key=None,
+                           span_index=None):
+    s3_client = clients['s3']
+    comprehend_client = clients['comprehend']
+
+    customer_recognizer_arn = parameters['CustomEntityRecognizerARN-TCA2I']
+    comprehend_execution_role_arn = parameters['ComprehendExecutionRole-TCA2I']
+    comprehend_output_bucket = parameters['ComprehendTemporaryDataStoreBucketName-TCA2I']
+
+    # Store it in an S3 bucket
+    processed_data_key = 'textract-output/processed/' + filename + '.txt'
+
+    # Store Processed Data in S3 Bucket, with the correlation id the later stages log
+    # and the key of the result cache entry ComprehendA2I adds the entities to
+    # The text is stored as plain text, so that entity offsets are offsets in the recreated text
+    metadata = processed_data.get_metadata()
+    if correlation_id:
+        metadata[instrumentation.CORRELATION_ID_METADATA_KEY] = correlation_id
+    if cache_key:
+        metadata[result_cache.CACHE_KEY_METADATA_KEY] = cache_key
+    processed_text = raw_text
+    processed_textract_data_response = s3_client.put_object(
+        Bucket=bucket,
+        Key=processed_data_key,
+        Body=processed_text,
+        Metadata=metadata
+    )
+    if span_index is not None:
+        processed_data.put_span_index(s3_client, bucket, processed_data_key, span_index)
+
+    # Entities of the entity list found in the text, the jobs' results get them in ComprehendA2I
+    uses_realtime_endpoint = uses_realtime_entity_detection(parameters, raw_text)
+    gazetteer_entities = None
+    if gazetteer.GAZETTEER_SKIP_COMPREHEND or uses_realtime_endpoint:
+        gazetteer_entities = gazetteer.find_known_entities(s3_client, parameters['CustomEntityTrainingListS3URI-TCA2I'],
+                                                           customer_recognizer_arn, processed_text)
+
+    # Documents whose known entities alone satisfy the review policy skip Comprehend and the human review
+    review_policy = human_loops.ReviewPolicy.from_environment()
+    if (gazetteer.GAZETTEER_SKIP_COMPREHEND and gazetteer_entities is not None
+            and not review_policy.requires_review(gazetteer_entities)):
+        gazetteer_entities = processed_data.annotate_entities(span_index, gazetteer_entities)
+        human_loops.route_document(s3_client, clients['human_loop_submitter'], bucket, processed_data_key,
+                                   processed_text, gazetteer_entities, review_policy, correlation_id)
+        if cache_key:
+            result_cache.put_entry(s3_client, bucket, cache_key, processed_data_key, correlation_id,
+                                   gazetteer_entities)
+        return {'status': 'SUCCEEDED'}
+
+    # Small documents are sent to the real-time endpoint and straight to the human review
+    if uses_realtime_endpoint:
+        human_loop_name = start_realtime_entity_detection(clients, parameters, bucket, processed_data_key,
+                                                          processed_text, correlation_id, cache_key,
+                                                          gazetteer_entities, span_index)
+        return {'status': 'SUCCEEDED', 'human_loop_name': human_loop_name}
+
+    # Re-uploads of the document reuse its Textract results while its entities are detected
+    if cache_key:
+        result_cache.put_entry(s3_client, bucket, cache_key, processed_data_key, correlation_id)
+
+    # In batch mode the document waits for the next Custom Entity Recognition Job on its batch
+    if 'batcher' in clients:
+        clients['batcher'].add(filename, processed_data_key, processed_text, correlation_id)
+        instrumentation.log_event('Document Queued for Custom Entity Detection', correlation_id,
+                                  processed_data_key=processed_data_key)
+        return {'status': 'SUCCEEDED'}
+
+    # Start the Custom Entity Recognition Job
+    response = comprehend_client.start_entities_detection_job(
+        InputDataConfig={
+            'S3Uri': 's3://' + bucket + '/' + processed_data_key,
+            'InputFormat': 'ONE_DOC_PER_FILE'
+        },
+        OutputDataConfig={
+            'S3Uri': 's3://' + comprehend_output_bucket + '/comprehend-output/raw/'
+        },
+        DataAccessRoleArn=comprehend_execution_role_arn,
+        JobName=get_job_name(filename, correlation_id),
+        EntityRecognizerArn=customer_recognizer_arn,
+        LanguageCode='en',
+        ClientRequestToken=get_client_request_token(bucket, processed_data_key, customer_recognizer_arn,
+                                                    processed_text)
+    )
+
+    instrumentation.log_event('Custom Entity Detection Job Started', correlation_id,
+                              processed_data_key=processed_data_key, comprehend_job_id=response['JobId'])
+    return {'status': 'SUCCEEDED'}
+
+
+# Name of the Custom Entity Recognition Job of a single document, ending with its correlation id
+def get_job_name(filename, correlation_id=None):
+    job_name = re.sub(r'\W+', '', filename)[:150] + '-TextractComprehendA2I'
+    return job_name + '-' + correlation_id if correlation_id else job_name
+
+
+# Idempotency token of the Custom Entity Recognition Job of a document: a retried event that
+# reprocesses a document already sent to Comprehend gets the job started the first time
+def get_client_request_token(bucket, processed_data_key, recognizer_arn, processed_text):
+    digest = hashlib.sha256('\n'.join([bucket, processed_data_key, recognizer_arn]).encode('utf-8'))
+    digest.update(processed_text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+# Decide between the real-time endpoint and an asynchronous Custom Entity Recognition Job
+# Returns: BOOLEAN
+def uses_realtime_entity_detection(parameters, raw_text):
+    endpoint_arn = parameters.get('CustomEntityRecognizerEndpointARN-TCA2I', 'NotActive')
+    return endpoint_arn != 'NotActive' and len(raw_text) <= REALTIME_MAX_TEXT_LENGTH
+
+
+# Detect the custom entities with the real-time endpoint and start the Human Loop with them
+# the same way ComprehendA2I does for the results of an asynchronous job
+# Returns: STRING name of the submitted Human Loop, or None if the document was auto-accepted
+def start_realtime_entity_detection(clients, parameters, bucket, processed_data_key, processed_text,
+                                    correlation_id=None, cache_key=None, gazetteer_entities=None, span_index=None):
+    def detect_entities(text):
+        return clients['comprehend'].detect_entities(
+            Text=text,
+            EndpointArn=parameters['CustomEntityRecognizerEndpointARN-TCA2I']
+        )['Entities']
+
+    # Long texts are detected in windows, their entities have offsets in the whole processed text
+    windows = text_chunking.split_into_windows(processed_text, REALTIME_WINDOW_LENGTH, REALTIME_WINDOW_OVERLAP)
+    if len(windows) == 1:
+        entities = detect_entities(processed_text)
+    else:
+        entities = text_chunking.detect_entities_in_windows(detect_entities, processed_text, windows,
+                                                            REALTIME_WINDOW_CONCURRENCY)
+    print(f"Custom Entity Detection Complete on Real-time Endpoint ({len(windows)} windows)")
+
+    if gazetteer_entities:
+        entities = gazetteer.merge_entities(entities, gazetteer_entities)
+    entities = processed_data.annotate_entities(span_index, entities)
+
+    route = human_loops.route_document(clients['s3'], clients['human_loop_submitter'], bucket, processed_data_key,
+                                       processed_text, entities,
+                                       human_loops.ReviewPolicy.from_environment(), correlation_id)
+    human_loop_name = None
+    if route == 'HUMAN_LOOP':
+        human_loop_name = human_loops.get_human_loop_name(processed_data_key, processed_text)
 
-        print("Custom Entity Detection Job Started")
-    return 0
+    if cache_key:
+        result_cache.put_entry(clients['s3'], bucket, cache_key, processed_data_key, correlation_id, entities,
+                               human_loop_name)
+    return human_loop_name
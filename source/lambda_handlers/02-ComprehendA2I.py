@@ -23,92 +23,250 @@
 # SOFTWARE.
 
 from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor, wait
+import collections
 import json
+import os
 import tarfile
-import boto3
-from io import BytesIO
-import time
+import tca2i_config
+import comprehend_batching
+import gazetteer
+import human_loops
+import instrumentation
+import processed_data
+import result_cache
 
+# Keep a copy of the extracted Comprehend results in the primary bucket. The copy
+# is written in the background and is not read back by this function.
+ARCHIVE_COMPREHEND_RESULTS = os.environ.get('ARCHIVE_COMPREHEND_RESULTS', 'true').lower() == 'true'
 
-def lambda_handler(event, context):
-    # Create an SSM Client
-    ssm_client = boto3.client('ssm')
+# Archived results that outgrow one part of this many bytes are written with a multipart
+# upload, so that at most ARCHIVE_MAX_PENDING_PARTS + 1 parts are held in memory. Every
+# part but the last one of a multipart upload must be at least 5 MiB
+ARCHIVE_PART_SIZE = max(5 * 1024 * 1024, int(os.environ.get('ARCHIVE_PART_SIZE', str(8 * 1024 * 1024))))
+ARCHIVE_MAX_PENDING_PARTS = 2
+
+# Background writer for the archived results, reused by warm invocations
+archive_executor = ThreadPoolExecutor(max_workers=2)
 
-    # Create an A2I Client
-    a2i_client = boto3.client('sagemaker-a2i-runtime')
 
-    # Get parameters from SSM
-    comprehend_parameters = ssm_client.get_parameters(Names=['FlowDefARN-TCA2I',
-                                                             'S3BucketName-TCA2I'], WithDecryption=True)
+@instrumentation.instrumented('ComprehendA2I')
+def lambda_handler(event, context):
+    # Create an A2I Client
+    a2i_client = instrumentation.client('sagemaker-a2i-runtime')
 
-    for parameter in comprehend_parameters['Parameters']:
-        if parameter['Name'] == 'FlowDefARN-TCA2I':
-            hrw_arn = parameter['Value']
-        elif parameter['Name'] == 'S3BucketName-TCA2I':
-            primary_s3_bucket = parameter['Value']
+    # Get parameters from SSM (cached across warm invocations)
+    comprehend_parameters = tca2i_config.get_parameters(['FlowDefARN-TCA2I', 'S3BucketName-TCA2I',
+                                                         'CustomEntityRecognizerARN-TCA2I',
+                                                         'CustomEntityTrainingListS3URI-TCA2I'])
 
     # Create an S3 Client
-    s3_client = boto3.client('s3')
+    s3_client = instrumentation.client('s3')
+
+    # Human Loops are started concurrently, rate limited and named after their document
+    human_loop_submitter = human_loops.HumanLoopSubmitter(a2i_client, comprehend_parameters['FlowDefARN-TCA2I'])
+
+    clients = {'s3': s3_client, 'a2i': a2i_client, 'human_loop_submitter': human_loop_submitter}
+
+    # Decides which documents are uncertain enough to need a human review
+    review_policy = human_loops.ReviewPolicy.from_environment()
+
+    # Number of documents sent to a human review (HUMAN_LOOP) or accepted without one (AUTO_ACCEPTED)
+    routing_counts = collections.Counter()
+
+    # Iterate over all the Comprehend output objects that have been passed to this lambda function
+    try:
+        for record in event['Records']:
+            process_comprehend_output(record, clients, comprehend_parameters, review_policy, routing_counts)
+    finally:
+        submission_results = human_loop_submitter.wait()
+        human_loop_submitter.shutdown()
+
+    submission_counts = collections.Counter(result['Status'] for result in submission_results)
+    print(f"Started {submission_counts['STARTED']} human loops, "
+          f"skipped {submission_counts['DUPLICATE']} duplicate human loops, "
+          f"avoided {routing_counts['AUTO_ACCEPTED']} human loops")
+
+    # Failing the invocation lets the event be delivered again, the human loops
+    # that were already started are then recognised as duplicates
+    if submission_counts['FAILED']:
+        raise RuntimeError(f"Failed to start {submission_counts['FAILED']} human loops")
+
+    return {'human_loops_started': submission_counts['STARTED'],
+            'human_loops_duplicate': submission_counts['DUPLICATE'],
+            'human_loops_avoided': routing_counts['AUTO_ACCEPTED']}
+
+
+# Route every document of one Comprehend output archive
+def process_comprehend_output(record, clients, parameters, review_policy, routing_counts):
+    s3_client = clients['s3']
+    primary_s3_bucket = parameters['S3BucketName-TCA2I']
 
     # Get details of the object that was just created by Comprehend
-    bucket = event['Records'][0]['s3']['bucket']['name']
-    key = event['Records'][0]['s3']['object']['key']
+    bucket = record['s3']['bucket']['name']
+    key = record['s3']['object']['key']
 
     # Get the unique name for this file
     extracted_file_key = 'comprehend-output/raw/' + key.split("/")[2] + "-" + "results"
 
-    # Load the .tar.gz file that generated from Comprehend Custom Entity Recognition
+    # Outputs of batched jobs have one result line per document of the batch,
+    # the batch manifest maps each file back to the document it came from
+    batch_id = comprehend_batching.get_batch_id(key)
+    manifest = comprehend_batching.load_manifest(s3_client, primary_s3_bucket, batch_id) if batch_id else None
+
+    # Stream the .tar.gz file that generated from Comprehend Custom Entity Recognition
+    # straight from the response body, one result line at a time
     input_tar_file = s3_client.get_object(Bucket=bucket, Key=key)
-    input_tar_content = input_tar_file['Body'].read()
+    archive_writers = []
 
-    # Extract the file and save the contents in the primary bucket
-    with tarfile.open(fileobj=BytesIO(input_tar_content)) as tar:
+    with tarfile.open(fileobj=input_tar_file['Body'], mode='r|gz') as tar:
         for tar_resource in tar:
-            if (tar_resource.isfile()):
-                inner_file_bytes = tar.extractfile(tar_resource).read()
-                s3_client.upload_fileobj(BytesIO(inner_file_bytes), Bucket=primary_s3_bucket, Key=extracted_file_key)
+            if not tar_resource.isfile():
+                continue
+
+            archive_writer = ArchiveWriter(s3_client, primary_s3_bucket, extracted_file_key) \
+                if ARCHIVE_COMPREHEND_RESULTS else None
+            for result_line in tar.extractfile(tar_resource):
+                if archive_writer is not None:
+                    archive_writer.write(result_line)
+                if not result_line.strip():
+                    continue
 
-    # Load the results generated by comprehend from the Primary Data Source Bucket
-    custom_entities_file = s3_client.get_object(Bucket=primary_s3_bucket, Key=extracted_file_key)
-    custom_entities_recognition_results = json.loads(custom_entities_file['Body'].read())
+                route = process_result_line(clients, parameters, manifest, review_policy,
+                                            json.loads(result_line.decode('utf-8')))
+                routing_counts[route] += 1
+
+            if archive_writer is not None:
+                archive_writer.close()
+                archive_writers.append(archive_writer)
+
+    # The archive copies are not needed by the human loops, but have to finish
+    # before the function returns and the container is frozen
+    for archive_writer in archive_writers:
+        try:
+            archive_writer.wait()
+        except Exception as e:
+            print(f'Failed to archive the Comprehend results to {extracted_file_key}: {e!r}')
+
+
+# Background copy of one extracted Comprehend results file. A file that fits in one
+# part is written with a single PutObject, a larger one part by part. A failure only
+# stops the copy and is raised by wait(), the results are still routed.
+class ArchiveWriter:
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.buffer = []
+        self.buffered_bytes = 0
+        self.upload_id = None
+        # Futures of the PutObject call, or of the UploadPart calls in part number order
+        self.writes = []
+        self.error = None
+
+    def write(self, data):
+        if self.error is not None:
+            return
+        self.buffer.append(data)
+        self.buffered_bytes += len(data)
+        if self.buffered_bytes >= ARCHIVE_PART_SIZE:
+            self._upload_part()
+
+    # Send the rest of the file, without waiting for it to be written
+    def close(self):
+        if self.error is not None:
+            return
+        if self.upload_id is None:
+            self.writes.append(archive_executor.submit(self.s3_client.put_object, Bucket=self.bucket, Key=self.key,
+                                                       Body=b''.join(self.buffer)))
+            self.buffer = []
+        elif self.buffer:
+            self._upload_part()
+
+    # Wait for the file to be written
+    def wait(self):
+        if self.upload_id is None:
+            if self.error is not None:
+                raise self.error
+            self.writes[0].result()
+            return
+
+        try:
+            if self.error is not None:
+                raise self.error
+            parts = [{'ETag': part_write.result()['ETag'], 'PartNumber': part_number}
+                     for part_number, part_write in enumerate(self.writes, 1)]
+            self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                                                     MultipartUpload={'Parts': parts})
+        except Exception:
+            # Parts of an upload that is not completed are billed until it is aborted
+            wait(self.writes)
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            raise
+
+    def _upload_part(self):
+        try:
+            if self.upload_id is None:
+                self.upload_id = self.s3_client.create_multipart_upload(Bucket=self.bucket,
+                                                                        Key=self.key)['UploadId']
+        except Exception as e:
+            self.error = e
+            self.buffer = []
+            return
+
+        # Only ARCHIVE_MAX_PENDING_PARTS parts are in flight, a failed one is reported by wait()
+        if len(self.writes) >= ARCHIVE_MAX_PENDING_PARTS:
+            wait([self.writes[-ARCHIVE_MAX_PENDING_PARTS]])
+        self.writes.append(archive_executor.submit(self.s3_client.upload_part, Bucket=self.bucket, Key=self.key,
+                                                   UploadId=self.upload_id, PartNumber=len(self.writes) + 1,
+                                                   Body=b''.join(self.buffer)))
+        self.buffer = []
+        self.buffered_bytes = 0
+
+
+# Start the human review for the entity recognition results of one document,
+# or accept them straight away if the review policy allows it
+# Returns: STRING route taken by the document
+def process_result_line(clients, parameters, manifest, review_policy, custom_entities_recognition_results):
+    primary_s3_bucket = parameters['S3BucketName-TCA2I']
 
     # Load the original text extracted using Amazon Textract
     file_identifier = custom_entities_recognition_results['File']
-    textract_results_key = 'textract-output/processed/' + file_identifier
-    text_file_object = s3_client.get_object(Bucket=primary_s3_bucket, Key=textract_results_key)
+    if manifest is not None:
+        textract_results_key = manifest['Documents'][file_identifier]['ProcessedDataKey']
+    else:
+        textract_results_key = 'textract-output/processed/' + file_identifier
+    text_file_object = clients['s3'].get_object(Bucket=primary_s3_bucket, Key=textract_results_key)
     original_text_file = text_file_object['Body'].read().decode("utf-8", 'ignore')
 
-    # Initialize Human Loop Input Object
-    human_loop_input = {}
-    human_loop_input['originalText'] = original_text_file
-
-    # Add list of identified entities
-    human_loop_input['entities'] = custom_entities_recognition_results['Entities']
-
-    # Add a list of types of entities that we need to recognize
-    human_loop_input['labels'] = [{'label': 'device', 'shortDisplayName': 'dvc', 'fullDisplayName': 'Device'}]
-
-    # Create an attribute to mark the entities that have been
-    # already identified to save time for the Human Reviewers
-    existing_entities = []
-    for entity in human_loop_input['entities']:
-        current_entity = {}
-        current_entity['label'] = entity['Type'].lower()
-        current_entity['startOffset'] = entity['BeginOffset']
-        current_entity['endOffset'] = entity['EndOffset']
-        existing_entities.append(current_entity)
-
-    human_loop_input['initialValue'] = existing_entities
-
-    # Create a Human Loop Name
-    human_loop_name = 'TCA2I-' + str(int(round(time.time() * 1000)))
-    print('Starting human loop - ' + human_loop_name)
-    response = a2i_client.start_human_loop(
-        HumanLoopName=human_loop_name,
-        FlowDefinitionArn=hrw_arn,
-        HumanLoopInput={
-            'InputContent': json.dumps(human_loop_input)
-        }
-    )
-
-    return 0
+    # The correlation id is in the batch manifest, or on the processed text itself
+    correlation_id = text_file_object.get('Metadata', {}).get(instrumentation.CORRELATION_ID_METADATA_KEY)
+    if manifest is not None:
+        correlation_id = manifest['Documents'][file_identifier].get('CorrelationId') or correlation_id
+
+    # Exact occurrences of known entities that the recognizer missed are pre-annotated as well
+    entities = custom_entities_recognition_results['Entities']
+    gazetteer_entities = gazetteer.find_known_entities(clients['s3'], parameters['CustomEntityTrainingListS3URI-TCA2I'],
+                                                       parameters['CustomEntityRecognizerARN-TCA2I'],
+                                                       original_text_file)
+    if gazetteer_entities:
+        entities = gazetteer.merge_entities(entities, gazetteer_entities)
+
+    # The reviewers and the accepted results get the page and bounding boxes of every entity
+    span_index = processed_data.get_span_index(clients['s3'], primary_s3_bucket, textract_results_key)
+    entities = processed_data.annotate_entities(span_index, entities)
+
+    route = human_loops.route_document(clients['s3'], clients['human_loop_submitter'], primary_s3_bucket,
+                                       textract_results_key, original_text_file, entities, review_policy,
+                                       correlation_id)
+
+    # Re-uploads of the document can now skip Comprehend and the human review as well
+    cache_key = text_file_object.get('Metadata', {}).get(result_cache.CACHE_KEY_METADATA_KEY)
+    if cache_key:
+        human_loop_name = None
+        if route == 'HUMAN_LOOP':
+            human_loop_name = human_loops.get_human_loop_name(textract_results_key, original_text_file)
+        result_cache.put_entry(clients['s3'], primary_s3_bucket, cache_key, textract_results_key, correlation_id,
+                               entities, human_loop_name)
+    return route
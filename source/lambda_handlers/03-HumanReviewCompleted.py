@@ -22,37 +22,44 @@
 # CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import boto3
 import json
-import csv
 import re
+import tca2i_config
+import entity_store
+import human_reviews
+import instrumentation
 
+
+@instrumentation.instrumented('HumanReviewCompleted')
 def lambda_handler(event, context):
     # Create an S3 Client
-    s3_client = boto3.client('s3')
-
-    # Create an SSM Client
-    ssm_client = boto3.client('ssm')
-
-    # Get parameters from SSM
-    a2i_parameters = ssm_client.get_parameters(Names=['FlowDefARN-TCA2I',
-                                                      'S3BucketName-TCA2I', 'CustomEntityTrainingListS3URI-TCA2I',
-                                                      'CustomEntityTrainingDatasetS3URI-TCA2I'], WithDecryption=True)
-
-    for parameter in a2i_parameters['Parameters']:
-        if parameter['Name'] == 'FlowDefARN-TCA2I':
-            hrw_arn = parameter['Value']
-        elif parameter['Name'] == 'S3BucketName-TCA2I':
-            primary_s3_bucket = parameter['Value']
-        elif parameter['Name'] == 'CustomEntityTrainingListS3URI-TCA2I':
-            custom_entities_file_uri = parameter['Value']
-        elif parameter['Name'] == 'CustomEntityTrainingDatasetS3URI-TCA2I':
-            custom_entities_training_data_file_uri = parameter['Value']
+    s3_client = instrumentation.client('s3')
+
+    # Get parameters from SSM (cached across warm invocations)
+    a2i_parameters = tca2i_config.get_parameters(['FlowDefARN-TCA2I',
+                                                  'S3BucketName-TCA2I', 'CustomEntityTrainingListS3URI-TCA2I',
+                                                  'CustomEntityTrainingDatasetS3URI-TCA2I'])
+
+    hrw_arn = a2i_parameters['FlowDefARN-TCA2I']
+    primary_s3_bucket = a2i_parameters['S3BucketName-TCA2I']
+    custom_entities_file_uri = a2i_parameters['CustomEntityTrainingListS3URI-TCA2I']
+    custom_entities_training_data_file_uri = a2i_parameters['CustomEntityTrainingDatasetS3URI-TCA2I']
+
+    # Scheduled run of the batch mode: process every loop output written since the last batch
+    if event['detail-type'] == 'Scheduled Event':
+        if human_reviews.HUMAN_REVIEW_BATCH_MODE:
+            process_completed_reviews(s3_client, instrumentation.client('sagemaker'), hrw_arn,
+                                      custom_entities_file_uri)
+        else:
+            print("HUMAN_REVIEW_BATCH_MODE is disabled, completed human loops are processed from their events")
+        return 0
 
     s3location = ''
     if event['detail-type'] == 'SageMaker A2I HumanLoop Status Change':
         if event['detail']['flowDefinitionArn'] == hrw_arn:
-            if event['detail']['humanLoopStatus'] == 'Completed':
+            if human_reviews.HUMAN_REVIEW_BATCH_MODE:
+                print("Human loop left to the next batch run")
+            elif event['detail']['humanLoopStatus'] == 'Completed':
                 s3location = event['detail']['humanLoopOutput']['outputS3Uri']
             else:
                 print("HumanLoop did not complete successfully")
@@ -74,8 +81,8 @@ def lambda_handler(event, context):
             'Body'].read()
         a2i_output_file = json.loads(a2i_output_file.decode('utf-8'))
 
-        list_of_annotated_entities = a2i_output_file['humanAnswers'][0]['answerContent']['crowd-entity-annotation'][
-            'entities']
+        # The annotations of all the workers of the loop, consolidated into one answer
+        list_of_annotated_entities = human_reviews.consolidate_annotations(a2i_output_file['humanAnswers'])
 
         # Check if any new custom entities were annotated by the human review
         if len(list_of_annotated_entities) > 0:
@@ -84,81 +91,24 @@ def lambda_handler(event, context):
             input_content = a2i_output_file['inputContent']
             original_text = input_content['originalText']
 
-            # Create lists to hold the entities defined by the human review
-            entity_text = []
-            entity_type = []
-
             # Generate a list of unique entities annotated by Human Reviewer
-            for annotated_entity in list_of_annotated_entities:
-                if original_text[annotated_entity['startOffset']:annotated_entity['endOffset']] not in entity_text:
-                    entity_text.append(original_text[annotated_entity['startOffset']:annotated_entity['endOffset']])
-                    entity_type.append(annotated_entity['label'].upper())
+            annotated_entities = entity_store.get_annotated_entities(original_text, list_of_annotated_entities)
 
-            # Read the updated custom entities file and retrieve its contents
+            # Only the annotations of this review are written, NewEntityCheck compacts
+            # the deltas of all the reviews into the updated custom entities file
             custom_entities_file_uri = custom_entities_file_uri.replace('s3://', '')
             comprehend_data_bucket = custom_entities_file_uri[0:custom_entities_file_uri.index('/')]
-
-            # Entity file that the last Custom Entity Model was trained on
             comprehend_entity_last_trained_file_key = custom_entities_file_uri[
                                                       custom_entities_file_uri.index('/') + 1: len(
                                                           custom_entities_file_uri)]
 
-            # Entity file that contains the latest updates from human reviews
-            temp_comprehend_entity_updated_file_key = custom_entities_file_uri[
-                                                      custom_entities_file_uri.index('/') + 1: len(
-                                                          custom_entities_file_uri)]
-            temp_comprehend_entity_updated_file_key = temp_comprehend_entity_updated_file_key.split('/')
-            temp_comprehend_entity_updated_file_key[-1] = "updated_" + temp_comprehend_entity_updated_file_key[-1]
-            temp_comprehend_entity_updated_file_key = "/".join(temp_comprehend_entity_updated_file_key)
-            comprehend_entity_file_key = temp_comprehend_entity_updated_file_key
-
-            try:
-                custom_entities_file = s3_client.get_object(
-                    Bucket=comprehend_data_bucket,
-                    Key=comprehend_entity_file_key)
-                print("Latest entity file loaded")
-            except:
-                # Copy Object source file decalaration
-                copy_source_object = {'Bucket': comprehend_data_bucket, 'Key': comprehend_entity_last_trained_file_key}
-                # S3 Copy Object operation
-                s3_client.copy_object(CopySource=copy_source_object, Bucket=comprehend_data_bucket,
-                                      Key=comprehend_entity_file_key)
-
-                # Try reading the file again
-                custom_entities_file = s3_client.get_object(
-                    Bucket=comprehend_data_bucket,
-                    Key=comprehend_entity_file_key)
-
-                print("Latest entity file loaded")
-
-            # Read the contents of the updated custom entity file
-            custom_entities_file_content = custom_entities_file['Body'].read().decode('utf-8').splitlines()
-
-            # Remove the entities that were annotated but already exist in the model
-            custom_entities_object = detect_new_entities(custom_entities_file_content, entity_text, entity_type)
-
-            if custom_entities_object['retraining_required']:
-                temp_csv_file = open("/tmp/entities_file.csv", "w+")
-                temp_csv_writer = csv.writer(temp_csv_file)
-                # writing the column names
-                temp_csv_writer.writerow(["Text", "Type"])
-
-                # Writing rows in to the CSV file
-                for index in range(len(custom_entities_object['entity_text'])):
-                    temp_csv_writer.writerow([custom_entities_object['entity_text'][index],
-                                              custom_entities_object['entity_type'][index]
-                                              ])
-                temp_csv_file.close()
-
-                # Create a s3 bucket resource
-                s3 = boto3.resource('s3')
-                comprehend_data_bucket_object = s3.Bucket(comprehend_data_bucket)
-                comprehend_data_bucket_object.upload_file('/tmp/entities_file.csv', comprehend_entity_file_key)
-                print("NewEntityFileUploaded")
-                print("The model will be retrained")
-            else:
-                print("All annotated entities are already present in the training data.")
-
+            correlation_id = input_content.get(instrumentation.CORRELATION_ID_INPUT_KEY)
+            delta_key = entity_store.put_delta(s3_client, comprehend_data_bucket,
+                                               entity_store.get_deltas_prefix(comprehend_entity_last_trained_file_key),
+                                               event['detail']['humanLoopName'], annotated_entities, correlation_id)
+            instrumentation.log_event('Annotated entities written', correlation_id, delta_key=delta_key,
+                                      human_loop_name=event['detail']['humanLoopName'],
+                                      annotated_entities=len(annotated_entities))
 
         else:
             print('No entities were annotated in the human review.')
@@ -166,33 +116,35 @@ def lambda_handler(event, context):
     return 0
 
 
-# Function to detect any new entities that are added and weren't already
-# present in the training data for current model
-def detect_new_entities(custom_entities_content, new_entity_text, new_entity_type):
-    # Loop over each entity to check for its existence in the ones
-    # marked by the human reviewer
-    line_count = 0
-
-    existing_entity_text_list = []
-    existing_entity_type_list = []
-
-    for entity in custom_entities_content:
-        row = str(entity).replace("b'", "").replace("'", "").split(',')
-        if line_count != 0 and len(row) == 2:
-            if row[0] in new_entity_text:
-                index_to_delete = new_entity_text.index(row[0])
-                new_entity_text.pop(index_to_delete)
-                new_entity_type.pop(index_to_delete)
-            existing_entity_text_list.append(row[0])
-            existing_entity_type_list.append(row[1])
-        line_count += 1
-
-    cleaned_values = {}
-    cleaned_values['entity_text'] = existing_entity_text_list + new_entity_text
-    cleaned_values['entity_type'] = existing_entity_type_list + new_entity_type
-    if len(cleaned_values['entity_text']) == (len(custom_entities_content) - 2):
-        cleaned_values['retraining_required'] = False
-    else:
-        cleaned_values['retraining_required'] = True
-
-    return cleaned_values
+# Write the entities annotated in the loop outputs written since the checkpoint as one delta
+def process_completed_reviews(s3_client, sagemaker_client, flow_definition_arn, custom_entities_file_uri):
+    output_bucket, output_prefix = human_reviews.get_output_location(sagemaker_client, flow_definition_arn)
+    comprehend_data_bucket, entity_list_key = custom_entities_file_uri.replace('s3://', '').split('/', 1)
+    checkpoint_key = human_reviews.get_checkpoint_key(entity_list_key)
+
+    checkpoint = human_reviews.ReviewCheckpoint.load(s3_client, comprehend_data_bucket, checkpoint_key)
+    outputs = human_reviews.list_new_outputs(s3_client, output_bucket, output_prefix, checkpoint)
+    if not outputs:
+        print('No human loop completed since the last batch.')
+        return
+
+    output_keys = [output['Key'] for output in outputs]
+    batch_entities = entity_store.EntityStore()
+    for output_key, a2i_output in zip(output_keys, human_reviews.load_outputs(s3_client, output_bucket, output_keys)):
+        annotated_entities = human_reviews.get_review_entities(a2i_output)
+        batch_entities.merge(annotated_entities)
+        instrumentation.log_event('Human review batched',
+                                  a2i_output['inputContent'].get(instrumentation.CORRELATION_ID_INPUT_KEY),
+                                  human_loop_name=a2i_output.get('humanLoopName'),
+                                  workers=len(a2i_output['humanAnswers']), annotated_entities=len(annotated_entities))
+
+    # One delta for the whole batch, written before the checkpoint moves so that a failed run is retried
+    delta_key = None
+    if len(batch_entities):
+        delta_key = entity_store.put_delta(s3_client, comprehend_data_bucket,
+                                           entity_store.get_deltas_prefix(entity_list_key),
+                                           human_reviews.get_batch_delta_name(output_keys), batch_entities)
+    checkpoint.advance(outputs)
+    checkpoint.save(s3_client, comprehend_data_bucket, checkpoint_key)
+    instrumentation.log_event('Annotated entities written', None, delta_key=delta_key, human_loops=len(outputs),
+                              annotated_entities=len(batch_entities))
@@ -23,42 +23,40 @@
 # SOFTWARE.
 
 import json
-import boto3
 import random
+import tca2i_config
+import entity_store
+import training_scheduler
+import training_set
+import instrumentation
 
 
+@instrumentation.instrumented('NewEntityCheck')
 def lambda_handler(event, context):
     # Create an S3 Client
-    s3_client = boto3.client('s3')
+    s3_client = instrumentation.client('s3')
 
     # Create an SSM Client
-    ssm_client = boto3.client('ssm')
+    ssm_client = instrumentation.client('ssm')
 
     # Create a Cloudwatch Events Client
-    events_client = boto3.client('events')
+    events_client = instrumentation.client('events')
 
     # Create a Comprehend Client
-    comprehend_client = boto3.client('comprehend')
-
-    # Get parameters from SSM
-    parameters = ssm_client.get_parameters(Names=['CustomEntityRecognizerARN-TCA2I',
-                                                  'CERTrainingCompletionCheckRuleARN-TCA2I',
-                                                  'CustomEntityTrainingListS3URI-TCA2I',
-                                                  'ComprehendExecutionRole-TCA2I',
-                                                  'CustomEntityTrainingDatasetS3URI-TCA2I'],
-                                           WithDecryption=True)
-
-    for parameter in parameters['Parameters']:
-        if parameter['Name'] == 'CustomEntityRecognizerARN-TCA2I':
-            custom_entity_recognizer = parameter['Value']
-        elif parameter['Name'] == 'CERTrainingCompletionCheckRuleARN-TCA2I':
-            cw_events_rule_for_training_completion_check_lambda = parameter['Value']
-        elif parameter['Name'] == 'CustomEntityTrainingDatasetS3URI-TCA2I':
-            custom_entities_training_data_file_uri = parameter['Value']
-        elif parameter['Name'] == 'CustomEntityTrainingListS3URI-TCA2I':
-            custom_entities_file_uri = parameter['Value']
-        elif parameter['Name'] == 'ComprehendExecutionRole-TCA2I':
-            comprehend_execution_role = parameter['Value']
+    comprehend_client = instrumentation.client('comprehend')
+
+    # Get parameters from SSM (cached across warm invocations)
+    parameters = tca2i_config.get_parameters(['CustomEntityRecognizerARN-TCA2I',
+                                              'CERTrainingCompletionCheckRuleARN-TCA2I',
+                                              'CustomEntityTrainingListS3URI-TCA2I',
+                                              'ComprehendExecutionRole-TCA2I',
+                                              'CustomEntityTrainingDatasetS3URI-TCA2I'])
+
+    custom_entity_recognizer = parameters['CustomEntityRecognizerARN-TCA2I']
+    cw_events_rule_for_training_completion_check_lambda = parameters['CERTrainingCompletionCheckRuleARN-TCA2I']
+    custom_entities_training_data_file_uri = parameters['CustomEntityTrainingDatasetS3URI-TCA2I']
+    custom_entities_file_uri = parameters['CustomEntityTrainingListS3URI-TCA2I']
+    comprehend_execution_role = parameters['ComprehendExecutionRole-TCA2I']
 
     # Read the updated custom entities file and retrieve its contents
     custom_entities_file_uri = custom_entities_file_uri.replace('s3://', '')
@@ -76,28 +74,72 @@ def lambda_handler(event, context):
     temp_comprehend_entity_updated_file_key = "/".join(temp_comprehend_entity_updated_file_key)
     hrw_updated_custom_entities_file_key = temp_comprehend_entity_updated_file_key
 
+    # Human reviews completed since the last run that still have to be compacted into the updated file
+    deltas_prefix = entity_store.get_deltas_prefix(last_trained_custom_entities_file_key)
+    delta_keys = entity_store.list_deltas(s3_client, comprehend_data_bucket, deltas_prefix)
+
+    # Without deltas, the fingerprints (or ETags) of both entity files tell whether anything changed
+    last_trained_custom_entities_head = entity_store.head_entity_list(s3_client, comprehend_data_bucket,
+                                                                      last_trained_custom_entities_file_key)
+    hrw_updated_custom_entities_head = entity_store.head_entity_list(s3_client, comprehend_data_bucket,
+                                                                     hrw_updated_custom_entities_file_key)
+    if not delta_keys and (hrw_updated_custom_entities_head is None or entity_store.is_same_entity_list(
+            last_trained_custom_entities_head, hrw_updated_custom_entities_head)):
+        print("No new entities since the last model retraining")
+        return 0
+
     # Read the Last Custom Entities file the Comprehend Model was training upon
     last_trained_custom_entities_file = s3_client.get_object(
         Bucket=comprehend_data_bucket,
         Key=last_trained_custom_entities_file_key)
-
-    # Read the Last Updated Custom Entities file
-    hrw_updated_custom_entities_file = s3_client.get_object(
-        Bucket=comprehend_data_bucket,
-        Key=hrw_updated_custom_entities_file_key)
+    last_trained_custom_entities = entity_store.EntityStore.from_csv(
+        last_trained_custom_entities_file['Body'].iter_lines())
+
+    # Lists written before fingerprints were introduced get one, so the next runs can skip reading them
+    if last_trained_custom_entities_head['Fingerprint'] is None:
+        entity_store.record_fingerprint(s3_client, comprehend_data_bucket, last_trained_custom_entities_file_key,
+                                        last_trained_custom_entities)
+
+    # Read the Last Updated Custom Entities file, it only exists once a human review has been compacted into it
+    if hrw_updated_custom_entities_head is not None:
+        hrw_updated_custom_entities_file = s3_client.get_object(
+            Bucket=comprehend_data_bucket,
+            Key=hrw_updated_custom_entities_file_key)
+        hrw_updated_custom_entities = entity_store.EntityStore.from_csv(
+            hrw_updated_custom_entities_file['Body'].iter_lines())
+    else:
+        hrw_updated_custom_entities = entity_store.EntityStore(last_trained_custom_entities)
 
     print("Latest entity files loaded")
 
-    # Read the contents of the last custom entity file used for model training
-    last_trained_custom_entities_content = last_trained_custom_entities_file['Body'].read().split(b'\n')
+    # Compact the entities annotated by the human reviews since the last run into the updated file
+    correlation_ids = []
+    if delta_keys:
+        compacted_entities, correlation_ids = entity_store.merge_deltas(s3_client, comprehend_data_bucket, delta_keys,
+                                                                        hrw_updated_custom_entities)
+        entity_store.put_entity_list(s3_client, comprehend_data_bucket, hrw_updated_custom_entities_file_key,
+                                     hrw_updated_custom_entities)
 
-    # Read the contents of the updated custom entity file
-    hrw_updated_custom_entities_content = hrw_updated_custom_entities_file['Body'].read().split(b'\n')
+        # The deltas are only deleted once the updated file has been written, a failed
+        # run leaves them in place and merging them again on the next run is a no-op
+        entity_store.delete_deltas(s3_client, comprehend_data_bucket, delta_keys)
+        print(f"Compacted {len(delta_keys)} entity list deltas, {len(compacted_entities)} new entities")
 
-    if check_for_new_entities(last_trained_custom_entities_content, hrw_updated_custom_entities_content):
+    if check_for_new_entities(last_trained_custom_entities, hrw_updated_custom_entities):
         print("New entities found. Retraining the model")
 
-        entity_types = get_entity_types(hrw_updated_custom_entities_content)
+        entity_types = get_entity_types(hrw_updated_custom_entities)
+
+        # Train on a bounded, deduplicated sample of the dataset that covers the entities of the list
+        training_documents_uri = custom_entities_training_data_file_uri
+        if training_set.TRAINING_SET_ENABLED:
+            training_documents_uri, training_set_report = training_set.build_training_set(
+                s3_client, custom_entities_training_data_file_uri, hrw_updated_custom_entities)
+            training_set.put_report(s3_client, comprehend_data_bucket,
+                                    training_set.get_report_key(last_trained_custom_entities_file_key),
+                                    training_set_report)
+            instrumentation.log_event('Training set built', None, **{
+                key: value for key, value in training_set_report.items() if key != 'EntitiesMissing'})
 
         # Call the Comprehend Create Entity Recognizer API
         custom_entity_recognizer_response = comprehend_client.create_entity_recognizer(
@@ -106,7 +148,7 @@ def lambda_handler(event, context):
             InputDataConfig={
                 "EntityTypes": entity_types,
                 "Documents": {
-                    "S3Uri": custom_entities_training_data_file_uri
+                    "S3Uri": training_documents_uri
                 },
                 "EntityList": {
                     "S3Uri": "s3://" + comprehend_data_bucket + "/" + hrw_updated_custom_entities_file_key
@@ -119,14 +161,24 @@ def lambda_handler(event, context):
         # Extract the ARN of the new Custom Entity Recognizer from the response object
         training_cer_arn = custom_entity_recognizer_response['EntityRecognizerArn']
 
-        # # Code to set the new under-training CER parameter
-        ssm_client.delete_parameter(Name="TrainingCustomEntityRecognizerARN-TCA2I")
-        ssm_client.put_parameter(Name="TrainingCustomEntityRecognizerARN-TCA2I",
-                                 Type="String", Value=training_cer_arn)
+        # Tie the retraining to the documents whose reviews added the new entities
+        for correlation_id in correlation_ids:
+            instrumentation.log_event('Retraining started with annotated entities', correlation_id,
+                                      training_recognizer_arn=training_cer_arn)
 
-        # Enable the Cloudwatch Events Rule that looks for CER Training Completion
-        enable_cw_event_reponse = events_client.enable_rule(
-            Name=cw_events_rule_for_training_completion_check_lambda.split('/')[-1])
+        # # Code to set the new under-training CER parameter
+        tca2i_config.put_parameter(ssm_client, "TrainingCustomEntityRecognizerARN-TCA2I", training_cer_arn)
+
+        # Enable the Cloudwatch Events Rule that looks for CER Training Completion, the first check
+        # is scheduled from the training durations recorded for entity lists of a similar size
+        training_history = training_scheduler.TrainingHistory.load(
+            s3_client, comprehend_data_bucket,
+            training_scheduler.get_history_key(last_trained_custom_entities_file_key))
+        first_check_delay = training_scheduler.get_next_poll_delay(
+            0, training_history.expected_duration(len(hrw_updated_custom_entities)))
+        training_scheduler.schedule_next_check(events_client,
+                                               cw_events_rule_for_training_completion_check_lambda.split('/')[-1],
+                                               first_check_delay)
         print("Enabled Cloudwatch Events Rule to check for completion of Comprehend CER Training Job")
 
     else:
@@ -138,42 +190,8 @@ def lambda_handler(event, context):
 # Function the compares the difference between the two entity lists
 # Returns: BOOLEAN
 def check_for_new_entities(last_trained_custom_entities, hrw_updated_custom_entities):
-    list_of_last_trained_entities = []
-    list_of_hrw_updated_entities = []
-
-    line_count = 0
-    for entity in last_trained_custom_entities:
-        row = str(entity).replace("b'", "").replace("'", "").split(',')
-        if line_count != 0 and len(row) == 2:
-            list_of_last_trained_entities.append(row[0])
-        line_count += 1
-
-    line_count = 0
-    for entity in hrw_updated_custom_entities:
-        row = str(entity).replace("b'", "").replace("'", "").split(',')
-        if line_count != 0 and len(row) == 2:
-            list_of_hrw_updated_entities.append(row[0])
-        line_count += 1
-
-    if len(list(set(list_of_hrw_updated_entities) - set(list_of_last_trained_entities))) == 0:
-        return False
-    else:
-        return True
-    return 0
+    return any(entity not in last_trained_custom_entities for entity in hrw_updated_custom_entities)
 
 
 def get_entity_types(hrw_updated_custom_entities):
-    list_of_hrw_updated_entities = []
-
-    line_count = 0
-    for entity in hrw_updated_custom_entities:
-        row = str(entity).replace("b'", "").replace("'", "").split(',')
-        if line_count != 0 and len(row) == 2:
-            list_of_hrw_updated_entities.append(row[1][:-2].upper())
-        line_count += 1
-
-    response_object = []
-    for i in list(set(list_of_hrw_updated_entities)):
-        response_object.append({"Type": i})
-
-    return response_object
\ No newline at end of file
+    return [{"Type": entity_type} for entity_type in hrw_updated_custom_entities.entity_types()]
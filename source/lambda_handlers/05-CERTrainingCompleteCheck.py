@@ -25,37 +25,47 @@
 import json
 import boto3
 import random
+import tca2i_config
+import entity_store
+import training_scheduler
+import recognizer_lifecycle
+import instrumentation
+import result_cache
 
 
+@instrumentation.instrumented('CERTrainingCompleteCheck')
 def lambda_handler(event, context):
     # Create a Comprehend Client
-    comprehend_client = boto3.client('comprehend')
+    comprehend_client = instrumentation.client('comprehend')
 
     # Create an SSM Client
-    ssm_client = boto3.client('ssm')
+    ssm_client = instrumentation.client('ssm')
 
     # Create an S3 Client
     s3_resource = boto3.resource('s3')
+    s3_client = instrumentation.client('s3')
 
     # Create a CloudWatch Events Client
-    events_client = boto3.client('events')
-
-    # Get the ARN for the Custom Entity Recognizer under training
-    parameters = ssm_client.get_parameters(
-        Names=['TrainingCustomEntityRecognizerARN-TCA2I',
-               'ComprehendExecutionRole-TCA2I', 'CustomEntityTrainingListS3URI-TCA2I',
-               'CERTrainingCompletionCheckRuleARN-TCA2I', 'CustomEntityRecognizerARN-TCA2I'],
-        WithDecryption=True)
-
-    for parameter in parameters['Parameters']:
-        if parameter['Name'] == 'TrainingCustomEntityRecognizerARN-TCA2I':
-            training_cer_arn = parameter['Value']
-        if parameter['Name'] == 'CustomEntityTrainingListS3URI-TCA2I':
-            custom_entity_training_list_s3_uri = parameter['Value']
-        if parameter['Name'] == 'CERTrainingCompletionCheckRuleARN-TCA2I':
-            cw_events_rule_for_this_fn = parameter['Value']
-        if parameter['Name'] == 'CustomEntityRecognizerARN-TCA2I':
-            original_custom_entity_recognizer_arn = parameter['Value']
+    events_client = instrumentation.client('events')
+
+    # Get the ARN for the Custom Entity Recognizer under training (cached across warm invocations). The
+    # recognizer ARNs are written by other functions, so they are always read from SSM
+    tca2i_config.parameter_cache.invalidate('TrainingCustomEntityRecognizerARN-TCA2I')
+    tca2i_config.parameter_cache.invalidate('CustomEntityRecognizerARN-TCA2I')
+    parameters = tca2i_config.get_parameters(
+        ['TrainingCustomEntityRecognizerARN-TCA2I',
+         'ComprehendExecutionRole-TCA2I', 'CustomEntityTrainingListS3URI-TCA2I',
+         'CERTrainingCompletionCheckRuleARN-TCA2I', 'CustomEntityRecognizerARN-TCA2I', 'S3BucketName-TCA2I'])
+
+    training_cer_arn = parameters['TrainingCustomEntityRecognizerARN-TCA2I']
+    custom_entity_training_list_s3_uri = parameters['CustomEntityTrainingListS3URI-TCA2I']
+    cw_events_rule_for_this_fn = parameters['CERTrainingCompletionCheckRuleARN-TCA2I']
+    original_custom_entity_recognizer_arn = parameters['CustomEntityRecognizerARN-TCA2I']
+
+    # Without a training in progress, this function only runs until the retired recognizers have drained
+    if training_cer_arn == 'NotActive':
+        finish_checks(ssm_client, comprehend_client, events_client, cw_events_rule_for_this_fn)
+        return 0
 
     # Check Status of the comprehend custom entity Recognizer
     custom_entity_recognizer_description = comprehend_client.describe_entity_recognizer(
@@ -64,15 +74,18 @@ def lambda_handler(event, context):
 
     if custom_entity_recognizer_description['EntityRecognizerProperties']['Status'] == 'TRAINING':
         print("Amazon Comprehend Custom Entity Recognizer is still training")
+        schedule_next_check(s3_client, events_client, cw_events_rule_for_this_fn, custom_entity_training_list_s3_uri,
+                            custom_entity_recognizer_description['EntityRecognizerProperties'])
 
     elif custom_entity_recognizer_description['EntityRecognizerProperties']['Status'] == 'SUBMITTED':
         print("Amazon Comprehend Custom Entity Recognizer training task has been submitted.")
+        schedule_next_check(s3_client, events_client, cw_events_rule_for_this_fn, custom_entity_training_list_s3_uri,
+                            custom_entity_recognizer_description['EntityRecognizerProperties'])
 
     elif custom_entity_recognizer_description['EntityRecognizerProperties']['Status'] == 'IN_ERROR':
 
         # # Reset the SSM Parameter that contains the ARN for the new CER
-        ssm_client.delete_parameter(Name="TrainingCustomEntityRecognizerARN-TCA2I")
-        ssm_client.put_parameter(Name="TrainingCustomEntityRecognizerARN-TCA2I", Type="String", Value="NotActive")
+        tca2i_config.put_parameter(ssm_client, "TrainingCustomEntityRecognizerARN-TCA2I", "NotActive")
         print("Reset Complete for SSM parameter storing training job Arn")
 
         # Move the Entity List file that caused the error for later analysis
@@ -95,14 +108,11 @@ def lambda_handler(event, context):
         )
         print("Deleted Errored Custom Entity Recognizer")
 
-        # Disable the Cloudwatch Events Rule for this function
-        disable_cw_event_reponse = events_client.disable_rule(Name=cw_events_rule_for_this_fn.split('/')[-1])
-        print("Disabled Cloudwatch Events Rule to check for completion of Comprehend CER Training Job")
+        finish_checks(ssm_client, comprehend_client, events_client, cw_events_rule_for_this_fn)
 
     elif custom_entity_recognizer_description['EntityRecognizerProperties']['Status'] == 'TRAINED':
         # # Reset the SSM Parameter that contains the ARN for the new CER
-        ssm_client.delete_parameter(Name="TrainingCustomEntityRecognizerARN-TCA2I")
-        ssm_client.put_parameter(Name="TrainingCustomEntityRecognizerARN-TCA2I", Type="String", Value="NotActive")
+        tca2i_config.put_parameter(ssm_client, "TrainingCustomEntityRecognizerARN-TCA2I", "NotActive")
         print("Reset Complete for SSM parameter storing training job Arn")
 
         # Move the Entity List file that caused the error for later analysis
@@ -118,24 +128,24 @@ def lambda_handler(event, context):
         dest.copy(source_entity_list_object, original_entity_list_object['Key'])
         print("Moved the entity list file as the new default for CER Entity List")
 
-        # # Replace the SSM Parameter that contains the ARN for the CER used in TextractComprehend Lambda
-        ssm_client.delete_parameter(Name="CustomEntityRecognizerARN-TCA2I")
-        ssm_client.put_parameter(Name="CustomEntityRecognizerARN-TCA2I",
-                                 Type="String",
-                                 Value=custom_entity_recognizer_description['EntityRecognizerProperties'][
-                                     'EntityRecognizerArn'])
-        print("Reset Complete for SSM parameter storing training job Arn")
+        # # Overwrite the SSM Parameter that contains the ARN for the CER used in TextractComprehend Lambda
+        new_custom_entity_recognizer_arn = custom_entity_recognizer_description['EntityRecognizerProperties'][
+            'EntityRecognizerArn']
+        recognizer_lifecycle.promote_recognizer(ssm_client, new_custom_entity_recognizer_arn,
+                                                original_custom_entity_recognizer_arn)
         print("Updated the CER Arn SSM Parameter")
+        print("Retired the Previous Custom Entity Recognizer, it is deleted once its jobs have drained")
 
-        # Delete the Previous Custom Entity Recognizer
-        custom_entity_recognizer_description = comprehend_client.delete_entity_recognizer(
-            EntityRecognizerArn=original_custom_entity_recognizer_arn
-        )
-        print("Deleted Previous Custom Entity Recognizer")
+        # Record how long the training took, to schedule the checks of the next trainings
+        record_training_duration(s3_client, custom_entity_training_list_s3_uri,
+                                 custom_entity_recognizer_description['EntityRecognizerProperties'])
 
-        # Disable the Cloudwatch Events Rule that triggers this Lambda Function
-        disable_cw_event_reponse = events_client.disable_rule(Name=cw_events_rule_for_this_fn.split('/')[-1])
-        print("Disabled Cloudwatch Events Rule to check for completion of Comprehend CER Training Job")
+        # The cached entities were detected by the previous recognizer
+        evicted_entries = result_cache.evict_stale_entries(s3_client, parameters['S3BucketName-TCA2I'],
+                                                           new_custom_entity_recognizer_arn)
+        print(f"Evicted {evicted_entries} result cache entries of the previous Custom Entity Recognizers")
+
+        finish_checks(ssm_client, comprehend_client, events_client, cw_events_rule_for_this_fn)
 
     else:
         print(custom_entity_recognizer_description)
@@ -143,6 +153,56 @@ def lambda_handler(event, context):
     return 0
 
 
+# Delete the retired recognizers that have drained, then disable the CloudWatch Events Rule
+# that triggers this function, or keep it running until the remaining ones have drained
+def finish_checks(ssm_client, comprehend_client, events_client, cw_events_rule_for_this_fn):
+    retired_recognizers = recognizer_lifecycle.drain_retired_recognizers(ssm_client, comprehend_client)
+    if retired_recognizers:
+        training_scheduler.schedule_next_check(events_client, cw_events_rule_for_this_fn.split('/')[-1],
+                                               recognizer_lifecycle.RETIRED_RECOGNIZER_DRAIN_POLL_SECONDS)
+        return
+
+    # Disable the Cloudwatch Events Rule that triggers this Lambda Function
+    disable_cw_event_reponse = events_client.disable_rule(Name=cw_events_rule_for_this_fn.split('/')[-1])
+    print("Disabled Cloudwatch Events Rule to check for completion of Comprehend CER Training Job")
+
+
+# Number of entities of the updated entity list the recognizer is trained on, None if it was not recorded
+def get_training_entity_count(s3_client, entity_list_object):
+    entity_list_head = entity_store.head_entity_list(s3_client, entity_list_object['Bucket'],
+                                                     prepend_to_s3_file_name(entity_list_object['Key'], "updated"))
+    return entity_list_head['EntityCount'] if entity_list_head is not None else None
+
+
+# Move the CloudWatch Events Rule of this function to the next check of the backoff
+# curve, based on the training durations recorded for entity lists of a similar size
+def schedule_next_check(s3_client, events_client, cw_events_rule_for_this_fn, custom_entity_training_list_s3_uri,
+                        recognizer_properties):
+    entity_list_object = get_s3_bucket_and_key(custom_entity_training_list_s3_uri)
+    training_history = training_scheduler.TrainingHistory.load(
+        s3_client, entity_list_object['Bucket'], training_scheduler.get_history_key(entity_list_object['Key']))
+
+    expected_seconds = training_history.expected_duration(get_training_entity_count(s3_client, entity_list_object))
+    next_check_delay = training_scheduler.get_next_poll_delay(
+        training_scheduler.get_elapsed_seconds(recognizer_properties), expected_seconds)
+    training_scheduler.schedule_next_check(events_client, cw_events_rule_for_this_fn.split('/')[-1], next_check_delay)
+
+
+# Add the duration of a completed training to the training history
+def record_training_duration(s3_client, custom_entity_training_list_s3_uri, recognizer_properties):
+    entity_list_object = get_s3_bucket_and_key(custom_entity_training_list_s3_uri)
+    history_key = training_scheduler.get_history_key(entity_list_object['Key'])
+    try:
+        training_history = training_scheduler.TrainingHistory.load(s3_client, entity_list_object['Bucket'],
+                                                                   history_key)
+        training_history.record(get_training_entity_count(s3_client, entity_list_object),
+                                training_scheduler.get_training_seconds(recognizer_properties))
+        training_history.save(s3_client, entity_list_object['Bucket'], history_key)
+    except Exception as e:
+        # The new recognizer is already in use, only the scheduling of the next trainings is affected
+        print(f"Failed to record the training duration: {e!r}")
+
+
 # Generate the Update Entity List's file name as defined in
 # ComprehendA2I Lambda Function
 def get_s3_bucket_and_key(original_entity_list_s3_uri):
@@ -0,0 +1,105 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Shared call budgets for the Textract and Comprehend quotas.
+#
+# Every call that TextractComprehend makes to a throttled API takes a token
+# from the budget of that API first. The quota of an API (calls per second
+# for the whole stack) is split evenly between the containers that the
+# ingestion queue lets run at the same time (INGESTION_MAX_CONCURRENCY), so
+# that together they stay at the quota instead of going over it and being
+# throttled. A call that cannot get a token within BUDGET_WAIT_SECONDS raises
+# BudgetExhausted: the document goes back to the queue instead of waiting out
+# the invocation, which is the backpressure of the ingestion stage.
+
+import functools
+import os
+
+from rate_limiting import TokenBucket, call_with_backoff
+
+# Number of containers of TextractComprehend that process the ingestion queue at the same time
+INGESTION_MAX_CONCURRENCY = int(os.environ.get('INGESTION_MAX_CONCURRENCY', '5'))
+
+# Maximum number of seconds a call waits for a token of its budget
+BUDGET_WAIT_SECONDS = float(os.environ.get('BUDGET_WAIT_SECONDS', '10'))
+
+# 'service.Operation' -> (environment variable, default) of its quota in calls per second for the whole stack
+API_QUOTAS = {
+    'textract.DetectDocumentText': ('TEXTRACT_DETECT_DOCUMENT_TEXT_TPS', '10'),
+    'textract.StartDocumentTextDetection': ('TEXTRACT_START_DOCUMENT_TEXT_DETECTION_TPS', '10'),
+    'textract.GetDocumentTextDetection': ('TEXTRACT_GET_DOCUMENT_TEXT_DETECTION_TPS', '10'),
+    'comprehend.DetectEntities': ('COMPREHEND_DETECT_ENTITIES_TPS', '10'),
+    'comprehend.StartEntitiesDetectionJob': ('COMPREHEND_START_ENTITIES_DETECTION_JOB_TPS', '1'),
+}
+
+
+class BudgetExhausted(Exception):
+
+    def __init__(self, operation, wait_seconds):
+        super().__init__(f'No {operation} call budget left after waiting {wait_seconds}s')
+        self.operation = operation
+
+
+# Returns: TokenBucket holding this container's share of the quota of an API
+def create_budget(quota, concurrency=INGESTION_MAX_CONCURRENCY):
+    rate = float(quota) / max(1, concurrency)
+    return TokenBucket(rate, max(1.0, rate))
+
+
+# Shared by every invocation (and every thread) served by this container
+budgets = {operation: create_budget(os.environ.get(variable, default))
+           for operation, (variable, default) in API_QUOTAS.items()}
+
+
+# Proxy around a (boto3 or instrumented) client whose calls to the APIs of
+# budgets take a token first and are retried with backoff while throttled
+class BudgetedClient:
+
+    def __init__(self, client, service_name, wait_seconds=BUDGET_WAIT_SECONDS, budgets_by_operation=None):
+        self._client = client
+        self._service_name = service_name
+        self._wait_seconds = wait_seconds
+        self._budgets = budgets if budgets_by_operation is None else budgets_by_operation
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        operation = self._service_name + '.' + ''.join(part.capitalize() for part in name.split('_'))
+        budget = self._budgets.get(operation)
+        if budget is None or not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            def budgeted_call():
+                if not budget.acquire(timeout=self._wait_seconds):
+                    raise BudgetExhausted(operation, self._wait_seconds)
+                return attribute(*args, **kwargs)
+            return call_with_backoff(budgeted_call)
+
+        return call
+
+
+# Wrap a client in the budgets of its service
+def budgeted(client, service_name):
+    return BudgetedClient(client, service_name)
@@ -0,0 +1,658 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Compact storage format for the raw output of Textract text detection.
+#
+# json.dumps(blocks) repeats the key names and the full polygons of every block,
+# and has to be parsed entirely to read anything out of it. The compact format
+# stores every page as three sections of columnar arrays, each compressed on its
+# own, and ends with a compressed JSON footer indexing the sections:
+#
+#   [text of page 1..n][geometry of page 1..n][structure of page 1..n][other blocks]
+#   [footer][footer length: u32][MAGIC]
+#
+#   text       line and word texts, confidences and word text types
+#   geometry   bounding boxes and polygons of the page, its lines and its words
+#   structure  block ids, CHILD relationships and the keys that have no column
+#
+# A CompactTextractReader reads the footer with one ranged GET from the end of the
+# object and then only the sections it needs, so the text of the document or of
+# a page, or the geometry of a range of lines, is read without decoding the rest.
+# Adjacent sections are fetched together, so the text of the whole document is
+# a single ranged GET.
+#
+# Ids, texts, types and relationships are stored exactly, confidences as 64-bit
+# floats and geometry rounded to 7 decimals. Blocks are read back page by page (PAGE, then
+# its LINEs, then their WORDs) with the lines in reading order.
+
+from array import array
+import io
+import json
+import math
+import struct
+import sys
+import uuid
+import zlib
+
+from textract_document import LINE_SEPARATOR
+
+FORMAT_NAME = 'tca2i-compact-textract'
+FORMAT_VERSION = 1
+
+# File extension and content type of the compact objects
+FILE_EXTENSION = '.compact'
+CONTENT_TYPE = 'application/vnd.tca2i.compact-textract'
+
+MAGIC = b'TCA2ICT1'
+TRAILER = struct.Struct('<I8s')
+
+COMPRESSION_LEVEL = 6
+
+# Bytes read from the end of an object to get its footer, small objects are read in full
+TAIL_PREFETCH_BYTES = 64 * 1024
+
+TEXT_TYPES = (None, 'PRINTED', 'HANDWRITING')
+
+# Polygon point count of a block without a polygon
+NO_POLYGON = 0xFFFF
+
+# Geometry (ratios of the page size) is stored as 32-bit fixed point numbers with 7 decimals
+GEOMETRY_SCALE = 10 ** 7
+NO_BOUNDING_BOX = -2 ** 31
+
+SECTIONS = ('text', 'geometry', 'structure')
+
+# Keys stored in columns, any other key of a block is kept in the structure section
+BLOCK_KEYS = frozenset(['BlockType', 'Id', 'Text', 'Confidence', 'TextType', 'Geometry', 'Relationships', 'Page'])
+BOUNDING_BOX_KEYS = ('Width', 'Height', 'Left', 'Top')
+
+
+def _to_bytes(typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_bytes(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+# Length-prefixed parts, compressed together
+def _pack(parts):
+    packed = bytearray()
+    for part in parts:
+        packed += struct.pack('<I', len(part))
+        packed += part
+    return zlib.compress(bytes(packed), COMPRESSION_LEVEL)
+
+
+def _unpack(data):
+    packed = zlib.decompress(data)
+    parts = []
+    position = 0
+    while position < len(packed):
+        length, = struct.unpack_from('<I', packed, position)
+        parts.append(packed[position + 4:position + 4 + length])
+        position += 4 + length
+    return parts
+
+
+def _encode_texts(texts):
+    encoded = [text.encode('utf-8') for text in texts]
+    return [_to_bytes('I', [len(text) for text in encoded]), b''.join(encoded)]
+
+
+def _decode_texts(lengths, blob):
+    texts = []
+    position = 0
+    for length in _from_bytes('I', lengths):
+        texts.append(blob[position:position + length].decode('utf-8'))
+        position += length
+    return texts
+
+
+# Textract ids are UUIDs and are stored in 16 bytes, other ids as a JSON list
+def _encode_ids(ids):
+    try:
+        uuids = [uuid.UUID(block_id) for block_id in ids]
+        if all(str(block_uuid) == block_id for block_uuid, block_id in zip(uuids, ids)):
+            return [b'u', b''.join(block_uuid.bytes for block_uuid in uuids)]
+    except (TypeError, ValueError, AttributeError):
+        pass
+    return [b'j', json.dumps(ids).encode('utf-8')]
+
+
+def _decode_ids(kind, data):
+    if kind == b'u':
+        hex_ids = data.hex()
+        return ['-'.join((hex_id[:8], hex_id[8:12], hex_id[12:16], hex_id[16:20], hex_id[20:]))
+                for hex_id in (hex_ids[index:index + 32] for index in range(0, len(hex_ids), 32))]
+    return json.loads(data.decode('utf-8'))
+
+
+def _encode_optional_floats(typecode, values):
+    return _to_bytes(typecode, [math.nan if value is None else value for value in values])
+
+
+def _decode_optional_floats(typecode, data):
+    return [None if math.isnan(value) else value for value in _from_bytes(typecode, data)]
+
+
+def _encode_geometry(records):
+    bounding_boxes = []
+    point_counts = []
+    points = []
+    for bounding_box, polygon in records:
+        if bounding_box is None:
+            bounding_boxes.extend((NO_BOUNDING_BOX,) * 4)
+        else:
+            bounding_boxes.extend(round(value * GEOMETRY_SCALE) for value in bounding_box)
+        if polygon is None:
+            point_counts.append(NO_POLYGON)
+        else:
+            point_counts.append(len(polygon) // 2)
+            points.extend(round(value * GEOMETRY_SCALE) for value in polygon)
+    return [_to_bytes('i', bounding_boxes), _to_bytes('H', point_counts), _to_bytes('i', points)]
+
+
+# Returns: LIST of Geometry dictionaries (or None)
+def _decode_geometry(bounding_boxes, point_counts, points):
+    bounding_boxes = _from_bytes('i', bounding_boxes)
+    points = [value / GEOMETRY_SCALE for value in _from_bytes('i', points)]
+    geometries = []
+    position = 0
+    for index, point_count in enumerate(_from_bytes('H', point_counts)):
+        geometry = {}
+        bounding_box = bounding_boxes[index * 4:index * 4 + 4]
+        if bounding_box[0] != NO_BOUNDING_BOX:
+            geometry['BoundingBox'] = dict(zip(BOUNDING_BOX_KEYS, (value / GEOMETRY_SCALE for value in bounding_box)))
+        if point_count != NO_POLYGON:
+            geometry['Polygon'] = [{'X': points[position + point * 2], 'Y': points[position + point * 2 + 1]}
+                                   for point in range(point_count)]
+            position += point_count * 2
+        geometries.append(geometry or None)
+    return geometries
+
+
+# Split a block into the values stored in columns and the keys without a column
+# Returns: TUPLE (bounding box, polygon, child ids, extras)
+def _split_block(block):
+    extras = {key: value for key, value in block.items() if key not in BLOCK_KEYS}
+
+    bounding_box = polygon = None
+    geometry = block.get('Geometry')
+    if geometry is not None:
+        if 'BoundingBox' in geometry:
+            bounding_box = tuple(geometry['BoundingBox'][key] for key in BOUNDING_BOX_KEYS)
+        if 'Polygon' in geometry:
+            polygon = [coordinate for point in geometry['Polygon'] for coordinate in (point['X'], point['Y'])]
+        geometry_extras = {key: value for key, value in geometry.items() if key not in ('BoundingBox', 'Polygon')}
+        if geometry_extras:
+            extras['Geometry'] = geometry_extras
+
+    child_ids = []
+    for relationship in block.get('Relationships', []):
+        if relationship['Type'] == 'CHILD':
+            child_ids.extend(relationship['Ids'])
+        else:
+            extras.setdefault('Relationships', []).append(relationship)
+    return bounding_box, polygon, child_ids, extras
+
+
+class _PageRecord:
+    __slots__ = ('id', 'number', 'bounding_box', 'polygon', 'child_ids', 'extras', 'lines', 'words')
+
+    def __init__(self, block_id, number, bounding_box=None, polygon=None, child_ids=(), extras=None):
+        self.id = block_id
+        self.number = number
+        self.bounding_box = bounding_box
+        self.polygon = polygon
+        self.child_ids = list(child_ids)
+        self.extras = extras or {}
+        self.lines = []
+        self.words = []
+
+
+# Collects blocks (e.g. while they are paginated from Textract) into columns and
+# writes them in the compact format. Only the columns are held in memory.
+class CompactBlocksWriter:
+
+    def __init__(self):
+        self._pages = []
+        # Records are tuples: (id, text, confidence, text type, bounding box, polygon, child ids, extras, page)
+        self._lines = []
+        self._words = []
+        self._other_blocks = []
+        self._has_page_field = False
+
+    def add(self, block):
+        block_type = block['BlockType']
+        self._has_page_field = self._has_page_field or 'Page' in block
+        if block_type not in ('PAGE', 'LINE', 'WORD'):
+            self._other_blocks.append(block)
+            return
+
+        bounding_box, polygon, child_ids, extras = _split_block(block)
+        if block_type == 'PAGE':
+            self._pages.append(_PageRecord(block['Id'], block.get('Page', len(self._pages) + 1), bounding_box,
+                                           polygon, child_ids, extras))
+            return
+
+        record = (block['Id'], block['Text'], block.get('Confidence'), block.get('TextType'), bounding_box, polygon,
+                  child_ids, extras, block.get('Page', 1))
+        (self._lines if block_type == 'LINE' else self._words).append(record)
+
+    # Add each block while passing it on
+    def collect(self, blocks):
+        for block in blocks:
+            self.add(block)
+            yield block
+
+    # Assign the lines and words to their pages in reading order, the same way TextractDocument does
+    def _resolve_pages(self):
+        pages = {}
+        for page in self._pages:
+            pages.setdefault(page.number, page)
+        lines_by_id = {line[0]: line for line in self._lines}
+        words_by_id = {word[0]: word for word in self._words}
+
+        assigned_lines = set()
+        for page in sorted(pages.values(), key=lambda page: page.number):
+            for child_id in page.child_ids:
+                if child_id in lines_by_id and child_id not in assigned_lines:
+                    page.lines.append(lines_by_id[child_id])
+                    assigned_lines.add(child_id)
+
+        # Lines that no PAGE block lists as a child keep their block order
+        for line in self._lines:
+            if line[0] not in assigned_lines:
+                if line[8] not in pages:
+                    pages[line[8]] = _PageRecord(None, line[8])
+                pages[line[8]].lines.append(line)
+
+        assigned_words = set()
+        for page in pages.values():
+            for line in page.lines:
+                for child_id in line[6]:
+                    if child_id in words_by_id and child_id not in assigned_words:
+                        page.words.append(words_by_id[child_id])
+                        assigned_words.add(child_id)
+        for word in self._words:
+            if word[0] not in assigned_words:
+                if word[8] not in pages:
+                    pages[word[8]] = _PageRecord(None, word[8])
+                pages[word[8]].words.append(word)
+
+        return sorted(pages.values(), key=lambda page: page.number)
+
+    @staticmethod
+    def _encode_page(page):
+        line_ids = [line[0] for line in page.lines]
+        line_id_set = set(line_ids)
+        word_indexes = {word[0]: index for index, word in enumerate(page.words)}
+        listed_line_ids = set(page.child_ids)
+
+        text = _pack(_encode_texts([line[1] for line in page.lines])
+                     + [_encode_optional_floats('d', [line[2] for line in page.lines])]
+                     + _encode_texts([word[1] for word in page.words])
+                     + [_encode_optional_floats('d', [word[2] for word in page.words]),
+                        _to_bytes('B', [TEXT_TYPES.index(word[3]) if word[3] in TEXT_TYPES else 0
+                                        for word in page.words])])
+
+        geometry = _pack(_encode_geometry([(page.bounding_box, page.polygon)])
+                         + _encode_geometry([(line[4], line[5]) for line in page.lines])
+                         + _encode_geometry([(word[4], word[5]) for word in page.words]))
+
+        # CHILD ids that are not words of the page (or lines, for the PAGE block) are kept as they are
+        child_counts = []
+        child_indexes = []
+        extras = {'Page': page.extras, 'Lines': {}, 'Words': {}, 'UnresolvedChildIds': {}}
+        for index, line in enumerate(page.lines):
+            children = [word_indexes[child_id] for child_id in line[6] if child_id in word_indexes]
+            child_counts.append(len(children))
+            child_indexes.extend(children)
+            unresolved = [child_id for child_id in line[6] if child_id not in word_indexes]
+            if unresolved:
+                extras['UnresolvedChildIds'][index] = unresolved
+            if line[7]:
+                extras['Lines'][index] = line[7]
+        for index, word in enumerate(page.words):
+            if word[7]:
+                extras['Words'][index] = word[7]
+        # The PAGE block lists the first ListedLines lines of the page
+        extras['ListedLines'] = sum(1 for line_id in line_ids if line_id in listed_line_ids)
+        extras['UnresolvedPageChildIds'] = [child_id for child_id in page.child_ids if child_id not in line_id_set]
+
+        structure = _pack(_encode_ids([page.id]) + _encode_ids(line_ids) + _encode_ids([word[0] for word in page.words])
+                          + [_to_bytes('I', child_counts), _to_bytes('I', child_indexes),
+                             json.dumps(extras).encode('utf-8')])
+        return {'text': text, 'geometry': geometry, 'structure': structure}
+
+    # Write the compact object to a binary file object
+    # Returns: INTEGER number of bytes written
+    def write(self, file_object):
+        pages = self._resolve_pages()
+        encoded_pages = [self._encode_page(page) for page in pages]
+
+        footer = {'Format': FORMAT_NAME, 'Version': FORMAT_VERSION, 'HasPageField': self._has_page_field,
+                  'Lines': sum(len(page.lines) for page in pages), 'Words': sum(len(page.words) for page in pages),
+                  'Pages': [{'Number': page.number, 'HasPageBlock': page.id is not None, 'Lines': len(page.lines),
+                             'Words': len(page.words), 'Sections': {}} for page in pages]}
+
+        offset = 0
+        first_line = 0
+        for page_footer in footer['Pages']:
+            page_footer['FirstLine'] = first_line
+            first_line += page_footer['Lines']
+        for section in SECTIONS:
+            for page_footer, encoded_page in zip(footer['Pages'], encoded_pages):
+                file_object.write(encoded_page[section])
+                page_footer['Sections'][section] = [offset, len(encoded_page[section])]
+                offset += len(encoded_page[section])
+
+        other_blocks = zlib.compress(json.dumps(self._other_blocks).encode('utf-8'), COMPRESSION_LEVEL)
+        file_object.write(other_blocks)
+        footer['OtherBlocks'] = [offset, len(other_blocks)]
+        offset += len(other_blocks)
+
+        encoded_footer = zlib.compress(json.dumps(footer).encode('utf-8'), COMPRESSION_LEVEL)
+        file_object.write(encoded_footer)
+        file_object.write(TRAILER.pack(len(encoded_footer), MAGIC))
+        return offset + len(encoded_footer) + TRAILER.size
+
+    # Returns: BYTES of the compact object
+    def to_bytes(self):
+        output = io.BytesIO()
+        self.write(output)
+        return output.getvalue()
+
+
+# Source reading a compact object held in memory
+class BytesSource:
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    # Returns: TUPLE (BYTES last length bytes of the object, INTEGER size of the object)
+    def read_tail(self, length):
+        return self.read(max(len(self.data) - length, 0), len(self.data)), len(self.data)
+
+    # Returns: BYTES in [start, end)
+    def read(self, start, end):
+        self.requests += 1
+        self.bytes_fetched += end - start
+        return self.data[start:end]
+
+
+# Source reading a compact object from S3 with ranged GETs
+class S3Source:
+
+    def __init__(self, s3_client, bucket, key):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.requests = 0
+        self.bytes_fetched = 0
+
+    def read_tail(self, length):
+        response = self._get_object('bytes=-' + str(length))
+        data = response['Body'].read()
+        # Content-Range: bytes first-last/size
+        size = int(response['ContentRange'].rsplit('/', 1)[1]) if 'ContentRange' in response else len(data)
+        return data, size
+
+    def read(self, start, end):
+        return self._get_object(f'bytes={start}-{end - 1}')['Body'].read()
+
+    def _get_object(self, byte_range):
+        self.requests += 1
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=self.key, Range=byte_range)
+        self.bytes_fetched += response['ContentLength']
+        return response
+
+
+# Lazy reader of a compact object. Sections are fetched and decoded on first use,
+# and kept for the following calls.
+class CompactTextractReader:
+
+    def __init__(self, source, tail_prefetch_bytes=TAIL_PREFETCH_BYTES):
+        self.source = source
+        tail, self.size = source.read_tail(tail_prefetch_bytes)
+        if len(tail) < TRAILER.size:
+            raise ValueError('Not a compact Textract object: too short')
+        footer_length, magic = TRAILER.unpack(tail[-TRAILER.size:])
+        if magic != MAGIC:
+            raise ValueError('Not a compact Textract object: bad magic number')
+        if footer_length + TRAILER.size > len(tail):
+            tail = source.read(self.size - footer_length - TRAILER.size, self.size)
+
+        self._tail = tail
+        self._tail_offset = self.size - len(tail)
+        self.footer = json.loads(zlib.decompress(tail[len(tail) - TRAILER.size - footer_length:-TRAILER.size]))
+        if self.footer.get('Format') != FORMAT_NAME or self.footer.get('Version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compact Textract object {self.footer.get('Format')} "
+                             f"version {self.footer.get('Version')}")
+        self.pages = self.footer['Pages']
+        self._decoded = {}
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(BytesSource(data))
+
+    @classmethod
+    def from_s3(cls, s3_client, bucket, key):
+        return cls(S3Source(s3_client, bucket, key))
+
+    @property
+    def page_numbers(self):
+        return [page['Number'] for page in self.pages]
+
+    @property
+    def line_count(self):
+        return self.footer['Lines']
+
+    @property
+    def word_count(self):
+        return self.footer['Words']
+
+    # Text of the document, the same as TextractDocument(blocks).text
+    def text(self):
+        return LINE_SEPARATOR.join(self.page_text(page['Number']) for page in self._prefetch(self.pages, ['text']))
+
+    def page_text(self, page_number):
+        return LINE_SEPARATOR.join(self._section(self._page_index(page_number), 'text')['line_texts'])
+
+    # Lines [first, last) of the document in reading order (last defaults to the end of the document),
+    # with their Text, Confidence and Page, and their Geometry if geometry is True
+    # Returns: LIST of DICTIONARY
+    def lines(self, first=0, last=None, geometry=False):
+        last = self.line_count if last is None else min(last, self.line_count)
+        pages = [page for page in self.pages
+                 if page['FirstLine'] < last and page['FirstLine'] + page['Lines'] > first]
+        self._prefetch(pages, ['text', 'geometry'] if geometry else ['text'])
+
+        lines = []
+        for page in pages:
+            page_index = self.pages.index(page)
+            text = self._section(page_index, 'text')
+            geometries = self._section(page_index, 'geometry')['lines'] if geometry else None
+            for index in range(max(first - page['FirstLine'], 0), min(last - page['FirstLine'], page['Lines'])):
+                line = {'Text': text['line_texts'][index], 'Confidence': text['line_confidences'][index],
+                        'Page': page['Number']}
+                if geometry:
+                    line['Geometry'] = geometries[index]
+                lines.append(line)
+        return lines
+
+    # Lines of one page, see lines()
+    def page_lines(self, page_number, geometry=False):
+        page = self.pages[self._page_index(page_number)]
+        return self.lines(page['FirstLine'], page['FirstLine'] + page['Lines'], geometry)
+
+    # Generator over the Textract blocks, page by page
+    def iter_blocks(self):
+        has_page_field = self.footer['HasPageField']
+        for page_index, page in enumerate(self._prefetch(self.pages, SECTIONS)):
+            text = self._section(page_index, 'text')
+            geometry = self._section(page_index, 'geometry')
+            structure = self._section(page_index, 'structure')
+            extras = structure['extras']
+
+            line_ids, word_ids = structure['line_ids'], structure['word_ids']
+            if page['HasPageBlock']:
+                child_ids = line_ids[:extras['ListedLines']] + extras['UnresolvedPageChildIds']
+                yield _build_block('PAGE', structure['page_id'], page['Number'] if has_page_field else None,
+                                   geometry['page'], child_ids, extras['Page'])
+
+            for index, line_id in enumerate(line_ids):
+                child_ids = ([word_ids[word_index] for word_index in structure['line_children'][index]]
+                             + extras['UnresolvedChildIds'].get(str(index), []))
+                yield _build_block('LINE', line_id, page['Number'] if has_page_field else None,
+                                   geometry['lines'][index], child_ids, extras['Lines'].get(str(index)),
+                                   text['line_texts'][index], text['line_confidences'][index])
+
+            for index, word_id in enumerate(word_ids):
+                yield _build_block('WORD', word_id, page['Number'] if has_page_field else None,
+                                   geometry['words'][index], [], extras['Words'].get(str(index)),
+                                   text['word_texts'][index], text['word_confidences'][index],
+                                   text['word_text_types'][index])
+
+        offset, length = self.footer['OtherBlocks']
+        for block in json.loads(zlib.decompress(self._read(offset, length))):
+            yield block
+
+    def _page_index(self, page_number):
+        for page_index, page in enumerate(self.pages):
+            if page['Number'] == page_number:
+                return page_index
+        raise KeyError(f'No page {page_number}')
+
+    def _read(self, offset, length):
+        if offset >= self._tail_offset:
+            return self._tail[offset - self._tail_offset:offset - self._tail_offset + length]
+        return self.source.read(offset, offset + length)
+
+    # Fetch the sections of the pages that are not decoded yet, merging adjacent ranges into one read
+    # Returns: LIST of the pages
+    def _prefetch(self, pages, sections):
+        keys = [(self.pages.index(page), section) for page in pages for section in sections]
+        keys = sorted((key for key in keys if key not in self._decoded),
+                      key=lambda key: self.pages[key[0]]['Sections'][key[1]][0])
+
+        run = []
+        for key in keys + [None]:
+            if key is not None and run:
+                last_offset, last_length = self.pages[run[-1][0]]['Sections'][run[-1][1]]
+                if self.pages[key[0]]['Sections'][key[1]][0] == last_offset + last_length:
+                    run.append(key)
+                    continue
+            if run:
+                start = self.pages[run[0][0]]['Sections'][run[0][1]][0]
+                last_offset, last_length = self.pages[run[-1][0]]['Sections'][run[-1][1]]
+                data = self._read(start, last_offset + last_length - start)
+                for page_index, section in run:
+                    offset, length = self.pages[page_index]['Sections'][section]
+                    self._decoded[(page_index, section)] = _DECODERS[section](data[offset - start:offset - start
+                                                                                   + length])
+            run = [key] if key is not None else []
+        return pages
+
+    def _section(self, page_index, section):
+        if (page_index, section) not in self._decoded:
+            offset, length = self.pages[page_index]['Sections'][section]
+            self._decoded[(page_index, section)] = _DECODERS[section](self._read(offset, length))
+        return self._decoded[(page_index, section)]
+
+
+def _decode_text_section(data):
+    line_lengths, line_blob, line_confidences, word_lengths, word_blob, word_confidences, word_text_types = _unpack(data)
+    return {'line_texts': _decode_texts(line_lengths, line_blob),
+            'line_confidences': _decode_optional_floats('d', line_confidences),
+            'word_texts': _decode_texts(word_lengths, word_blob),
+            'word_confidences': _decode_optional_floats('d', word_confidences),
+            'word_text_types': [TEXT_TYPES[text_type] for text_type in _from_bytes('B', word_text_types)]}
+
+
+def _decode_geometry_section(data):
+    parts = _unpack(data)
+    return {'page': _decode_geometry(*parts[0:3])[0],
+            'lines': _decode_geometry(*parts[3:6]),
+            'words': _decode_geometry(*parts[6:9])}
+
+
+def _decode_structure_section(data):
+    parts = _unpack(data)
+    child_counts = _from_bytes('I', parts[6])
+    child_indexes = _from_bytes('I', parts[7])
+    line_children = []
+    position = 0
+    for child_count in child_counts:
+        line_children.append(child_indexes[position:position + child_count])
+        position += child_count
+    return {'page_id': _decode_ids(parts[0], parts[1])[0],
+            'line_ids': _decode_ids(parts[2], parts[3]),
+            'word_ids': _decode_ids(parts[4], parts[5]),
+            'line_children': line_children,
+            'extras': json.loads(parts[8].decode('utf-8'))}
+
+
+_DECODERS = {'text': _decode_text_section, 'geometry': _decode_geometry_section,
+             'structure': _decode_structure_section}
+
+
+def _build_block(block_type, block_id, page_number, geometry, child_ids, extras, text=None, confidence=None,
+                 text_type=None):
+    block = {'BlockType': block_type}
+    if confidence is not None:
+        block['Confidence'] = confidence
+    if text is not None:
+        block['Text'] = text
+    if text_type is not None:
+        block['TextType'] = text_type
+    if geometry is not None:
+        block['Geometry'] = dict(geometry)
+    block['Id'] = block_id
+    extras = dict(extras or {})
+    if 'Geometry' in extras:
+        block.setdefault('Geometry', {}).update(extras.pop('Geometry'))
+    relationships = [{'Type': 'CHILD', 'Ids': child_ids}] if child_ids else []
+    relationships.extend(extras.pop('Relationships', []))
+    if relationships:
+        block['Relationships'] = relationships
+    if page_number is not None:
+        block['Page'] = page_number
+    block.update(extras)
+    return block
+
+
+# Returns: BOOLEAN True if data ends with the trailer of a compact object
+def is_compact(data):
+    return len(data) >= TRAILER.size and data[-len(MAGIC):] == MAGIC
@@ -0,0 +1,156 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Micro-batching of documents into Comprehend entity detection jobs.
+#
+# Instead of one asynchronous job per document, processed documents are
+# accumulated under a shared "pending" prefix. Once max_documents are waiting
+# (or the oldest one has waited window_seconds) they are moved to a batch
+# prefix and a single ONE_DOC_PER_FILE job is started on that prefix. A
+# manifest maps each file of the batch back to the document it came from, so
+# that ComprehendA2I can fan the job output out per document.
+
+import hashlib
+import json
+import re
+import time
+
+PENDING_PREFIX = 'comprehend-input/pending/'
+BATCHES_PREFIX = 'comprehend-input/batches/'
+MANIFESTS_PREFIX = 'comprehend-input/manifests/'
+BATCH_OUTPUT_PREFIX = 'comprehend-output/batches/'
+
+
+class DocumentBatcher:
+
+    def __init__(self, s3_client, comprehend_client, bucket, output_bucket, recognizer_arn, data_access_role_arn,
+                 max_documents, window_seconds, clock=time.time):
+        self.s3_client = s3_client
+        self.comprehend_client = comprehend_client
+        self.bucket = bucket
+        self.output_bucket = output_bucket
+        self.recognizer_arn = recognizer_arn
+        self.data_access_role_arn = data_access_role_arn
+        self.max_documents = max_documents
+        self.window_seconds = window_seconds
+        self.clock = clock
+
+    # Queue a processed document for the next entity detection job
+    def add(self, filename, processed_data_key, text, correlation_id=None):
+        metadata = {'filename': filename, 'processed-data-key': processed_data_key}
+        if correlation_id:
+            metadata['correlation-id'] = correlation_id
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=PENDING_PREFIX + get_batch_file_name(filename),
+            Body=text,
+            Metadata=metadata
+        )
+
+    # Start an entity detection job for the pending documents if the batch is
+    # full, if the oldest document has waited longer than the window or if force is set
+    # Returns: DICTIONARY manifest of the started batch, or None
+    def flush(self, force=False):
+        response = self.s3_client.list_objects_v2(Bucket=self.bucket, Prefix=PENDING_PREFIX,
+                                                  MaxKeys=self.max_documents)
+        pending_objects = response.get('Contents', [])
+        if not pending_objects:
+            return None
+
+        oldest_modification = min(pending_object['LastModified'] for pending_object in pending_objects)
+        window_expired = self.clock() - oldest_modification.timestamp() >= self.window_seconds
+        if not (force or window_expired or len(pending_objects) >= self.max_documents):
+            return None
+
+        # The batch id is derived from its documents, so that two invocations
+        # flushing the same pending documents start the same (idempotent) job
+        pending_keys = [pending_object['Key'] for pending_object in pending_objects]
+        batch_id = hashlib.sha1('\n'.join(pending_keys).encode('utf-8')).hexdigest()[:32]
+        batch_prefix = BATCHES_PREFIX + batch_id + '/'
+
+        manifest = {'BatchId': batch_id, 'Documents': {}}
+        for pending_key in pending_keys:
+            batch_file_name = pending_key[len(PENDING_PREFIX):]
+            metadata = self.s3_client.head_object(Bucket=self.bucket, Key=pending_key)['Metadata']
+            self.s3_client.copy_object(CopySource={'Bucket': self.bucket, 'Key': pending_key},
+                                       Bucket=self.bucket, Key=batch_prefix + batch_file_name)
+            manifest['Documents'][batch_file_name] = {'Filename': metadata.get('filename'),
+                                                      'ProcessedDataKey': metadata.get('processed-data-key'),
+                                                      'CorrelationId': metadata.get('correlation-id')}
+
+        # The manifest has to exist before the job can produce any output
+        self.s3_client.put_object(Bucket=self.bucket, Key=MANIFESTS_PREFIX + batch_id + '.json',
+                                  Body=json.dumps(manifest))
+
+        response = self.comprehend_client.start_entities_detection_job(
+            InputDataConfig={
+                'S3Uri': 's3://' + self.bucket + '/' + batch_prefix,
+                'InputFormat': 'ONE_DOC_PER_FILE'
+            },
+            OutputDataConfig={
+                'S3Uri': 's3://' + self.output_bucket + '/' + BATCH_OUTPUT_PREFIX + batch_id + '/'
+            },
+            DataAccessRoleArn=self.data_access_role_arn,
+            JobName='TCA2I-batch-' + batch_id,
+            EntityRecognizerArn=self.recognizer_arn,
+            LanguageCode='en',
+            ClientRequestToken=batch_id
+        )
+
+        # Pending documents are only removed once their job has been started, a
+        # failed start is retried with the same batch id by the next flush
+        self.s3_client.delete_objects(Bucket=self.bucket,
+                                      Delete={'Objects': [{'Key': pending_key} for pending_key in pending_keys]})
+        print(f"Custom Entity Detection Job {response['JobId']} Started for {len(pending_keys)} documents")
+        return manifest
+
+    # Keep starting jobs while full batches are waiting
+    # Returns: LIST of the manifests of the started batches
+    def flush_all(self, force=False):
+        manifests = []
+        while True:
+            manifest = self.flush(force)
+            if manifest is None:
+                return manifests
+            manifests.append(manifest)
+            if len(manifest['Documents']) < self.max_documents:
+                return manifests
+
+
+# Get a flat, unique file name for a document in a batch prefix
+def get_batch_file_name(filename):
+    return re.sub(r'[^\w.-]+', '_', filename) + '-' + hashlib.sha1(filename.encode('utf-8')).hexdigest()[:8] + '.txt'
+
+
+# Get the batch id of a Comprehend output object key written for a batch, or None
+def get_batch_id(output_key):
+    if not output_key.startswith(BATCH_OUTPUT_PREFIX):
+        return None
+    return output_key[len(BATCH_OUTPUT_PREFIX):].split('/')[0]
+
+
+def load_manifest(s3_client, bucket, batch_id):
+    manifest_object = s3_client.get_object(Bucket=bucket, Key=MANIFESTS_PREFIX + batch_id + '.json')
+    return json.loads(manifest_object['Body'].read())
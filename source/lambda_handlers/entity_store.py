@@ -0,0 +1,329 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# In-memory index of a Comprehend Custom Entity Recognizer entity list.
+#
+# The entity list is a CSV file with a Text,Type header and one entity per row.
+# Entities are indexed by their normalized (text, type) key so that looking up
+# or merging an annotation costs O(1) whatever the size of the list.
+#
+# Human reviews don't rewrite the entity list. Each completed review writes a
+# small delta file, named after its human loop, into a deltas folder next to the
+# entity list, and NewEntityCheck compacts all the deltas into the list once per run.
+#
+# Entity lists written by these functions carry a fingerprint of their content in
+# their S3 metadata, so that two lists can be compared with HEAD requests alone.
+
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import gc
+import hashlib
+import io
+import itertools
+import re
+import unicodedata
+
+from botocore.exceptions import ClientError
+
+ENTITY_LIST_HEADER = ['Text', 'Type']
+
+# Folder, next to the entity list, holding one delta file per completed human review
+ENTITY_LIST_DELTAS_FOLDER = 'entity-list-deltas/'
+
+# Number of delta files downloaded in parallel during a compaction
+DELTA_DOWNLOAD_CONCURRENCY = 8
+
+# Number of lines of an entity list parsed at a time
+CSV_CHUNK_LINES = 1000
+
+# S3 user metadata holding the fingerprint of an entity list
+FINGERPRINT_METADATA_KEY = 'entity-list-fingerprint'
+
+# S3 user metadata holding the correlation id of the document a delta was annotated on
+CORRELATION_ID_METADATA_KEY = 'correlation-id'
+
+# S3 user metadata holding the number of entities of an entity list
+ENTITY_COUNT_METADATA_KEY = 'entity-list-count'
+
+# DeleteObjects accepts at most 1000 keys per request
+S3_DELETE_OBJECTS_MAX_KEYS = 1000
+
+
+# Characters that sort before the tab separating the text and type of a fingerprinted entity
+CONTROL_CHARACTERS = re.compile('[\x00-\x08]')
+
+
+# Rows of the lines of an entity list (all str or all bytes), CSV_CHUNK_LINES at a time. A
+# chunk without quotes or carriage returns is split on the commas, the way csv.reader would
+# Returns: ITERATOR of LISTS of rows
+def _iter_csv_chunks(lines):
+    while True:
+        chunk = list(itertools.islice(lines, CSV_CHUNK_LINES))
+        if not chunk:
+            return
+        text = b'\n'.join(chunk).decode('utf-8') if isinstance(chunk[0], bytes) else '\n'.join(chunk)
+        if '"' in text or '\r' in text:
+            yield list(csv.reader(text.split('\n')))
+        else:
+            yield [line.split(',') if line else [] for line in text.split('\n')]
+
+
+# Key used to index an entity: the text is NFC normalized, whitespace collapsed
+# and case folded, the type is upper cased
+def normalize_entity(text, entity_type):
+    return normalize_text(text), entity_type.strip().upper()
+
+
+def normalize_text(text):
+    # ASCII text is already NFC normalized
+    if not text.isascii():
+        text = unicodedata.normalize('NFC', text)
+    return ' '.join(text.split()).casefold()
+
+
+# Unique (text, type) pairs annotated by a human reviewer, in annotation order
+def get_annotated_entities(original_text, annotated_entities):
+    unique_entities = {}
+    for annotated_entity in annotated_entities:
+        text = original_text[annotated_entity['startOffset']:annotated_entity['endOffset']]
+        entity_type = annotated_entity['label'].upper()
+        unique_entities.setdefault(normalize_entity(text, entity_type), (text, entity_type))
+    return list(unique_entities.values())
+
+
+class EntityStore:
+
+    def __init__(self, entities=()):
+        # Normalized key -> (Text, Type) as written in the entity list, in insertion order
+        self._entities = {}
+        for text, entity_type in entities:
+            self.add(text, entity_type)
+
+    # Build the store from the contents of an entity list, either a string or
+    # an iterable of lines (all str or all bytes, e.g. a streaming body's iter_lines())
+    @classmethod
+    def from_csv(cls, content):
+        store = cls()
+        store.load_csv(content)
+        return store
+
+    # Same as calling add for every row, inlined as entity lists have hundreds of
+    # thousands of rows but only a handful of entity types. The lines are parsed as
+    # they are read, the whole entity list is never held in memory as text
+    def load_csv(self, content):
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        if isinstance(content, str):
+            content = content.splitlines()
+
+        # Entity type as written -> normalized entity type
+        entity_types = {}
+        # The rows only add tuples of strings, which cannot form reference cycles: the
+        # garbage collector is paused instead of scanning the growing store over and over
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for chunk_number, rows in enumerate(_iter_csv_chunks(iter(content))):
+                if chunk_number == 0 and [column.strip().title() for column in rows[0]] == ENTITY_LIST_HEADER:
+                    del rows[0]
+                self._load_rows(rows, entity_types)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _load_rows(self, rows, entity_types):
+        entities = self._entities
+        for row in rows:
+            if len(row) != 2:
+                continue
+            text, entity_type = row[0].strip(), row[1]
+            normalized_type = entity_types.get(entity_type)
+            if normalized_type is None:
+                normalized_type = entity_types[entity_type] = entity_type.strip().upper()
+            if not text or not normalized_type:
+                continue
+
+            # normalize_text, inlined
+            if not text.isascii():
+                text_key = ' '.join(unicodedata.normalize('NFC', text).split()).casefold()
+            else:
+                text_key = ' '.join(text.split()).casefold()
+            key = (text_key, normalized_type)
+            if key not in entities:
+                entities[key] = (text, normalized_type)
+
+    # Add an entity to the store
+    # Returns: BOOLEAN True if the entity was not already in the store
+    def add(self, text, entity_type):
+        key = normalize_entity(text, entity_type)
+        if key in self._entities:
+            return False
+        self._entities[key] = (text, entity_type.strip().upper())
+        return True
+
+    # Add the (text, type) pairs that are not in the store yet
+    # Returns: LIST of the entities that were added
+    def merge(self, entities):
+        return [(text, entity_type) for text, entity_type in entities if self.add(text, entity_type)]
+
+    # SHA-256 of the normalized entities, independent of the order of the rows
+    def fingerprint(self):
+        # Joined keys sort like the (text, type) pairs, unless a text has characters below the tab
+        rows = sorted(map('\t'.join, self._entities))
+        if CONTROL_CHARACTERS.search('\n'.join(rows)):
+            rows = map('\t'.join, sorted(self._entities))
+        rows = '\n'.join(rows)
+        return hashlib.sha256((rows + '\n' if rows else '').encode('utf-8')).hexdigest()
+
+    def entity_types(self):
+        return sorted({entity_type for _, entity_type in self._entities.values()})
+
+    def to_csv(self):
+        # Fields without commas, quotes or line breaks are written as they are by csv.writer,
+        # so the rows are joined in one go unless a field has to be quoted
+        rows = '\r\n'.join(map(','.join, self._entities.values()))
+        if (rows.count(',') == len(self._entities) and rows.count('\r') == max(len(self._entities) - 1, 0)
+                and '"' not in rows and '\n' not in rows.replace('\r\n', '')):
+            return ','.join(ENTITY_LIST_HEADER) + '\r\n' + (rows + '\r\n' if rows else '')
+
+        output = io.StringIO()
+        self.write_csv(output)
+        return output.getvalue()
+
+    def write_csv(self, file_object):
+        writer = csv.writer(file_object)
+        writer.writerow(ENTITY_LIST_HEADER)
+        writer.writerows(self._entities.values())
+
+    def __contains__(self, entity):
+        return normalize_entity(*entity) in self._entities
+
+    def __iter__(self):
+        return iter(self._entities.values())
+
+    def __len__(self):
+        return len(self._entities)
+
+
+# Write the entity list together with its fingerprint
+def put_entity_list(s3_client, bucket, key, store):
+    s3_client.put_object(Bucket=bucket, Key=key, Body=store.to_csv().encode('utf-8'), ContentType='text/csv',
+                         Metadata=get_entity_list_metadata(store))
+
+
+# Record the fingerprint of an entity list that was written without one (e.g. the
+# initial training list) by copying the object onto itself with the new metadata
+def record_fingerprint(s3_client, bucket, key, store):
+    s3_client.copy_object(CopySource={'Bucket': bucket, 'Key': key}, Bucket=bucket, Key=key,
+                          Metadata=get_entity_list_metadata(store),
+                          MetadataDirective='REPLACE', ContentType='text/csv')
+
+
+def get_entity_list_metadata(store):
+    return {FINGERPRINT_METADATA_KEY: store.fingerprint(), ENTITY_COUNT_METADATA_KEY: str(len(store))}
+
+
+# Returns: DICTIONARY with the 'Fingerprint' and 'EntityCount' (None if they were not recorded)
+# and the 'ETag' of an entity list, None if the entity list does not exist
+def head_entity_list(s3_client, bucket, key):
+    try:
+        response = s3_client.head_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    metadata = response.get('Metadata', {})
+    entity_count = metadata.get(ENTITY_COUNT_METADATA_KEY)
+    return {'Fingerprint': metadata.get(FINGERPRINT_METADATA_KEY),
+            'EntityCount': int(entity_count) if entity_count is not None else None,
+            'ETag': response['ETag']}
+
+
+# Compare two entity lists from their HEAD responses
+# Returns: BOOLEAN True if both lists are known to hold the same entities
+def is_same_entity_list(entity_list_head, other_entity_list_head):
+    if entity_list_head is None or other_entity_list_head is None:
+        return False
+    if entity_list_head['ETag'] == other_entity_list_head['ETag']:
+        return True
+    return (entity_list_head['Fingerprint'] is not None
+            and entity_list_head['Fingerprint'] == other_entity_list_head['Fingerprint'])
+
+
+# Prefix of the delta files of an entity list
+def get_deltas_prefix(entity_list_key):
+    folder = entity_list_key[:entity_list_key.rindex('/') + 1] if '/' in entity_list_key else ''
+    return folder + ENTITY_LIST_DELTAS_FOLDER
+
+
+# Write the entities annotated by one human review. The key only depends on the
+# human loop name, so a redelivered review event overwrites its own delta.
+# Returns: STRING key of the delta file
+def put_delta(s3_client, bucket, deltas_prefix, human_loop_name, entities, correlation_id=None):
+    delta_key = deltas_prefix + human_loop_name + '.csv'
+    s3_client.put_object(Bucket=bucket, Key=delta_key, Body=EntityStore(entities).to_csv().encode('utf-8'),
+                         ContentType='text/csv',
+                         Metadata={CORRELATION_ID_METADATA_KEY: correlation_id} if correlation_id else {})
+    return delta_key
+
+
+# Returns: LIST of the keys of every delta file waiting to be compacted
+def list_deltas(s3_client, bucket, deltas_prefix):
+    delta_keys = []
+    list_arguments = {'Bucket': bucket, 'Prefix': deltas_prefix}
+    while True:
+        response = s3_client.list_objects_v2(**list_arguments)
+        delta_keys.extend(delta_object['Key'] for delta_object in response.get('Contents', []))
+        if not response.get('IsTruncated'):
+            return delta_keys
+        list_arguments['ContinuationToken'] = response['NextContinuationToken']
+
+
+# Merge the delta files into the store
+# Returns: TUPLE (LIST of the entities that were not in the store yet,
+#                 LIST of the correlation ids of the documents whose reviews added them)
+def merge_deltas(s3_client, bucket, delta_keys, store):
+    def load_delta(delta_key):
+        delta_object = s3_client.get_object(Bucket=bucket, Key=delta_key)
+        return (EntityStore.from_csv(delta_object['Body'].read().decode('utf-8')),
+                delta_object.get('Metadata', {}).get(CORRELATION_ID_METADATA_KEY))
+
+    new_entities = []
+    correlation_ids = []
+    with ThreadPoolExecutor(max_workers=DELTA_DOWNLOAD_CONCURRENCY) as executor:
+        # map keeps the order of the delta keys, so the merge is deterministic
+        for delta, correlation_id in executor.map(load_delta, delta_keys):
+            added_entities = store.merge(delta)
+            new_entities.extend(added_entities)
+            if added_entities and correlation_id:
+                correlation_ids.append(correlation_id)
+    return new_entities, correlation_ids
+
+
+# Delete the delta files once they have been merged into the entity list
+def delete_deltas(s3_client, bucket, delta_keys):
+    for start in range(0, len(delta_keys), S3_DELETE_OBJECTS_MAX_KEYS):
+        s3_client.delete_objects(Bucket=bucket, Delete={
+            'Objects': [{'Key': delta_key} for delta_key in delta_keys[start:start + S3_DELETE_OBJECTS_MAX_KEYS]]})
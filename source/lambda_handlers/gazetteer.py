@@ -0,0 +1,220 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Gazetteer pre-annotation of documents with the entities of the entity list.
+#
+# The entities of the list the Custom Entity Recognizer was trained with are
+# compiled into an Aho-Corasick automaton, which finds all of their occurrences
+# in one pass over a document whatever the number of entities. Matching is case
+# insensitive and any whitespace character matches the (collapsed) whitespace
+# of an entity. Only whole words are matched, and overlapping hits are resolved
+# leftmost-longest.
+#
+# A Lambda container builds the automaton once per recognizer version. Its hits
+# are merged into the entities shown to the human reviewers, and with
+# GAZETTEER_SKIP_COMPREHEND a document whose hits alone satisfy the review policy
+# is accepted without running Comprehend at all.
+
+import bisect
+import os
+import threading
+
+from botocore.exceptions import ClientError
+
+import entity_store
+import result_cache
+
+GAZETTEER_ENABLED = os.environ.get('GAZETTEER_ENABLED', 'false').lower() == 'true'
+GAZETTEER_SKIP_COMPREHEND = os.environ.get('GAZETTEER_SKIP_COMPREHEND', 'false').lower() == 'true'
+
+# Score given to the entities found by the gazetteer, which are exact matches
+GAZETTEER_SCORE = 1.0
+
+# Every whitespace character folds to a space (all of them are below U+3001)
+WHITESPACE_TRANSLATION = {code_point: ' ' for code_point in range(0x3001) if chr(code_point).isspace()}
+
+
+# Fold a text for matching without changing its length, so that offsets in the
+# folded text are offsets in the original text
+def fold_text(text):
+    folded = text.translate(WHITESPACE_TRANSLATION).lower()
+    if len(folded) == len(text):
+        return folded
+    # A few characters lower case to more than one character (e.g. U+0130), they are kept as they are
+    return ''.join(character if len(character.lower()) != 1 else character.lower()
+                   for character in text.translate(WHITESPACE_TRANSLATION))
+
+
+def _is_word_character(character):
+    return character.isalnum() or character == '_'
+
+
+class Gazetteer:
+
+    def __init__(self, entities=()):
+        # Trie of the folded entity texts: transitions, failure links, the (length, type)
+        # of the entity ending at each node and the next node with an entity on the failure chain
+        self._transitions = [{}]
+        self._failure = [0]
+        self._outputs = [None]
+        self._output_links = [0]
+        self.entity_count = 0
+        for text, entity_type in entities:
+            self._add(' '.join(text.split()), entity_type)
+        self._link()
+
+    # Returns: Gazetteer of the entities of an entity_store.EntityStore
+    @classmethod
+    def from_entity_store(cls, store):
+        return cls(iter(store))
+
+    def _add(self, text, entity_type):
+        folded = fold_text(text)
+        if not folded:
+            return
+        node = 0
+        for character in folded:
+            next_node = self._transitions[node].get(character)
+            if next_node is None:
+                next_node = len(self._transitions)
+                self._transitions.append({})
+                self._failure.append(0)
+                self._outputs.append(None)
+                self._output_links.append(0)
+                self._transitions[node][character] = next_node
+            node = next_node
+        # The first type listed for a text wins
+        if self._outputs[node] is None:
+            self._outputs[node] = (len(folded), entity_type.strip().upper())
+            self.entity_count += 1
+
+    # Breadth first computation of the failure and output links
+    def _link(self):
+        queue = list(self._transitions[0].values())
+        for node in queue:
+            for character, next_node in self._transitions[node].items():
+                failure = self._failure[node]
+                while failure and character not in self._transitions[failure]:
+                    failure = self._failure[failure]
+                failure = self._transitions[failure].get(character, 0)
+                self._failure[next_node] = failure
+                self._output_links[next_node] = failure if self._outputs[failure] else self._output_links[failure]
+                queue.append(next_node)
+
+    # Returns: LIST of (BeginOffset, EndOffset, Type) of the entities found in text, in text order
+    def find(self, text):
+        folded = fold_text(text)
+        transitions, failure, outputs, output_links = self._transitions, self._failure, self._outputs, self._output_links
+
+        candidates = []
+        node = 0
+        for end, character in enumerate(folded, 1):
+            while node and character not in transitions[node]:
+                node = failure[node]
+            node = transitions[node].get(character, 0)
+
+            output_node = node if outputs[node] else output_links[node]
+            while output_node:
+                length, entity_type = outputs[output_node]
+                if self._is_whole_word(folded, end - length, end):
+                    candidates.append((end - length, end, entity_type))
+                output_node = output_links[output_node]
+
+        # Leftmost-longest, non overlapping
+        hits = []
+        last_end = 0
+        for begin, end, entity_type in sorted(candidates, key=lambda candidate: (candidate[0], -candidate[1])):
+            if begin >= last_end:
+                hits.append((begin, end, entity_type))
+                last_end = end
+        return hits
+
+    # Returns: LIST of the entities found in text, in the format of Comprehend's results
+    def find_entities(self, text):
+        return [{'BeginOffset': begin, 'EndOffset': end, 'Score': GAZETTEER_SCORE, 'Text': text[begin:end],
+                 'Type': entity_type} for begin, end, entity_type in self.find(text)]
+
+    # Returns: BOOLEAN True if the match does not start or end in the middle of a word
+    @staticmethod
+    def _is_whole_word(folded, begin, end):
+        if begin > 0 and _is_word_character(folded[begin]) and _is_word_character(folded[begin - 1]):
+            return False
+        return not (end < len(folded) and _is_word_character(folded[end - 1]) and _is_word_character(folded[end]))
+
+
+# Add the gazetteer entities that do not overlap an entity found by Comprehend
+# Returns: LIST of entities sorted by BeginOffset
+def merge_entities(entities, gazetteer_entities):
+    spans = sorted((entity['BeginOffset'], entity['EndOffset']) for entity in entities)
+    begins = [begin for begin, _ in spans]
+    # Largest end offset of the spans up to each index
+    max_ends = []
+    for _, end in spans:
+        max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+
+    merged_entities = list(entities)
+    for gazetteer_entity in gazetteer_entities:
+        # The spans starting before the end of the gazetteer entity overlap it if one of them ends after its start
+        index = bisect.bisect_left(begins, gazetteer_entity['EndOffset'])
+        if index == 0 or max_ends[index - 1] <= gazetteer_entity['BeginOffset']:
+            merged_entities.append(gazetteer_entity)
+    return sorted(merged_entities, key=lambda entity: (entity['BeginOffset'], entity['EndOffset']))
+
+
+# Gazetteers built by this container, by recognizer version (only the latest one is kept)
+_gazetteers = {}
+_gazetteers_lock = threading.Lock()
+
+
+# Get the gazetteer of the entity list the recognizer was trained with, building it on first use
+# Returns: Gazetteer, or None if the entity list could not be loaded
+def get_gazetteer(s3_client, entity_list_s3_uri, recognizer_arn):
+    recognizer_version = result_cache.get_recognizer_version(recognizer_arn)
+    with _gazetteers_lock:
+        gazetteer = _gazetteers.get(recognizer_version)
+        if gazetteer is not None:
+            return gazetteer
+
+        bucket, key = entity_list_s3_uri[len('s3://'):].split('/', 1)
+        try:
+            entity_list_object = s3_client.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            # Documents are still processed without the gazetteer hits
+            print(f'Failed to load the entity list {entity_list_s3_uri} for the gazetteer: {e!r}')
+            return None
+
+        gazetteer = Gazetteer.from_entity_store(entity_store.EntityStore.from_csv(
+            entity_list_object['Body'].read().decode('utf-8')))
+        _gazetteers.clear()
+        _gazetteers[recognizer_version] = gazetteer
+        return gazetteer
+
+
+# Find the entities of the entity list the recognizer was trained with in a processed text
+# Returns: LIST of entities, or None if the gazetteer is disabled or unavailable
+def find_known_entities(s3_client, entity_list_s3_uri, recognizer_arn, processed_text):
+    if not GAZETTEER_ENABLED:
+        return None
+    gazetteer = get_gazetteer(s3_client, entity_list_s3_uri, recognizer_arn)
+    return gazetteer.find_entities(processed_text) if gazetteer is not None else None
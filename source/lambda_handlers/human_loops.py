@@ -0,0 +1,213 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Helpers shared by the functions that send documents to an Amazon A2I human review.
+
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+from rate_limiting import TokenBucket, call_with_backoff
+import instrumentation
+
+# Types of entities that the human reviewers are asked to label
+ENTITY_LABELS = [{'label': 'device', 'shortDisplayName': 'dvc', 'fullDisplayName': 'Device'}]
+
+# Documents whose results are not sent to a human review are written under this prefix
+ACCEPTED_RESULTS_PREFIX = 'comprehend-output/accepted/'
+
+# Maximum number of concurrent start_human_loop calls, and the number of calls
+# per second (with bursts of up to HUMAN_LOOP_SUBMISSION_BURST calls) per container
+HUMAN_LOOP_SUBMISSION_CONCURRENCY = int(os.environ.get('HUMAN_LOOP_SUBMISSION_CONCURRENCY', '4'))
+HUMAN_LOOP_SUBMISSION_RATE = float(os.environ.get('HUMAN_LOOP_SUBMISSION_RATE', '5'))
+HUMAN_LOOP_SUBMISSION_BURST = int(os.environ.get('HUMAN_LOOP_SUBMISSION_BURST', '10'))
+
+# Shared by every invocation served by this container
+human_loop_rate_limiter = TokenBucket(HUMAN_LOOP_SUBMISSION_RATE, HUMAN_LOOP_SUBMISSION_BURST)
+
+
+# Decides which documents are uncertain enough to need a human review.
+# A document is auto-accepted only if it has at least min_entities entities,
+# every entity has a Score of at least min_score and every label in
+# required_labels was recognized at least once. Without a min_score every
+# document is reviewed.
+class ReviewPolicy:
+
+    def __init__(self, min_score=None, min_entities=1, required_labels=()):
+        self.min_score = min_score
+        self.min_entities = min_entities
+        self.required_labels = set(label.lower() for label in required_labels)
+
+    @classmethod
+    def from_environment(cls):
+        min_score = os.environ.get('AUTO_ACCEPT_MIN_SCORE', '')
+        required_labels = os.environ.get('AUTO_ACCEPT_REQUIRED_LABELS', '')
+        if required_labels == '*':
+            required_labels = [label['label'] for label in ENTITY_LABELS]
+        else:
+            required_labels = [label.strip() for label in required_labels.split(',') if label.strip()]
+        return cls(min_score=float(min_score) if min_score else None,
+                   min_entities=int(os.environ.get('AUTO_ACCEPT_MIN_ENTITIES', '1')),
+                   required_labels=required_labels)
+
+    # Returns: BOOLEAN
+    def requires_review(self, entities):
+        if self.min_score is None or len(entities) < self.min_entities:
+            return True
+        if any(entity['Score'] < self.min_score for entity in entities):
+            return True
+        recognized_labels = set(entity['Type'].lower() for entity in entities)
+        return not self.required_labels.issubset(recognized_labels)
+
+
+# Build the Human Loop input for a document and the entities recognized in it
+def build_human_loop_input(original_text, entities, correlation_id=None):
+    # Initialize Human Loop Input Object
+    human_loop_input = {}
+    human_loop_input['originalText'] = original_text
+
+    # Carried through the review to the entity list delta written by HumanReviewCompleted
+    if correlation_id:
+        human_loop_input[instrumentation.CORRELATION_ID_INPUT_KEY] = correlation_id
+
+    # Add list of identified entities
+    human_loop_input['entities'] = entities
+
+    # Add a list of types of entities that we need to recognize
+    human_loop_input['labels'] = ENTITY_LABELS
+
+    # Create an attribute to mark the entities that have been
+    # already identified to save time for the Human Reviewers
+    existing_entities = []
+    for entity in human_loop_input['entities']:
+        current_entity = {}
+        current_entity['label'] = entity['Type'].lower()
+        current_entity['startOffset'] = entity['BeginOffset']
+        current_entity['endOffset'] = entity['EndOffset']
+        existing_entities.append(current_entity)
+
+    human_loop_input['initialValue'] = existing_entities
+    return human_loop_input
+
+
+# Get a deterministic Human Loop Name from the identity and the content of a document,
+# so that a redelivered event maps to the Human Loop that was already started
+def get_human_loop_name(document_id, original_text):
+    digest = hashlib.sha256((document_id + '\n' + original_text).encode('utf-8')).hexdigest()
+    return 'tca2i-' + digest[:48]
+
+
+# Submits Human Loops on a bounded thread pool, limited by a token bucket and
+# retried with jittered backoff while A2I throttles. A Human Loop that already
+# exists is reported as a DUPLICATE instead of being created again.
+class HumanLoopSubmitter:
+
+    def __init__(self, a2i_client, flow_definition_arn, max_workers=HUMAN_LOOP_SUBMISSION_CONCURRENCY,
+                 rate_limiter=human_loop_rate_limiter):
+        self.a2i_client = a2i_client
+        self.flow_definition_arn = flow_definition_arn
+        self.rate_limiter = rate_limiter
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._submissions = []
+
+    def submit(self, human_loop_name, human_loop_input):
+        self._submissions.append(self._executor.submit(self._start_human_loop, human_loop_name, human_loop_input))
+        return human_loop_name
+
+    # Wait for every submitted Human Loop
+    # Returns: LIST of {'HumanLoopName', 'Status': STARTED|DUPLICATE|FAILED}
+    def wait(self):
+        results = [submission.result() for submission in self._submissions]
+        self._submissions = []
+        return results
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def _start_human_loop(self, human_loop_name, human_loop_input):
+        def start():
+            self.rate_limiter.acquire()
+            return self.a2i_client.start_human_loop(
+                HumanLoopName=human_loop_name,
+                FlowDefinitionArn=self.flow_definition_arn,
+                HumanLoopInput={
+                    'InputContent': json.dumps(human_loop_input)
+                }
+            )
+
+        print('Starting human loop - ' + human_loop_name)
+        try:
+            call_with_backoff(start)
+            return {'HumanLoopName': human_loop_name, 'Status': 'STARTED'}
+        except ClientError as e:
+            if is_duplicate_human_loop_error(e):
+                print('Human loop already exists - ' + human_loop_name)
+                return {'HumanLoopName': human_loop_name, 'Status': 'DUPLICATE'}
+            print(f'Failed to start human loop {human_loop_name}: {e!r}')
+            return {'HumanLoopName': human_loop_name, 'Status': 'FAILED', 'Error': repr(e)}
+
+
+# Returns: BOOLEAN True if start_human_loop failed because the Human Loop Name is already in use
+def is_duplicate_human_loop_error(error):
+    error_code = error.response['Error']['Code']
+    error_message = error.response['Error'].get('Message', '').lower()
+    return error_code == 'ConflictException' or (error_code == 'ValidationException' and 'already exist' in error_message)
+
+
+# Send a document to the human review, or write its results straight to the
+# accepted results prefix when the review policy does not require a review
+# Returns: STRING 'HUMAN_LOOP' or 'AUTO_ACCEPTED'
+def route_document(s3_client, human_loop_submitter, bucket, processed_data_key, original_text, entities,
+                   review_policy, correlation_id=None):
+    if review_policy.requires_review(entities):
+        human_loop_input = build_human_loop_input(original_text, entities, correlation_id)
+        human_loop_name = get_human_loop_name(processed_data_key, original_text)
+        human_loop_submitter.submit(human_loop_name, human_loop_input)
+        instrumentation.log_event('Human Loop Submitted', correlation_id, human_loop_name=human_loop_name)
+        return 'HUMAN_LOOP'
+
+    accepted_results_key = ACCEPTED_RESULTS_PREFIX + get_document_name(processed_data_key) + '.json'
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=accepted_results_key,
+        Body=json.dumps({'processedDataKey': processed_data_key, 'originalText': original_text,
+                         'entities': entities, 'correlationId': correlation_id})
+    )
+    instrumentation.log_event('Results accepted without human review', correlation_id,
+                              accepted_results_key=accepted_results_key)
+    return 'AUTO_ACCEPTED'
+
+
+# Get the document name of a processed data key (without textract-output/processed/ or .txt)
+def get_document_name(processed_data_key):
+    document_name = processed_data_key
+    if document_name.startswith('textract-output/processed/'):
+        document_name = document_name[len('textract-output/processed/'):]
+    if document_name.endswith('.txt'):
+        document_name = document_name[:-len('.txt')]
+    return document_name
@@ -0,0 +1,199 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Completed human reviews, one by one or in batches.
+#
+# A human loop reviewed by several workers has one answer per worker. Their
+# entity annotations (a span and a label) are consolidated with
+# HUMAN_ANSWER_CONSOLIDATION: "majority" keeps the annotations of more than half
+# of the workers, "union" the annotations of any worker.
+#
+# With HUMAN_REVIEW_BATCH_MODE, HumanReviewCompleted ignores the status change
+# events of the human loops. A scheduled run lists the loop outputs written
+# under the output path of the flow definition since its checkpoint and writes
+# the entities of all of them as a single entity list delta. The checkpoint is
+# the LastModified of the last output processed, with the keys of the outputs
+# that share it. It is stored next to the entity list.
+#
+# A2I writes the output of a loop to
+#   <S3OutputPath>/<flow definition name>/YYYY/MM/DD/hh/mm/ss/<human loop name>/output.json
+# where the date is the creation time of the loop. Outputs are listed from the
+# partition HUMAN_REVIEW_BATCH_LOOKBACK_DAYS before the checkpoint, so a loop
+# that stayed open longer than that is not processed.
+
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import datetime
+import hashlib
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+import entity_store
+
+# "majority" or "union" of the annotations of the workers of a human loop
+HUMAN_ANSWER_CONSOLIDATION = os.environ.get('HUMAN_ANSWER_CONSOLIDATION', 'majority')
+
+# Process the completed human loops in scheduled batches instead of one event at a time
+HUMAN_REVIEW_BATCH_MODE = os.environ.get('HUMAN_REVIEW_BATCH_MODE', 'false').lower() == 'true'
+
+# Maximum number of loop outputs processed by one batch, the others are left for the next one
+HUMAN_REVIEW_BATCH_MAX_LOOPS = int(os.environ.get('HUMAN_REVIEW_BATCH_MAX_LOOPS', '1000'))
+
+# How long a human loop can stay open before its output is written
+HUMAN_REVIEW_BATCH_LOOKBACK_DAYS = int(os.environ.get('HUMAN_REVIEW_BATCH_LOOKBACK_DAYS', '10'))
+
+# Number of loop outputs downloaded in parallel by a batch
+OUTPUT_DOWNLOAD_CONCURRENCY = 8
+
+# Name of the checkpoint object, stored next to the entity list
+CHECKPOINT_FILE_NAME = 'human-review-checkpoint.json'
+
+# Name of the output file of a human loop
+OUTPUT_FILE_NAME = 'output.json'
+
+CONSOLIDATION_RULES = ('majority', 'union')
+
+
+# Returns: LIST of the entity annotations of one worker's answer
+def get_answer_annotations(human_answer):
+    return human_answer['answerContent']['crowd-entity-annotation']['entities']
+
+
+# Annotations of the workers of a human loop that the consolidation rule keeps,
+# each annotation counting once per worker
+# Returns: LIST of {'startOffset', 'endOffset', 'label'} in text order
+def consolidate_annotations(human_answers, rule=None):
+    rule = rule or HUMAN_ANSWER_CONSOLIDATION
+    if rule not in CONSOLIDATION_RULES:
+        raise ValueError(f'Unknown human answer consolidation rule {rule!r}, expected one of {CONSOLIDATION_RULES}')
+
+    votes = collections.Counter()
+    for human_answer in human_answers:
+        votes.update({(annotation['startOffset'], annotation['endOffset'], annotation['label'])
+                      for annotation in get_answer_annotations(human_answer)})
+
+    minimum_votes = 1 if rule == 'union' else len(human_answers) // 2 + 1
+    return [{'startOffset': begin, 'endOffset': end, 'label': label}
+            for (begin, end, label), count in sorted(votes.items()) if count >= minimum_votes]
+
+
+# Unique (text, type) pairs of the consolidated annotations of a human loop output
+def get_review_entities(a2i_output, rule=None):
+    annotations = consolidate_annotations(a2i_output['humanAnswers'], rule)
+    return entity_store.get_annotated_entities(a2i_output['inputContent']['originalText'], annotations)
+
+
+# Location of the loop outputs of a flow definition, from its OutputConfig
+# Returns: TUPLE (bucket, prefix)
+def get_output_location(sagemaker_client, flow_definition_arn):
+    flow_definition_name = flow_definition_arn.split('/')[-1]
+    output_path = sagemaker_client.describe_flow_definition(
+        FlowDefinitionName=flow_definition_name)['OutputConfig']['S3OutputPath']
+    bucket, _, prefix = output_path.replace('s3://', '').partition('/')
+    prefix = prefix.rstrip('/') + '/' if prefix else ''
+    return bucket, prefix + flow_definition_name + '/'
+
+
+class ReviewCheckpoint:
+
+    def __init__(self, last_modified=None, keys=()):
+        # LastModified of the last output processed, and the keys of the processed outputs that share it
+        self.last_modified = last_modified
+        self.keys = set(keys)
+
+    @classmethod
+    def load(cls, s3_client, bucket, key):
+        try:
+            checkpoint_object = s3_client.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            return cls()
+        checkpoint = json.loads(checkpoint_object['Body'].read().decode('utf-8'))
+        return cls(datetime.datetime.fromisoformat(checkpoint['LastModified']), checkpoint['Keys'])
+
+    def save(self, s3_client, bucket, key):
+        s3_client.put_object(Bucket=bucket, Key=key, ContentType='application/json', Body=json.dumps({
+            'LastModified': self.last_modified.isoformat(), 'Keys': sorted(self.keys)}).encode('utf-8'))
+
+    # Returns: BOOLEAN True if the output was written after the checkpoint
+    def is_new(self, output):
+        if self.last_modified is None or output['LastModified'] > self.last_modified:
+            return True
+        return output['LastModified'] == self.last_modified and output['Key'] not in self.keys
+
+    # Move the checkpoint to the last of the outputs processed, in (LastModified, Key) order
+    def advance(self, outputs):
+        if not outputs:
+            return
+        if outputs[-1]['LastModified'] != self.last_modified:
+            self.last_modified, self.keys = outputs[-1]['LastModified'], set()
+        self.keys.update(output['Key'] for output in outputs if output['LastModified'] == self.last_modified)
+
+
+# Location of the checkpoint object for an entity list
+def get_checkpoint_key(entity_list_key):
+    folder = entity_list_key[:entity_list_key.rindex('/') + 1] if '/' in entity_list_key else ''
+    return folder + CHECKPOINT_FILE_NAME
+
+
+# Loop outputs written after the checkpoint, oldest first
+# Returns: LIST of {'Key', 'LastModified'}, at most max_loops
+def list_new_outputs(s3_client, bucket, prefix, checkpoint, max_loops=HUMAN_REVIEW_BATCH_MAX_LOOPS,
+                     lookback_days=HUMAN_REVIEW_BATCH_LOOKBACK_DAYS):
+    list_arguments = {'Bucket': bucket, 'Prefix': prefix}
+    if checkpoint.last_modified is not None:
+        first_partition = checkpoint.last_modified - datetime.timedelta(days=lookback_days)
+        list_arguments['StartAfter'] = prefix + first_partition.strftime('%Y/%m/%d/%H')
+
+    outputs = []
+    while True:
+        response = s3_client.list_objects_v2(**list_arguments)
+        outputs.extend({'Key': listed_object['Key'], 'LastModified': listed_object['LastModified']}
+                       for listed_object in response.get('Contents', [])
+                       if listed_object['Key'].endswith('/' + OUTPUT_FILE_NAME) and checkpoint.is_new(listed_object))
+        if not response.get('IsTruncated'):
+            break
+        list_arguments['ContinuationToken'] = response['NextContinuationToken']
+
+    outputs.sort(key=lambda output: (output['LastModified'], output['Key']))
+    return outputs[:max_loops]
+
+
+# Returns: LIST of the loop outputs (parsed output.json), in the order of the keys
+def load_outputs(s3_client, bucket, output_keys):
+    def load_output(output_key):
+        return json.loads(s3_client.get_object(Bucket=bucket, Key=output_key)['Body'].read().decode('utf-8'))
+
+    with ThreadPoolExecutor(max_workers=OUTPUT_DOWNLOAD_CONCURRENCY) as executor:
+        return list(executor.map(load_output, output_keys))
+
+
+# Name of the delta of a batch. It only depends on the outputs of the batch, so a
+# batch that is run again after a failure overwrites its own delta
+def get_batch_delta_name(output_keys):
+    return 'batch-' + hashlib.sha256('\n'.join(sorted(output_keys)).encode('utf-8')).hexdigest()[:32]
@@ -0,0 +1,167 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Ingestion of the uploaded documents through an SQS queue.
+#
+# S3 sends the notifications of the uploads under input/ to the ingestion
+# queue, which TextractComprehend consumes in batches with at most
+# INGESTION_MAX_CONCURRENCY containers (see api_budgets), so a bulk upload
+# waits in the queue instead of throttling Textract and Comprehend.
+#
+# A message holds an S3 event notification, or the retry of one document (an S3
+# record, or the Textract completion notification of a document whose text
+# detection job had finished when it failed). A
+# document that fails is sent back to the queue as a retry message carrying its
+# retry state (attempts, deferrals and the last error) with an exponential,
+# jittered delay, and to the dead-letter queue after INGESTION_MAX_ATTEMPTS
+# attempts or at once when the error cannot be fixed by a retry. A document
+# deferred because a call budget was exhausted goes back to the queue without
+# counting as an attempt. The redrive policy of the queue itself only catches
+# the messages of invocations that failed as a whole.
+
+import datetime
+import json
+import os
+import random
+
+import instrumentation
+
+INGESTION_QUEUE_URL = os.environ.get('INGESTION_QUEUE_URL', '')
+INGESTION_DEAD_LETTER_QUEUE_URL = os.environ.get('INGESTION_DEAD_LETTER_QUEUE_URL', '')
+
+# Attempts of a document before it is dead-lettered, and the delays between them
+INGESTION_MAX_ATTEMPTS = int(os.environ.get('INGESTION_MAX_ATTEMPTS', '5'))
+INGESTION_RETRY_BASE_SECONDS = int(os.environ.get('INGESTION_RETRY_BASE_SECONDS', '30'))
+INGESTION_DEFERRAL_SECONDS = int(os.environ.get('INGESTION_DEFERRAL_SECONDS', '60'))
+
+# Longest delay SQS accepts for a message
+MAX_DELAY_SECONDS = 900
+
+# Attribute of a retry message holding the retry state of its document
+RETRY_STATE_KEY = 'RetryState'
+
+# Error codes of documents that no retry can process. LimitExceededException is a quota of the
+# account (e.g. concurrent jobs) being exceeded, not throttling that clears within the retry delays
+PERMANENT_ERROR_CODES = ('InvalidS3ObjectException', 'UnsupportedDocumentException', 'BadDocumentException',
+                         'DocumentTooLargeException', 'InvalidParameterException', 'LimitExceededException',
+                         'NoSuchKey', '404', 'NotFound')
+
+# Error code of the documents deferred by an exhausted call budget
+BUDGET_EXHAUSTED_ERROR_CODE = 'BudgetExhausted'
+
+
+# Returns: BOOLEAN True if the event is a batch of messages of the ingestion queue
+def is_ingestion_event(event):
+    records = event.get('Records') or []
+    return bool(records) and records[0].get('eventSource') == 'aws:sqs'
+
+
+# Unpack the records of the messages of an ingestion event
+# Returns: LIST of {'MessageId', 'Record', 'RetryState'}, one per document
+def get_documents(sqs_records):
+    documents = []
+    for message in sqs_records:
+        body = json.loads(message['body'])
+        retry_state = body.get(RETRY_STATE_KEY) or new_retry_state()
+        # The s3:TestEvent sent when the notification is configured has no records
+        for record in body.get('Records', []):
+            documents.append({'MessageId': message['messageId'], 'Record': record, 'RetryState': retry_state})
+    return documents
+
+
+def new_retry_state():
+    return {'Attempts': 0, 'Deferrals': 0, 'LastError': None,
+            'FirstReceived': datetime.datetime.now(datetime.timezone.utc).isoformat()}
+
+
+# Returns: INTEGER seconds before the next attempt of a document that failed attempts times
+def get_retry_delay(attempts):
+    return random.randint(0, min(MAX_DELAY_SECONDS, INGESTION_RETRY_BASE_SECONDS * 2 ** (attempts - 1)))
+
+
+# Send the failed documents of an ingestion event back to the queue or to the dead-letter queue
+# Returns: LIST of {'itemIdentifier'} of the messages to receive again (the partial batch response)
+def settle(sqs_client, documents, results, queue_url=None, dead_letter_queue_url=None):
+    queue_url = queue_url or INGESTION_QUEUE_URL
+    dead_letter_queue_url = dead_letter_queue_url or INGESTION_DEAD_LETTER_QUEUE_URL
+
+    failed_message_ids = []
+    for document, result in zip(documents, results):
+        if result['status'] != 'FAILED':
+            continue
+        try:
+            requeue_document(sqs_client, document, result, queue_url, dead_letter_queue_url)
+        except Exception as e:
+            # The whole message is received again, its redrive policy dead-letters it in the end
+            print(f"Failed to requeue {result['key']}: {e!r}")
+            if document['MessageId'] not in failed_message_ids:
+                failed_message_ids.append(document['MessageId'])
+    return [{'itemIdentifier': message_id} for message_id in failed_message_ids]
+
+
+# Hand the failed records of an event that did not come from the ingestion queue (the
+# Textract completion notifications) to the queue, which retries or dead-letters them
+# Returns: LIST of the results of the records that could not be sent to the queue
+def requeue_failed_records(sqs_client, failed_results, queue_url=None, dead_letter_queue_url=None):
+    queue_url = queue_url or INGESTION_QUEUE_URL
+    dead_letter_queue_url = dead_letter_queue_url or INGESTION_DEAD_LETTER_QUEUE_URL
+    if not queue_url:
+        return failed_results
+
+    not_requeued = []
+    for result in failed_results:
+        document = {'MessageId': None, 'Record': result['record'], 'RetryState': new_retry_state()}
+        try:
+            requeue_document(sqs_client, document, result, queue_url, dead_letter_queue_url)
+        except Exception as e:
+            print(f"Failed to requeue {result['key']}: {e!r}")
+            not_requeued.append(result)
+    return not_requeued
+
+
+# Send one failed document back to the queue with its updated retry state, or to the dead-letter queue
+# Returns: STRING 'DEFERRED', 'RETRY' or 'DEAD_LETTER'
+def requeue_document(sqs_client, document, result, queue_url, dead_letter_queue_url):
+    retry_state = dict(document['RetryState'], LastError=result.get('error'))
+    error_code = result.get('error_code')
+    correlation_id = instrumentation.get_correlation_id(result['bucket'], result['key'])
+
+    if error_code == BUDGET_EXHAUSTED_ERROR_CODE:
+        retry_state['Deferrals'] += 1
+        outcome, target_url = 'DEFERRED', queue_url
+        delay = random.randint(INGESTION_DEFERRAL_SECONDS // 2, INGESTION_DEFERRAL_SECONDS)
+    else:
+        retry_state['Attempts'] += 1
+        if error_code in PERMANENT_ERROR_CODES or retry_state['Attempts'] >= INGESTION_MAX_ATTEMPTS:
+            outcome, target_url, delay = 'DEAD_LETTER', dead_letter_queue_url, 0
+        else:
+            outcome, target_url, delay = 'RETRY', queue_url, get_retry_delay(retry_state['Attempts'])
+
+    sqs_client.send_message(QueueUrl=target_url, DelaySeconds=delay,
+                            MessageBody=json.dumps({'Records': [document['Record']], RETRY_STATE_KEY: retry_state}))
+    instrumentation.log_event('Document ' + {'DEFERRED': 'Deferred', 'RETRY': 'Retry Scheduled',
+                                             'DEAD_LETTER': 'Dead-Lettered'}[outcome],
+                              correlation_id, key=result['key'], delay_seconds=delay, error_code=error_code,
+                              attempts=retry_state['Attempts'], deferrals=retry_state['Deferrals'])
+    return outcome
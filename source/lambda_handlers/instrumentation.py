@@ -0,0 +1,214 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Instrumentation shared by the Textract Comprehend A2I Lambda functions.
+#
+# Clients created with instrumentation.client() are proxies around the boto3
+# clients that time every call and capture its payload sizes. At the end of an
+# invocation of a handler decorated with @instrumented, the calls are emitted as
+# CloudWatch Embedded Metric Format (EMF) log lines, one per API operation, so
+# that the Lambda logs turn into Latency/Calls/Errors/Bytes metrics without any
+# PutMetricData call.
+#
+# A document keeps the same correlation id from its upload to the retraining its
+# annotations cause: it is derived from the uploaded object and travels in the
+# Comprehend job name (or batch manifest), the processed text metadata, the
+# human loop input and the entity list delta metadata.
+
+import functools
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+
+import boto3
+
+METRICS_NAMESPACE = os.environ.get('TCA2I_METRICS_NAMESPACE', 'TextractComprehendA2I')
+METRICS_ENABLED = os.environ.get('TCA2I_METRICS_ENABLED', 'true').lower() == 'true'
+
+# S3 user metadata and human loop input attribute holding the correlation id
+CORRELATION_ID_METADATA_KEY = 'correlation-id'
+CORRELATION_ID_INPUT_KEY = 'correlationId'
+
+# Request parameters and response fields whose size is captured as payload bytes
+REQUEST_PAYLOAD_PARAMETERS = ('Body', 'Bytes', 'Text', 'TextList', 'HumanLoopInput')
+RESPONSE_PAYLOAD_FIELDS = ('ContentLength',)
+
+
+# Correlation id of the document uploaded to bucket/key
+def get_correlation_id(bucket, key):
+    return 'doc-' + hashlib.sha256((bucket + '/' + key).encode('utf-8')).hexdigest()[:20]
+
+
+def _payload_size(value):
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (list, tuple)):
+        return sum(_payload_size(item) for item in value)
+    if isinstance(value, dict):
+        return len(json.dumps(value, default=str).encode('utf-8'))
+    # File objects and streams are not read just to be measured
+    return 0
+
+
+class MetricsRecorder:
+
+    def __init__(self, namespace=METRICS_NAMESPACE, clock=time.perf_counter):
+        self.namespace = namespace
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.function_name = None
+        self.reset()
+
+    def reset(self, function_name=None):
+        with self._lock:
+            self.function_name = function_name
+            # 'service.Operation' -> {'Calls', 'Errors', 'LatencyMilliseconds', 'RequestBytes', 'ResponseBytes'}
+            self.operations = {}
+
+    def record_call(self, operation, latency_seconds, request_bytes=0, response_bytes=0, error=False):
+        with self._lock:
+            totals = self.operations.setdefault(operation, {'Calls': 0, 'Errors': 0, 'LatencyMilliseconds': 0.0,
+                                                            'RequestBytes': 0, 'ResponseBytes': 0})
+            totals['Calls'] += 1
+            totals['Errors'] += 1 if error else 0
+            totals['LatencyMilliseconds'] += latency_seconds * 1000
+            totals['RequestBytes'] += request_bytes
+            totals['ResponseBytes'] += response_bytes
+
+    # Returns: LIST of EMF documents, one per API operation plus one for the invocation
+    def build_emf_documents(self, duration_seconds=None, timestamp=None):
+        timestamp = int((timestamp or time.time()) * 1000)
+        with self._lock:
+            operations = {operation: dict(totals) for operation, totals in self.operations.items()}
+
+        documents = []
+        for operation, totals in sorted(operations.items()):
+            documents.append({
+                '_aws': {'Timestamp': timestamp, 'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Function', 'Operation']],
+                    'Metrics': [{'Name': 'Calls', 'Unit': 'Count'},
+                                {'Name': 'Errors', 'Unit': 'Count'},
+                                {'Name': 'LatencyMilliseconds', 'Unit': 'Milliseconds'},
+                                {'Name': 'RequestBytes', 'Unit': 'Bytes'},
+                                {'Name': 'ResponseBytes', 'Unit': 'Bytes'}]}]},
+                'Function': self.function_name or 'unknown',
+                'Operation': operation,
+                **{name: round(value, 3) if isinstance(value, float) else value for name, value in totals.items()}
+            })
+
+        if duration_seconds is not None:
+            documents.append({
+                '_aws': {'Timestamp': timestamp, 'CloudWatchMetrics': [{
+                    'Namespace': self.namespace,
+                    'Dimensions': [['Function']],
+                    'Metrics': [{'Name': 'InvocationMilliseconds', 'Unit': 'Milliseconds'},
+                                {'Name': 'ApiCalls', 'Unit': 'Count'}]}]},
+                'Function': self.function_name or 'unknown',
+                'InvocationMilliseconds': round(duration_seconds * 1000, 3),
+                'ApiCalls': sum(totals['Calls'] for totals in operations.values())
+            })
+        return documents
+
+    def emit(self, duration_seconds=None):
+        if not METRICS_ENABLED:
+            return
+        for document in self.build_emf_documents(duration_seconds):
+            _write_log_line(json.dumps(document))
+
+
+# Module scope recorder shared by the clients and the handler of this container
+metrics = MetricsRecorder()
+
+
+# Proxy around a boto3 client recording the latency, errors and payload sizes of its calls
+class InstrumentedClient:
+
+    def __init__(self, client, service_name, recorder=None):
+        self._client = client
+        self._service_name = service_name
+        self._recorder = recorder or metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute) or name.startswith('_') or name in ('get_paginator', 'get_waiter', 'can_paginate'):
+            return attribute
+
+        operation = self._service_name + '.' + ''.join(part.capitalize() for part in name.split('_'))
+
+        @functools.wraps(attribute)
+        def call(*args, **kwargs):
+            request_bytes = sum(_payload_size(kwargs.get(parameter)) for parameter in REQUEST_PAYLOAD_PARAMETERS)
+            start = self._recorder.clock()
+            try:
+                response = attribute(*args, **kwargs)
+            except Exception:
+                self._recorder.record_call(operation, self._recorder.clock() - start, request_bytes, error=True)
+                raise
+            response_bytes = 0
+            if isinstance(response, dict):
+                response_bytes = sum(response.get(field) or 0 for field in RESPONSE_PAYLOAD_FIELDS)
+            self._recorder.record_call(operation, self._recorder.clock() - start, request_bytes, response_bytes)
+            return response
+
+        return call
+
+
+# Create an instrumented boto3 client
+def client(service_name, *args, **kwargs):
+    return InstrumentedClient(boto3.client(service_name, *args, **kwargs), service_name)
+
+
+# Decorator for the lambda_handler functions: starts a fresh set of metrics for the
+# invocation and emits them when it ends, whether it succeeded or not
+def instrumented(function_name):
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            metrics.reset(function_name)
+            start = time.perf_counter()
+            try:
+                return handler(event, context)
+            finally:
+                metrics.emit(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+# Structured log line tying an event of the pipeline to a document's correlation id
+def log_event(message, correlation_id=None, **fields):
+    _write_log_line(json.dumps({'message': message, 'correlationId': correlation_id, **fields}, default=str))
+
+
+# Lines are written in one call, so that lines logged by concurrent threads don't interleave
+def _write_log_line(line):
+    sys.stdout.write(line + '\n')
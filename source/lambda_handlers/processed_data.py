@@ -0,0 +1,187 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Processed text of a document and the index of its spans.
+#
+# The processed text (textract-output/processed/) is the text recreated from
+# the Textract blocks, written as plain UTF-8 so that the character offsets of
+# Comprehend and of the human reviewers are offsets in the text itself. Texts
+# written before were JSON encoded, they are told apart by their metadata.
+#
+# Next to it, the span index (textract-output/span-index/) lists the LINE and
+# WORD blocks of the text in text order with their character span, block Id,
+# page and bounding box, as sorted columns. The blocks overlapping an entity
+# span are found with two binary searches, without reading the raw Textract
+# output.
+
+from array import array
+from bisect import bisect_left, bisect_right
+import json
+
+from botocore.exceptions import ClientError
+
+# S3 user metadata of a processed text telling how its text is encoded
+TEXT_FORMAT_METADATA_KEY = 'text-format'
+PLAIN_TEXT_FORMAT = 'plain'
+
+SPAN_INDEX_FORMAT_NAME = 'tca2i-span-index'
+SPAN_INDEX_FORMAT_VERSION = 1
+SPAN_INDEX_PREFIX = 'textract-output/span-index/'
+PROCESSED_DATA_PREFIX = 'textract-output/processed/'
+
+
+# Returns: STRING text of a processed text object, given its body (bytes) and its user metadata
+def decode(body, metadata=None):
+    text = body.decode('utf-8')
+    if (metadata or {}).get(TEXT_FORMAT_METADATA_KEY) == PLAIN_TEXT_FORMAT:
+        return text
+    # Written as a JSON string before the text was stored as plain text
+    return json.loads(text)
+
+
+# Returns: DICTIONARY user metadata identifying the encoding of a processed text
+def get_metadata():
+    return {TEXT_FORMAT_METADATA_KEY: PLAIN_TEXT_FORMAT}
+
+
+# Key of the span index of a processed text
+def get_span_index_key(processed_data_key):
+    name = processed_data_key
+    if name.startswith(PROCESSED_DATA_PREFIX):
+        name = name[len(PROCESSED_DATA_PREFIX):]
+    if name.endswith('.txt'):
+        name = name[:-len('.txt')]
+    return SPAN_INDEX_PREFIX + name + '.json'
+
+
+# Sorted columns of the blocks of one type: the blocks do not overlap and are in
+# text order, so both their start and their end offsets are increasing
+class _BlockColumns:
+    __slots__ = ('starts', 'ends', 'ids', 'pages', 'bounding_boxes')
+
+    def __init__(self, starts=(), ends=(), ids=(), pages=(), bounding_boxes=()):
+        self.starts = array('q', starts)
+        self.ends = array('q', ends)
+        self.ids = list(ids)
+        self.pages = list(pages)
+        self.bounding_boxes = list(bounding_boxes)
+
+    @classmethod
+    def from_records(cls, records):
+        return cls([record.start for record in records], [record.end for record in records],
+                   [record.id for record in records], [record.page for record in records],
+                   [list(record.bounding_box) if record.bounding_box else None for record in records])
+
+    def to_dict(self):
+        return {'Starts': self.starts.tolist(), 'Ends': self.ends.tolist(), 'Ids': self.ids, 'Pages': self.pages,
+                'BoundingBoxes': self.bounding_boxes}
+
+    @classmethod
+    def from_dict(cls, columns):
+        return cls(columns['Starts'], columns['Ends'], columns['Ids'], columns['Pages'], columns['BoundingBoxes'])
+
+    # Returns: RANGE of the indexes of the blocks overlapping the [begin, end) span
+    def overlapping(self, begin, end):
+        return range(bisect_right(self.ends, begin), bisect_left(self.starts, end))
+
+    def block(self, index):
+        bounding_box = self.bounding_boxes[index]
+        if bounding_box is not None:
+            bounding_box = dict(zip(('Left', 'Top', 'Width', 'Height'), bounding_box))
+        return {'BlockId': self.ids[index], 'Page': self.pages[index], 'BoundingBox': bounding_box}
+
+
+class SpanIndex:
+
+    def __init__(self, text_length, lines, words):
+        self.text_length = text_length
+        self.lines = lines
+        self.words = words
+
+    # Build the index of the text of a TextractDocument
+    @classmethod
+    def from_document(cls, document):
+        return cls(len(document.text), _BlockColumns.from_records(document.lines),
+                   _BlockColumns.from_records(document.words))
+
+    def to_json(self):
+        return json.dumps({'Format': SPAN_INDEX_FORMAT_NAME, 'Version': SPAN_INDEX_FORMAT_VERSION,
+                           'TextLength': self.text_length, 'Lines': self.lines.to_dict(),
+                           'Words': self.words.to_dict()}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, content):
+        index = json.loads(content)
+        if index.get('Format') != SPAN_INDEX_FORMAT_NAME or index.get('Version') != SPAN_INDEX_FORMAT_VERSION:
+            raise ValueError(f"Unsupported span index format {index.get('Format')} {index.get('Version')}")
+        return cls(index['TextLength'], _BlockColumns.from_dict(index['Lines']), _BlockColumns.from_dict(index['Words']))
+
+    # Returns: LIST of {'BlockId', 'Page', 'BoundingBox'} of the LINE blocks overlapping the [begin, end) span
+    def lines_in_span(self, begin, end):
+        return [self.lines.block(index) for index in self.lines.overlapping(begin, end)]
+
+    # Returns: LIST of {'BlockId', 'Page', 'BoundingBox'} of the WORD blocks overlapping the [begin, end) span
+    def words_in_span(self, begin, end):
+        return [self.words.block(index) for index in self.words.overlapping(begin, end)]
+
+    # Returns: LIST of the WORD blocks of a span, or its LINE blocks if none of its words were located
+    def boxes_in_span(self, begin, end):
+        return self.words_in_span(begin, end) or self.lines_in_span(begin, end)
+
+    # Returns: LIST of copies of the entities with the 'Geometry' of their blocks
+    def annotate_entities(self, entities):
+        return [dict(entity, Geometry=self.boxes_in_span(entity['BeginOffset'], entity['EndOffset']))
+                for entity in entities]
+
+
+def put_span_index(s3_client, bucket, processed_data_key, span_index):
+    s3_client.put_object(Bucket=bucket, Key=get_span_index_key(processed_data_key), Body=span_index.to_json(),
+                         ContentType='application/json')
+
+
+# Returns: SpanIndex of a processed text, or None if it has none (it was written before the index existed)
+def get_span_index(s3_client, bucket, processed_data_key):
+    try:
+        index_object = s3_client.get_object(Bucket=bucket, Key=get_span_index_key(processed_data_key))
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+    return SpanIndex.from_json(index_object['Body'].read())
+
+
+# Copy the span index of a processed text (if it has one) to another processed text
+def copy_span_index(s3_client, bucket, source_processed_data_key, processed_data_key):
+    try:
+        s3_client.copy_object(CopySource={'Bucket': bucket, 'Key': get_span_index_key(source_processed_data_key)},
+                              Bucket=bucket, Key=get_span_index_key(processed_data_key))
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            raise
+
+
+# Annotate entities with their geometry when the processed text has a span index
+# Returns: LIST of entities
+def annotate_entities(span_index, entities):
+    return span_index.annotate_entities(entities) if span_index is not None else entities
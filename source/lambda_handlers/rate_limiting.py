@@ -0,0 +1,84 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Client-side rate limiting shared by the threads of a Lambda container.
+
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Error codes returned by AWS services when a request is throttled
+THROTTLING_ERROR_CODES = ('ThrottlingException', 'Throttling', 'TooManyRequestsException',
+                          'ProvisionedThroughputExceededException', 'RequestLimitExceeded')
+
+# Error codes retried with backoff: throttling and transient server errors
+RETRYABLE_ERROR_CODES = THROTTLING_ERROR_CODES + ('InternalServerException',)
+
+
+# Token bucket refilled at rate tokens per second, holding at most capacity tokens
+class TokenBucket:
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(capacity)
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    # Take tokens from the bucket, waiting for them to be refilled for at most
+    # timeout seconds (forever if timeout is None)
+    # Returns: BOOLEAN True if the tokens were taken
+    def acquire(self, tokens=1, timeout=None):
+        deadline = None if timeout is None else self.clock() + timeout
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+
+            if deadline is not None and now + wait > deadline:
+                return False
+            self.sleep(wait)
+
+
+# Call function, retrying with exponential backoff and full jitter while AWS throttles it
+# or fails with a transient server error
+def call_with_backoff(function, max_attempts=5, base_delay=0.2, max_delay=5.0, retryable_codes=RETRYABLE_ERROR_CODES,
+                      sleep=time.sleep):
+    for attempt in range(max_attempts):
+        try:
+            return function()
+        except ClientError as e:
+            if e.response['Error']['Code'] not in retryable_codes or attempt == max_attempts - 1:
+                raise
+            sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
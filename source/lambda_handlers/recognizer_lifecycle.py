@@ -0,0 +1,140 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Promotion and retirement of Comprehend Custom Entity Recognizers.
+#
+# CustomEntityRecognizerARN-TCA2I is overwritten in place when a new recognizer
+# is promoted, so TextractComprehend always reads a valid ARN. The previous
+# recognizer is not deleted straight away: it is added to the retired recognizers
+# (RetiredCustomEntityRecognizerARNs-TCA2I, a JSON object of ARN -> retirement
+# time) and only deleted once
+#   - containers that may still serve the old ARN from their parameter cache
+#     have refreshed it (RETIRED_RECOGNIZER_GRACE_SECONDS), and
+#   - no entity detection job using it is SUBMITTED or IN_PROGRESS anymore.
+# A retired recognizer still served by a real-time endpoint can't be deleted; it
+# is dropped from the retired recognizers and logged for manual cleanup.
+
+import collections
+import json
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+import tca2i_config
+
+RECOGNIZER_PARAMETER = 'CustomEntityRecognizerARN-TCA2I'
+RETIRED_RECOGNIZERS_PARAMETER = 'RetiredCustomEntityRecognizerARNs-TCA2I'
+
+# Minimum time between the retirement and the deletion of a recognizer, longer than
+# the parameter cache TTL of the functions starting entity detection jobs
+RETIRED_RECOGNIZER_GRACE_SECONDS = float(os.environ.get(
+    'RETIRED_RECOGNIZER_GRACE_SECONDS', str(tca2i_config.PARAMETER_CACHE_TTL_SECONDS + 60)))
+
+# Delay between two checks of the retired recognizers
+RETIRED_RECOGNIZER_DRAIN_POLL_SECONDS = int(os.environ.get('RETIRED_RECOGNIZER_DRAIN_POLL_SECONDS', '300'))
+
+# Entity detection jobs in these states still need their recognizer
+IN_FLIGHT_JOB_STATUSES = ('SUBMITTED', 'IN_PROGRESS')
+
+
+# Returns: DICTIONARY of retired recognizer ARN -> retirement time (epoch seconds)
+def load_retired_recognizers(ssm_client):
+    try:
+        value = ssm_client.get_parameter(Name=RETIRED_RECOGNIZERS_PARAMETER)['Parameter']['Value']
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ParameterNotFound':
+            raise
+        return {}
+    return {} if value == 'NotActive' else json.loads(value)
+
+
+def save_retired_recognizers(ssm_client, retired_recognizers):
+    tca2i_config.put_parameter(ssm_client, RETIRED_RECOGNIZERS_PARAMETER,
+                               json.dumps(retired_recognizers, sort_keys=True) if retired_recognizers else 'NotActive')
+
+
+# Point CustomEntityRecognizerARN-TCA2I to the new recognizer and retire the previous one
+def promote_recognizer(ssm_client, new_recognizer_arn, previous_recognizer_arn, clock=time.time):
+    tca2i_config.put_parameter(ssm_client, RECOGNIZER_PARAMETER, new_recognizer_arn)
+    if previous_recognizer_arn in (None, 'NotActive', new_recognizer_arn):
+        return
+
+    retired_recognizers = load_retired_recognizers(ssm_client)
+    retired_recognizers.setdefault(previous_recognizer_arn, clock())
+    save_retired_recognizers(ssm_client, retired_recognizers)
+
+
+# Returns: COUNTER of recognizer ARN -> number of its SUBMITTED or IN_PROGRESS entity detection jobs
+def count_in_flight_jobs(comprehend_client):
+    in_flight_jobs = collections.Counter()
+    for job_status in IN_FLIGHT_JOB_STATUSES:
+        list_arguments = {'Filter': {'JobStatus': job_status}}
+        while True:
+            response = comprehend_client.list_entities_detection_jobs(**list_arguments)
+            for job in response.get('EntitiesDetectionJobPropertiesList', []):
+                if job.get('EntityRecognizerArn'):
+                    in_flight_jobs[job['EntityRecognizerArn']] += 1
+            if not response.get('NextToken'):
+                break
+            list_arguments['NextToken'] = response['NextToken']
+    return in_flight_jobs
+
+
+# Delete the retired recognizers whose grace period is over and whose jobs have drained
+# Returns: DICTIONARY of the recognizers that are still retired
+def drain_retired_recognizers(ssm_client, comprehend_client, clock=time.time):
+    retired_recognizers = load_retired_recognizers(ssm_client)
+    if not retired_recognizers:
+        return retired_recognizers
+
+    now = clock()
+    in_flight_jobs = count_in_flight_jobs(comprehend_client)
+    remaining_recognizers = {}
+    for recognizer_arn, retired_at in retired_recognizers.items():
+        if now - retired_at < RETIRED_RECOGNIZER_GRACE_SECONDS or in_flight_jobs[recognizer_arn]:
+            print(f"Retired Custom Entity Recognizer {recognizer_arn} still has "
+                  f"{in_flight_jobs[recognizer_arn]} entity detection jobs in flight")
+            remaining_recognizers[recognizer_arn] = retired_at
+            continue
+
+        try:
+            comprehend_client.delete_entity_recognizer(EntityRecognizerArn=recognizer_arn)
+            print(f"Deleted retired Custom Entity Recognizer {recognizer_arn}")
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if error_code == 'ResourceNotFoundException':
+                continue
+            if error_code != 'ResourceInUseException':
+                raise
+            # Its jobs have drained, so a real-time endpoint still serves the recognizer. The
+            # endpoint is not managed by this stack: the recognizer is no longer checked and is
+            # left to be deleted once the endpoint has been moved to another model
+            print(f"Retired Custom Entity Recognizer {recognizer_arn} is still served by an endpoint, "
+                  f"delete it manually once the endpoint uses another model")
+
+    if remaining_recognizers != retired_recognizers:
+        save_retired_recognizers(ssm_client, remaining_recognizers)
+    return remaining_recognizers
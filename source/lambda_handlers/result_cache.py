@@ -0,0 +1,123 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Content-addressed cache of the results of the documents already processed.
+#
+# Users re-upload the same scan under new names. An entry is keyed on the S3
+# ETag and size of the uploaded object and on the version of the Custom Entity
+# Recognizer, so a re-upload can reuse the Textract blocks, the processed text
+# and (once Comprehend has returned them) the entities of the first upload
+# instead of running Textract, Comprehend and a human review again.
+#
+# The ETag of a multipart upload depends on the part size as well as on the
+# content, so the same file uploaded with another part size is only a miss.
+#
+# Entries live under result-cache/<recognizer version>/ in the primary bucket.
+# Entries of other recognizer versions can no longer be hit, and are evicted by
+# CERTrainingCompleteCheck when it promotes a new recognizer.
+
+import hashlib
+import json
+import os
+
+from botocore.exceptions import ClientError
+
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+
+RESULT_CACHE_PREFIX = 'result-cache/'
+
+# S3 user metadata of a processed text holding the key of its cache entry,
+# so that ComprehendA2I can add the entities to the entry
+CACHE_KEY_METADATA_KEY = 'result-cache-key'
+
+# Maximum number of keys of a DeleteObjects request
+S3_DELETE_OBJECTS_MAX_KEYS = 1000
+
+
+# Version of a Custom Entity Recognizer, every promotion changes the ARN in use
+def get_recognizer_version(recognizer_arn):
+    return hashlib.sha256(recognizer_arn.encode('utf-8')).hexdigest()[:16]
+
+
+# Key of the cache entry of an uploaded object for a Custom Entity Recognizer
+def get_cache_key(etag, size, recognizer_arn):
+    return (RESULT_CACHE_PREFIX + get_recognizer_version(recognizer_arn) + '/'
+            + etag.strip('"') + '-' + str(size) + '.json')
+
+
+# Returns: DICTIONARY cache entry {'ProcessedDataKey', 'CorrelationId', 'Entities', 'HumanLoopName'}
+#          (Entities and HumanLoopName are None until Comprehend has returned), or None on a miss
+def get_entry(s3_client, bucket, cache_key):
+    try:
+        entry_object = s3_client.get_object(Bucket=bucket, Key=cache_key)
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('404', 'NoSuchKey', 'NotFound'):
+            # The cache is an optimization, a failed lookup is processed as a miss
+            print(f'Failed to read the result cache entry {cache_key}: {e!r}')
+        return None
+    return json.loads(entry_object['Body'].read().decode('utf-8'))
+
+
+# Write the entry of a document. The entry only points to the processed text of the document
+# (its Textract blocks are stored under the same name) and holds its entities, so writing it
+# again once the entities are known needs no read.
+def put_entry(s3_client, bucket, cache_key, processed_data_key, correlation_id=None, entities=None,
+              human_loop_name=None):
+    s3_client.put_object(Bucket=bucket, Key=cache_key, ContentType='application/json', Body=json.dumps({
+        'ProcessedDataKey': processed_data_key,
+        'CorrelationId': correlation_id,
+        'Entities': entities,
+        'HumanLoopName': human_loop_name
+    }).encode('utf-8'))
+
+
+# Delete the entries of every recognizer version but the one of recognizer_arn
+# Returns: INTEGER number of entries deleted
+def evict_stale_entries(s3_client, bucket, recognizer_arn):
+    current_prefix = RESULT_CACHE_PREFIX + get_recognizer_version(recognizer_arn) + '/'
+
+    stale_prefixes = []
+    list_arguments = {'Bucket': bucket, 'Prefix': RESULT_CACHE_PREFIX, 'Delimiter': '/'}
+    while True:
+        response = s3_client.list_objects_v2(**list_arguments)
+        stale_prefixes.extend(common_prefix['Prefix'] for common_prefix in response.get('CommonPrefixes', [])
+                              if common_prefix['Prefix'] != current_prefix)
+        if not response.get('IsTruncated'):
+            break
+        list_arguments['ContinuationToken'] = response['NextContinuationToken']
+
+    deleted_entries = 0
+    for stale_prefix in stale_prefixes:
+        list_arguments = {'Bucket': bucket, 'Prefix': stale_prefix, 'MaxKeys': S3_DELETE_OBJECTS_MAX_KEYS}
+        while True:
+            response = s3_client.list_objects_v2(**list_arguments)
+            entry_keys = [entry_object['Key'] for entry_object in response.get('Contents', [])]
+            if entry_keys:
+                s3_client.delete_objects(Bucket=bucket,
+                                         Delete={'Objects': [{'Key': entry_key} for entry_key in entry_keys]})
+                deleted_entries += len(entry_keys)
+            if not response.get('IsTruncated'):
+                break
+            list_arguments['ContinuationToken'] = response['NextContinuationToken']
+    return deleted_entries
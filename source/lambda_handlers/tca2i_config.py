@@ -0,0 +1,178 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Shared configuration layer for the Textract Comprehend A2I Lambda functions.
+#
+# The *-TCA2I parameters are cached at module scope so that a warm Lambda
+# container only goes back to SSM Parameter Store once the TTL has expired.
+# Every refresh compares the parameter Version returned by SSM with the cached
+# one, so a parameter that was overwritten (e.g. CustomEntityRecognizerARN-TCA2I
+# after a retraining) is picked up on the first refresh after the change. A
+# version change also drops the other cached parameters, so that parameters
+# written together (a recognizer and its endpoint) are read again together.
+
+import os
+import threading
+import time
+
+import instrumentation
+
+# Number of seconds a cached parameter is served before SSM is asked again
+PARAMETER_CACHE_TTL_SECONDS = float(os.environ.get('TCA2I_PARAMETER_CACHE_TTL_SECONDS', '300'))
+
+# GetParameters accepts at most 10 names per request
+SSM_GET_PARAMETERS_MAX_NAMES = 10
+
+
+class ParameterCache:
+
+    def __init__(self, ssm_client=None, ttl_seconds=PARAMETER_CACHE_TTL_SECONDS, clock=time.monotonic):
+        self.ssm_client = ssm_client
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+
+        # Parameter Name -> {'Value', 'Version', 'ExpiresAt'}
+        self._entries = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.invalidations = 0
+
+    # Return a dictionary of Name -> Value for the requested parameters,
+    # only calling SSM for the parameters that are missing or expired
+    def get_parameters(self, names):
+        with self._lock:
+            now = self.clock()
+            stale_names = []
+            for name in names:
+                entry = self._entries.get(name)
+                if entry is not None and entry['ExpiresAt'] > now:
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                    stale_names.append(name)
+
+            if stale_names:
+                self._refresh(stale_names, now)
+
+            return {name: self._entries[name]['Value'] for name in names if name in self._entries}
+
+    # Return the value of a single parameter, or None if it does not exist
+    def get_parameter(self, name):
+        return self.get_parameters([name]).get(name)
+
+    # Return the SSM Version of a cached parameter (refreshing it if needed)
+    def get_version(self, name):
+        self.get_parameters([name])
+        with self._lock:
+            entry = self._entries.get(name)
+            return entry['Version'] if entry is not None else None
+
+    # Record a value that this container has just written to SSM so that it
+    # does not have to wait for the TTL to expire to see its own update
+    def record(self, name, value, version):
+        with self._lock:
+            self._store(name, value, version, self.clock())
+
+    # Drop one (or all) of the cached parameters
+    def invalidate(self, name=None):
+        with self._lock:
+            if name is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(name, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'refreshes': self.refreshes,
+                'invalidations': self.invalidations,
+                'cached_parameters': len(self._entries)
+            }
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.refreshes = 0
+            self.invalidations = 0
+
+    def _refresh(self, names, now):
+        if self.ssm_client is None:
+            self.ssm_client = instrumentation.client('ssm')
+
+        for start in range(0, len(names), SSM_GET_PARAMETERS_MAX_NAMES):
+            response = self.ssm_client.get_parameters(Names=names[start:start + SSM_GET_PARAMETERS_MAX_NAMES],
+                                                      WithDecryption=True)
+            self.refreshes += 1
+
+            changed_names = [parameter['Name'] for parameter in response['Parameters']
+                             if self._store(parameter['Name'], parameter['Value'], parameter.get('Version'), now)]
+            if changed_names:
+                for name in set(self._entries) - set(names):
+                    del self._entries[name]
+                    self.invalidations += 1
+
+            # Parameters that have been deleted must not be served from the cache
+            for name in response.get('InvalidParameters', []):
+                if self._entries.pop(name, None) is not None:
+                    self.invalidations += 1
+
+    # Returns: BOOLEAN True if a cached value of another Version was replaced
+    def _store(self, name, value, version, now):
+        entry = self._entries.get(name)
+        if entry is not None and version is not None and entry['Version'] is not None \
+                and entry['Version'] > version:
+            # SSM may still return the previous version of a parameter this container has just written
+            entry['ExpiresAt'] = now + self.ttl_seconds
+            return False
+
+        changed = entry is not None and (entry['Version'] != version or entry['Value'] != value)
+        if changed:
+            self.invalidations += 1
+        self._entries[name] = {'Value': value, 'Version': version, 'ExpiresAt': now + self.ttl_seconds}
+        return changed
+
+
+# Module scope cache shared by every invocation served by this container
+parameter_cache = ParameterCache()
+
+
+def get_parameters(names):
+    return parameter_cache.get_parameters(names)
+
+
+# Overwrite a parameter in place, so that readers always find either the previous
+# or the new value, and serve the new value from this container's cache right away
+# Returns: INTEGER the new Version of the parameter
+def put_parameter(ssm_client, name, value):
+    put_parameter_response = ssm_client.put_parameter(Name=name, Type="String", Value=value, Overwrite=True)
+    parameter_cache.record(name, value, put_parameter_response['Version'])
+    return put_parameter_response['Version']
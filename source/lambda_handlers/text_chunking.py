@@ -0,0 +1,144 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Entity detection on long texts in overlapping windows.
+#
+# A text longer than one request of the real-time endpoint is split into
+# windows of at most max_length UTF-8 bytes (the unit of the DetectEntities
+# limit) that end on a sentence boundary (or at least between two words) and
+# overlap their neighbours by about overlap bytes, so that an entity cut by the end of a window is found
+# whole in the next one. The windows are detected in parallel, the entity
+# offsets are shifted back to offsets in the whole text, entities cut by the
+# edge of a window are dropped and the duplicates found in two overlapping
+# windows are merged.
+
+from concurrent.futures import ThreadPoolExecutor
+import bisect
+import itertools
+import re
+
+# Where a window may end: after the end of a sentence or at a line break, or failing that between two words
+SENTENCE_BOUNDARY = re.compile(r'[.!?]["\')\]]*\s+|\n+')
+WORD_BOUNDARY = re.compile(r'\s+')
+
+
+# Returns: INTEGER the last boundary offset (the end of a match) in text[low:high], or None
+def _last_boundary(pattern, text, low, high):
+    last = None
+    for match in pattern.finditer(text, low, high):
+        if match.end() <= high:
+            last = match.end()
+    return last
+
+
+# Returns: INTEGER the first boundary offset (the end of a match) in text[low:high], or None
+def _first_boundary(pattern, text, low, high):
+    for match in pattern.finditer(text, low, high):
+        if match.end() <= high:
+            return match.end()
+    return None
+
+
+# Returns: BOOLEAN True if offset is inside a word of text
+def _cuts_word(text, offset):
+    return 0 < offset < len(text) and text[offset - 1].isalnum() and text[offset].isalnum()
+
+
+# Returns: SEQUENCE of the UTF-8 byte offset of every character offset of text (and of its end)
+def get_byte_offsets(text):
+    if text.isascii():
+        return range(len(text) + 1)
+    return list(itertools.accumulate((len(character.encode('utf-8')) for character in text), initial=0))
+
+
+# Split text into windows of at most max_length UTF-8 bytes overlapping by about overlap bytes
+# Returns: LIST of (start, end) character offsets, covering the whole text
+def split_into_windows(text, max_length, overlap):
+    if max_length <= 0 or overlap < 0 or overlap >= max_length // 2:
+        raise ValueError('The overlap must be less than half of the window length')
+
+    byte_offsets = get_byte_offsets(text)
+    windows = []
+    start = 0
+    while True:
+        if byte_offsets[-1] - byte_offsets[start] <= max_length:
+            windows.append((start, len(text)))
+            return windows
+
+        # End on the last sentence boundary of the second half of the window, or between two words
+        limit = max(bisect.bisect_right(byte_offsets, byte_offsets[start] + max_length) - 1, start + 1)
+        middle = start + (limit - start) // 2
+        end = (_last_boundary(SENTENCE_BOUNDARY, text, middle, limit)
+               or _last_boundary(WORD_BOUNDARY, text, middle, limit)
+               or limit)
+        windows.append((start, end))
+
+        # The next window starts on the first boundary at least overlap bytes before the end
+        low = max(bisect.bisect_left(byte_offsets, byte_offsets[end] - overlap), start + 1)
+        next_start = (_first_boundary(SENTENCE_BOUNDARY, text, low, end)
+                      or _first_boundary(WORD_BOUNDARY, text, low, end)
+                      or low)
+        start = min(next_start, end)
+
+
+# Detect the entities of text with detect_entities(window_text) -> LIST of entities, one
+# window at a time on max_workers threads
+# Returns: LIST of entities with offsets in text, sorted by BeginOffset
+def detect_entities_in_windows(detect_entities, text, windows, max_workers=4):
+    def detect(window):
+        start, end = window
+        return window, detect_entities(text[start:end])
+
+    if len(windows) == 1 or max_workers <= 1:
+        results = [detect(window) for window in windows]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as executor:
+            results = list(executor.map(detect, windows))
+
+    candidates = []
+    for (start, end), entities in results:
+        for entity in entities:
+            begin_offset, end_offset = start + entity['BeginOffset'], start + entity['EndOffset']
+            # An entity touching an edge that cuts a word has been cut, the neighbouring window has it whole
+            if (begin_offset == start and _cuts_word(text, start)) or (end_offset == end and _cuts_word(text, end)):
+                continue
+            candidates.append(dict(entity, BeginOffset=begin_offset, EndOffset=end_offset,
+                                   Text=text[begin_offset:end_offset]))
+    return deduplicate_entities(candidates)
+
+
+# Keep one entity per span found by overlapping windows (the one with the best Score),
+# and the longest entity where two spans overlap
+# Returns: LIST of entities sorted by BeginOffset
+def deduplicate_entities(entities):
+    ordered = sorted(entities, key=lambda entity: (entity['BeginOffset'], -entity['EndOffset'],
+                                                   -entity.get('Score', 0)))
+    kept = []
+    for entity in ordered:
+        if kept and entity['BeginOffset'] < kept[-1]['EndOffset']:
+            if (entity['EndOffset'] - entity['BeginOffset']) > (kept[-1]['EndOffset'] - kept[-1]['BeginOffset']):
+                kept[-1] = entity
+            continue
+        kept.append(entity)
+    return kept
@@ -0,0 +1,206 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Compact, linear-time model of a Textract DetectDocumentText result.
+#
+# The blocks are read in a single pass into slotted Page / Line / Word records,
+# the CHILD relationships are resolved once afterwards and the document text is
+# produced with a join over the LINE texts in reading order (the order in which
+# each PAGE lists its lines), so the model does not depend on the order in
+# which Textract returns the blocks. Character offsets in the text can be
+# mapped back to the LINE / WORD that produced them with a binary search.
+
+from array import array
+from bisect import bisect_right
+
+# Separator placed between the texts of two consecutive lines
+LINE_SEPARATOR = ' '
+
+
+class Page:
+    __slots__ = ('id', 'number', 'lines', 'bounding_box')
+
+    def __init__(self, block_id, number, bounding_box):
+        self.id = block_id
+        self.number = number
+        self.lines = []
+        self.bounding_box = bounding_box
+
+
+class Line:
+    __slots__ = ('id', 'text', 'confidence', 'page', 'words', 'bounding_box', 'start', 'end')
+
+    def __init__(self, block_id, text, confidence, page, bounding_box):
+        self.id = block_id
+        self.text = text
+        self.confidence = confidence
+        self.page = page
+        self.words = []
+        self.bounding_box = bounding_box
+        self.start = -1
+        self.end = -1
+
+
+class Word:
+    __slots__ = ('id', 'text', 'confidence', 'page', 'line', 'bounding_box', 'start', 'end')
+
+    def __init__(self, block_id, text, confidence, page, bounding_box):
+        self.id = block_id
+        self.text = text
+        self.confidence = confidence
+        self.page = page
+        self.line = None
+        self.bounding_box = bounding_box
+        self.start = -1
+        self.end = -1
+
+
+class TextractDocument:
+
+    # blocks can be any iterable (e.g. a generator over paginated results)
+    def __init__(self, blocks):
+        # Block Id -> Page / Line / Word
+        self.block_index = {}
+        self.pages = []
+
+        lines_in_block_order = []
+        child_ids = {}
+
+        for block in blocks:
+            block_type = block['BlockType']
+            if block_type == 'PAGE':
+                record = Page(block['Id'], block.get('Page', len(self.pages) + 1), _bounding_box(block))
+                self.pages.append(record)
+            elif block_type == 'LINE':
+                record = Line(block['Id'], block['Text'], block.get('Confidence'), block.get('Page', 1),
+                              _bounding_box(block))
+                lines_in_block_order.append(record)
+            elif block_type == 'WORD':
+                record = Word(block['Id'], block['Text'], block.get('Confidence'), block.get('Page', 1),
+                              _bounding_box(block))
+            else:
+                continue
+
+            self.block_index[record.id] = record
+            for relationship in block.get('Relationships', []):
+                if relationship['Type'] == 'CHILD':
+                    child_ids.setdefault(record.id, []).extend(relationship['Ids'])
+
+        self._resolve_relationships(child_ids, lines_in_block_order)
+        self._build_text()
+
+    def _resolve_relationships(self, child_ids, lines_in_block_order):
+        self.pages.sort(key=lambda page: page.number)
+        pages_by_number = {page.number: page for page in self.pages}
+
+        for record_id, ids in child_ids.items():
+            parent = self.block_index[record_id]
+            for child_id in ids:
+                child = self.block_index.get(child_id)
+                if isinstance(parent, Page) and isinstance(child, Line):
+                    parent.lines.append(child)
+                elif isinstance(parent, Line) and isinstance(child, Word):
+                    parent.words.append(child)
+                    child.line = parent
+
+        # Lines that no PAGE block lists as a child keep their block order
+        listed_lines = set(id(line) for page in self.pages for line in page.lines)
+        for line in lines_in_block_order:
+            if id(line) not in listed_lines:
+                page = pages_by_number.get(line.page)
+                if page is None:
+                    page = Page(None, line.page, None)
+                    pages_by_number[line.page] = page
+                    self.pages.append(page)
+                page.lines.append(line)
+        self.pages.sort(key=lambda page: page.number)
+
+    def _build_text(self):
+        self.lines = [line for page in self.pages for line in page.lines]
+        self.words = []
+        self._line_starts = array('q')
+        self._word_starts = array('q')
+
+        offset = 0
+        for line in self.lines:
+            line.start = offset
+            line.end = offset + len(line.text)
+            self._line_starts.append(line.start)
+
+            # Words are located inside the text of their line, in order
+            cursor = 0
+            for word in line.words:
+                position = line.text.find(word.text, cursor)
+                if position == -1:
+                    continue
+                word.start = line.start + position
+                word.end = word.start + len(word.text)
+                cursor = position + len(word.text)
+                self.words.append(word)
+                self._word_starts.append(word.start)
+
+            offset = line.end + len(LINE_SEPARATOR)
+
+        self.text = LINE_SEPARATOR.join(line.text for line in self.lines)
+
+    # Return the LINE that contains the character at offset, or None
+    def line_at(self, offset):
+        return _record_at(self.lines, self._line_starts, offset)
+
+    # Return the WORD that contains the character at offset, or None
+    def word_at(self, offset):
+        return _record_at(self.words, self._word_starts, offset)
+
+    # Return the LINEs that overlap the [begin, end) character span
+    def lines_in_span(self, begin, end):
+        return _records_in_span(self.lines, self._line_starts, begin, end)
+
+    # Return the WORDs that overlap the [begin, end) character span
+    def words_in_span(self, begin, end):
+        return _records_in_span(self.words, self._word_starts, begin, end)
+
+
+def _bounding_box(block):
+    bounding_box = block.get('Geometry', {}).get('BoundingBox')
+    if bounding_box is None:
+        return None
+    return (bounding_box['Left'], bounding_box['Top'], bounding_box['Width'], bounding_box['Height'])
+
+
+def _record_at(records, starts, offset):
+    index = bisect_right(starts, offset) - 1
+    if index >= 0 and offset < records[index].end:
+        return records[index]
+    return None
+
+
+def _records_in_span(records, starts, begin, end):
+    index = max(bisect_right(starts, begin) - 1, 0)
+    overlapping = []
+    while index < len(records) and records[index].start < end:
+        if records[index].end > begin:
+            overlapping.append(records[index])
+        index += 1
+    return overlapping
@@ -0,0 +1,148 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Page-parallel text detection of multi-page documents.
+#
+# Instead of one asynchronous Textract job, a multi-page PDF or TIFF is split
+# into single-page documents that are sent to the synchronous
+# detect_document_text API concurrently. The blocks of the pages are merged
+# back into the blocks an asynchronous job would have returned: the pages in
+# order, each block with the number of its page, and the Ids of a page that
+# collide with the Ids of an earlier page renamed (with the relationships
+# pointing to them).
+#
+# Splitting needs pypdf (PDF) or Pillow (TIFF), which are optional: without
+# them split_pages returns None and the document uses the asynchronous job.
+
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import uuid
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:
+    Image = ImageSequence = None
+
+# Number of pages detected concurrently per document (the detect_document_text calls
+# are limited by the budget of the client, see api_budgets)
+PAGE_PARALLEL_CONCURRENCY = int(os.environ.get('PAGE_PARALLEL_CONCURRENCY', '4'))
+
+# Largest page detect_document_text accepts as Bytes
+MAX_PAGE_BYTES = 5 * 1024 * 1024
+
+# Renamed block Ids are derived from the page number and the original Id, so that they are deterministic
+RENAMED_ID_NAMESPACE = uuid.UUID('6d1f9a52-3c1e-4d83-a4a8-0f52f2f8d7b1')
+
+# Returns: LIST of the single-page PDF documents of a PDF document
+def split_pdf_pages(document_bytes):
+    reader = pypdf.PdfReader(io.BytesIO(document_bytes))
+    pages = []
+    for page in reader.pages:
+        writer = pypdf.PdfWriter()
+        writer.add_page(page)
+        page_file = io.BytesIO()
+        writer.write(page_file)
+        pages.append(page_file.getvalue())
+    return pages
+
+
+# Returns: LIST of the single-page TIFF documents of a multi-page TIFF document
+def split_tiff_pages(document_bytes):
+    image = Image.open(io.BytesIO(document_bytes))
+    pages = []
+    for frame in ImageSequence.Iterator(image):
+        page_file = io.BytesIO()
+        frame.save(page_file, format='TIFF', compression=image.info.get('compression') or 'tiff_lzw')
+        pages.append(page_file.getvalue())
+    return pages
+
+
+# File extension -> (function splitting a document into pages, BOOLEAN its library is installed)
+PAGE_SPLITTERS = {
+    'pdf': (split_pdf_pages, pypdf is not None),
+    'tif': (split_tiff_pages, Image is not None),
+    'tiff': (split_tiff_pages, Image is not None),
+}
+
+
+# Returns: BOOLEAN True if documents with this file extension can be split into pages
+def can_split_pages(extension):
+    splitter = PAGE_SPLITTERS.get(extension.lower())
+    return splitter is not None and splitter[1]
+
+
+# Split a document into single-page documents that detect_document_text accepts
+# Returns: LIST of page documents, or None if the document cannot be processed page by page
+def split_pages(document_bytes, extension):
+    if not can_split_pages(extension):
+        return None
+    try:
+        pages = PAGE_SPLITTERS[extension.lower()][0](document_bytes)
+    except Exception as e:
+        print(f'Failed to split the document into pages: {e!r}')
+        return None
+    if len(pages) < 2 or any(len(page) > MAX_PAGE_BYTES for page in pages):
+        return None
+    return pages
+
+
+# Detect the text of every page on a bounded thread pool
+# Returns: LIST of the blocks of the document, merged in page order
+def detect_pages_text(textract_client, pages, max_workers=PAGE_PARALLEL_CONCURRENCY):
+    def detect(page):
+        return textract_client.detect_document_text(Document={'Bytes': page})['Blocks']
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages)))) as executor:
+        pages_blocks = list(executor.map(detect, pages))
+    return merge_page_blocks(pages_blocks)
+
+
+# Merge the blocks of single-page documents (in page order) into the blocks of one document
+# Returns: LIST of blocks
+def merge_page_blocks(pages_blocks):
+    merged_blocks = []
+    used_ids = set()
+    for page_number, blocks in enumerate(pages_blocks, start=1):
+        renamed_ids = {}
+        for block in blocks:
+            if block['Id'] in used_ids:
+                renamed_ids[block['Id']] = str(uuid.uuid5(RENAMED_ID_NAMESPACE, f"{page_number}/{block['Id']}"))
+
+        for block in blocks:
+            merged_block = dict(block, Page=page_number)
+            if renamed_ids:
+                merged_block['Id'] = renamed_ids.get(block['Id'], block['Id'])
+                if 'Relationships' in block:
+                    merged_block['Relationships'] = [
+                        dict(relationship, Ids=[renamed_ids.get(block_id, block_id) for block_id in relationship['Ids']])
+                        for relationship in block['Relationships']]
+            merged_blocks.append(merged_block)
+            used_ids.add(merged_block['Id'])
+    return merged_blocks
@@ -0,0 +1,144 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Adaptive polling of Comprehend Custom Entity Recognizer training jobs.
+#
+# CERTrainingCompleteCheck is invoked by a CloudWatch Events rule. Instead of a
+# fixed rate, every check moves the rule to the next poll delay, taken from a
+# backoff curve around the expected training duration:
+#   - right after the submission, the delay doubles from one check to the next,
+#     so that jobs failing on their input are noticed within minutes
+#   - before the expected duration, the delay halves the remaining time, so the
+#     checks get closer together as the job is expected to finish
+#   - after the expected duration, the delay grows with the overdue time, so a
+#     job that runs late is not polled every minute for hours
+# The expected duration is the median of the training durations recorded for
+# entity lists of a similar size (entity counts in the same power of two).
+
+import datetime
+import json
+import os
+import statistics
+
+from botocore.exceptions import ClientError
+
+# Training duration assumed when nothing has been recorded yet
+DEFAULT_EXPECTED_TRAINING_SECONDS = int(os.environ.get('CER_DEFAULT_EXPECTED_TRAINING_SECONDS', '3600'))
+
+# Bounds of the delay between two checks. CloudWatch Events rules can't fire more
+# often than once per minute, and a job is never left unchecked for longer than the
+# 10 minutes of the previous fixed rule
+MIN_POLL_SECONDS = max(60, int(os.environ.get('CER_MIN_POLL_SECONDS', '240')))
+MAX_POLL_SECONDS = min(600, int(os.environ.get('CER_MAX_POLL_SECONDS', '600')))
+
+# Delay of the first check, so that a job failing on its input is reported quickly
+FIRST_POLL_SECONDS = 300
+
+# Number of training durations kept per entity list size
+HISTORY_MAX_RECORDS = 20
+
+# Name of the training history object, stored next to the entity list
+TRAINING_HISTORY_FILE_NAME = 'cer-training-history.json'
+
+
+# Entity lists are grouped by the power of two of their entity count
+def get_size_bucket(entity_count):
+    return str(max(int(entity_count or 1), 1).bit_length())
+
+
+# Returns: INTEGER number of seconds to wait before the next check of a job that
+# was submitted elapsed_seconds ago and is expected to take expected_seconds
+def get_next_poll_delay(elapsed_seconds, expected_seconds, min_delay=MIN_POLL_SECONDS, max_delay=MAX_POLL_SECONDS):
+    if elapsed_seconds < expected_seconds:
+        delay = min(max(elapsed_seconds, FIRST_POLL_SECONDS), (expected_seconds - elapsed_seconds) / 2)
+    else:
+        delay = (elapsed_seconds - expected_seconds) / 2
+    return int(min(max(delay, min_delay), max_delay))
+
+
+class TrainingHistory:
+
+    def __init__(self, durations=None):
+        # Size bucket -> LIST of training durations in seconds, oldest first
+        self.durations = durations or {}
+
+    @classmethod
+    def load(cls, s3_client, bucket, key):
+        try:
+            history_object = s3_client.get_object(Bucket=bucket, Key=key)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            return cls()
+        return cls(json.loads(history_object['Body'].read().decode('utf-8'))['Durations'])
+
+    def save(self, s3_client, bucket, key):
+        s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps({'Durations': self.durations}).encode('utf-8'),
+                             ContentType='application/json')
+
+    def record(self, entity_count, duration_seconds):
+        durations = self.durations.setdefault(get_size_bucket(entity_count), [])
+        durations.append(round(duration_seconds))
+        del durations[:-HISTORY_MAX_RECORDS]
+
+    # Median duration of the closest size bucket that has records
+    # Returns: INTEGER expected training duration in seconds
+    def expected_duration(self, entity_count):
+        if not self.durations:
+            return DEFAULT_EXPECTED_TRAINING_SECONDS
+        size_bucket = int(get_size_bucket(entity_count))
+        closest_bucket = min(self.durations, key=lambda recorded: (abs(int(recorded) - size_bucket), int(recorded)))
+        return int(statistics.median(self.durations[closest_bucket]))
+
+
+# Location of the training history object for an entity list
+def get_history_key(entity_list_key):
+    folder = entity_list_key[:entity_list_key.rindex('/') + 1] if '/' in entity_list_key else ''
+    return folder + TRAINING_HISTORY_FILE_NAME
+
+
+# Seconds since the training job was submitted, from its DescribeEntityRecognizer properties
+def get_elapsed_seconds(recognizer_properties, now=None):
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return max((now - recognizer_properties['SubmitTime']).total_seconds(), 0)
+
+
+# Seconds the training job took, from its DescribeEntityRecognizer properties
+def get_training_seconds(recognizer_properties):
+    return (recognizer_properties['EndTime'] - recognizer_properties['SubmitTime']).total_seconds()
+
+
+# Schedule expression of a CloudWatch Events rule firing every delay_seconds
+def get_schedule_expression(delay_seconds):
+    minutes = max(1, int(round(delay_seconds / 60)))
+    return f"rate({minutes} minute{'s' if minutes > 1 else ''})"
+
+
+# Move the training completion check rule to the next poll delay (and enable it)
+def schedule_next_check(events_client, rule_name, delay_seconds):
+    events_client.put_rule(Name=rule_name, ScheduleExpression=get_schedule_expression(delay_seconds),
+                           State='ENABLED',
+                           Description='Event Rule to periodically check for completion of Training Job for new CER.')
+    print(f"Next check for completion of the Comprehend CER Training Job in {delay_seconds} seconds")
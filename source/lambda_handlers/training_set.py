@@ -0,0 +1,263 @@
+# MIT License
+#
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject
+# to  the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN  NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS
+# BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN
+# ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE  SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+# Bounded training sets for the Custom Entity Recognizer.
+#
+# NewEntityCheck trains a new recognizer on the documents of the training
+# dataset (one document per line) and the entity list. Instead of the whole
+# dataset, which only grows, it passes a training set built from it:
+#   1. exact duplicates (after case and whitespace folding) and near duplicates
+#      are dropped. Near duplicates are found with MinHash sketches of word
+#      shingles (one permutation hashing) and LSH banding, and confirmed when the
+#      sketches estimate a Jaccard similarity of TRAINING_SET_DUPLICATE_SIMILARITY
+#   2. the entities of the entity list are found in the documents with the
+#      gazetteer, and the documents covering every entity are picked first,
+#      rarest entity first
+#   3. the rest of the TRAINING_SET_MAX_DOCUMENTS documents is shared evenly by
+#      the entity types (and the documents without entities), each document
+#      counting for its rarest type, in a random order seeded for repeatability
+# The training set is written under training-sets/ next to the dataset, named
+# after its content, and a report comparing it with the dataset is written next
+# to the entity list.
+
+import collections
+import hashlib
+import json
+import os
+import random
+import time
+
+import entity_store
+import gazetteer
+
+TRAINING_SET_ENABLED = os.environ.get('TRAINING_SET_ENABLED', 'true').lower() == 'true'
+
+# Maximum number of documents of a training set
+TRAINING_SET_MAX_DOCUMENTS = int(os.environ.get('TRAINING_SET_MAX_DOCUMENTS', '10000'))
+
+# Estimated Jaccard similarity of their word shingles above which two documents are duplicates
+TRAINING_SET_DUPLICATE_SIMILARITY = float(os.environ.get('TRAINING_SET_DUPLICATE_SIMILARITY', '0.8'))
+
+# Words per shingle, and the bins of a MinHash sketch split into LSH bands of equal size
+SHINGLE_WORDS = 3
+SKETCH_BINS = 64
+LSH_BANDS = 16
+
+# Shingle hashes are below HASH_RANGE, the values given to the empty bins of a sketch are above it
+HASH_RANGE = 2 ** 64
+
+# Stratum of the documents in which no entity of the list was found
+NO_ENTITY_STRATUM = ''
+
+# Seed of the sampling order, the same dataset and entity list always give the same training set
+SAMPLE_SEED = 0
+
+# Folder, next to the dataset, of the training sets, and name of the report, next to the entity list
+TRAINING_SETS_FOLDER = 'training-sets/'
+REPORT_FILE_NAME = 'training-set-report.json'
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def _fold_words(text):
+    return text.casefold().split()
+
+
+# MinHash sketch of the word shingles of a text, with one hash per shingle: the
+# low bits pick a bin, and a bin keeps the smallest hash that falls in it. An
+# empty bin takes the value of the next full bin (circularly), shifted by their
+# distance, so that short texts don't all collide on their empty bins
+# Returns: TUPLE of SKETCH_BINS integers
+def get_sketch(text):
+    words = _fold_words(text)
+    sketch = [None] * SKETCH_BINS
+    for start in range(max(1, len(words) - SHINGLE_WORDS + 1)):
+        shingle_hash = _hash64(' '.join(words[start:start + SHINGLE_WORDS]))
+        sketch_bin = shingle_hash % SKETCH_BINS
+        if sketch[sketch_bin] is None or shingle_hash < sketch[sketch_bin]:
+            sketch[sketch_bin] = shingle_hash
+
+    dense_sketch = list(sketch)
+    for sketch_bin, value in enumerate(sketch):
+        distance = 1
+        while value is None:
+            value = sketch[(sketch_bin + distance) % SKETCH_BINS]
+            if value is not None:
+                dense_sketch[sketch_bin] = value + distance * HASH_RANGE
+            distance += 1
+    return tuple(dense_sketch)
+
+
+# Returns: FLOAT Jaccard similarity of the shingles of two texts estimated from their sketches
+def estimate_similarity(sketch, other_sketch):
+    return sum(1 for value, other_value in zip(sketch, other_sketch) if value == other_value) / SKETCH_BINS
+
+
+# Drop the exact and near duplicates of earlier documents
+# Returns: TUPLE (LIST of the indexes of the documents kept, INTEGER exact duplicates, INTEGER near duplicates)
+def deduplicate(documents, similarity=TRAINING_SET_DUPLICATE_SIMILARITY):
+    rows = SKETCH_BINS // LSH_BANDS
+    seen_texts = set()
+    # (band, values of the band) -> LIST of the indexes of kept documents
+    band_buckets = collections.defaultdict(list)
+    sketches = {}
+    kept = []
+    exact_duplicates = near_duplicates = 0
+    for index, document in enumerate(documents):
+        text_hash = _hash64(' '.join(_fold_words(document)))
+        if text_hash in seen_texts:
+            exact_duplicates += 1
+            continue
+        seen_texts.add(text_hash)
+
+        sketch = get_sketch(document)
+        bands = [(band, sketch[band * rows:(band + 1) * rows]) for band in range(LSH_BANDS)]
+        candidates = {candidate for band in bands for candidate in band_buckets.get(band, ())}
+        if any(estimate_similarity(sketch, sketches[candidate]) >= similarity for candidate in candidates):
+            near_duplicates += 1
+            continue
+
+        sketches[index] = sketch
+        for band in bands:
+            band_buckets[band].append(index)
+        kept.append(index)
+    return kept, exact_duplicates, near_duplicates
+
+
+# Returns: FROZENSET of the normalized (text, type) keys of the entities found in a document
+def find_document_entities(entity_gazetteer, document):
+    return frozenset(entity_store.normalize_entity(document[begin:end], entity_type)
+                     for begin, end, entity_type in entity_gazetteer.find(document))
+
+
+# Pick up to max_documents documents covering every entity found in them, then
+# share the rest evenly by the strata of the documents (their rarest entity type)
+# Returns: LIST of the picked indexes of documents_entities, in dataset order
+def sample(documents_entities, max_documents=TRAINING_SET_MAX_DOCUMENTS, seed=SAMPLE_SEED):
+    entity_documents = collections.defaultdict(list)
+    for index, entities in enumerate(documents_entities):
+        for entity in entities:
+            entity_documents[entity].append(index)
+
+    # Every entity, rarest first, is covered by the document covering the most entities not covered yet
+    selected, covered = set(), set()
+    for entity in sorted(entity_documents, key=lambda entity: (len(entity_documents[entity]), entity)):
+        if len(selected) >= max_documents:
+            break
+        if entity in covered:
+            continue
+        best = max(entity_documents[entity], key=lambda index: (len(documents_entities[index] - covered), -index))
+        selected.add(best)
+        covered.update(documents_entities[best])
+
+    type_counts = collections.Counter(entity_type for entities in documents_entities
+                                      for entity_type in {entity_type for _, entity_type in entities})
+    strata = collections.defaultdict(list)
+    for index, entities in enumerate(documents_entities):
+        if index not in selected:
+            entity_types = {entity_type for _, entity_type in entities}
+            strata[min(entity_types, key=lambda entity_type: (type_counts[entity_type], entity_type))
+                   if entity_types else NO_ENTITY_STRATUM].append(index)
+
+    # Round robin over the shuffled strata, so a stratum with few documents leaves its share to the others
+    generator = random.Random(seed)
+    queues = []
+    for stratum in sorted(strata):
+        generator.shuffle(strata[stratum])
+        queues.append(collections.deque(strata[stratum]))
+    while queues and len(selected) < max_documents:
+        for queue in list(queues):
+            if len(selected) >= max_documents:
+                break
+            selected.add(queue.popleft())
+            if not queue:
+                queues.remove(queue)
+    return sorted(selected)
+
+
+# Returns: STRING key of the report of the training sets built for an entity list
+def get_report_key(entity_list_key):
+    folder = entity_list_key[:entity_list_key.rindex('/') + 1] if '/' in entity_list_key else ''
+    return folder + REPORT_FILE_NAME
+
+
+# Build the training set of a recognizer from the training dataset and the entity list it is trained with
+# Returns: TUPLE (STRING S3 URI of the documents to train with, DICTIONARY report)
+def build_training_set(s3_client, dataset_s3_uri, store, max_documents=TRAINING_SET_MAX_DOCUMENTS,
+                       similarity=TRAINING_SET_DUPLICATE_SIMILARITY):
+    start = time.perf_counter()
+    bucket, dataset_key = dataset_s3_uri.replace('s3://', '').split('/', 1)
+    dataset_object = s3_client.get_object(Bucket=bucket, Key=dataset_key)
+    lines = [line.decode('utf-8') if isinstance(line, bytes) else line
+             for line in dataset_object['Body'].iter_lines()]
+    documents = [line for line in lines if line.strip()]
+
+    kept, exact_duplicates, near_duplicates = deduplicate(documents, similarity)
+    entity_gazetteer = gazetteer.Gazetteer.from_entity_store(store)
+    kept_entities = [find_document_entities(entity_gazetteer, documents[index]) for index in kept]
+    positions = sample(kept_entities, max_documents)
+    selected = [kept[position] for position in positions]
+    covered = set().union(*(kept_entities[position] for position in positions))
+    missing_entities = sorted(text for text, entity_type in store
+                              if entity_store.normalize_entity(text, entity_type) not in covered)
+
+    report = {'DatasetS3Uri': dataset_s3_uri,
+              'InputDocuments': len(documents),
+              'InputBytes': sum(len(document.encode('utf-8')) + 1 for document in documents),
+              'ExactDuplicates': exact_duplicates,
+              'NearDuplicates': near_duplicates,
+              'TrainingDocuments': len(selected),
+              'Entities': len(store),
+              'EntitiesCovered': len(store) - len(missing_entities),
+              'EntitiesMissing': missing_entities[:100],
+              'TrainingDocumentsPerType': dict(sorted(collections.Counter(
+                  entity_type for position in positions
+                  for entity_type in {entity_type for _, entity_type in kept_entities[position]}).items()))}
+
+    # The dataset is used as is when no document (nor empty line) was dropped
+    if len(selected) == len(lines):
+        training_set_s3_uri = dataset_s3_uri
+        report['TrainingBytes'] = report['InputBytes']
+    else:
+        body = '\n'.join(documents[index] for index in selected).encode('utf-8')
+        folder, _, name = dataset_key.rpartition('/')
+        stem, dot, extension = name.rpartition('.') if '.' in name else (name, '', '')
+        training_set_key = ((folder + '/' if folder else '') + TRAINING_SETS_FOLDER + stem + '-'
+                            + hashlib.sha256(body).hexdigest()[:16] + dot + extension)
+        s3_client.put_object(Bucket=bucket, Key=training_set_key, Body=body, ContentType='text/plain')
+        training_set_s3_uri = f's3://{bucket}/{training_set_key}'
+        report['TrainingBytes'] = len(body) + 1
+
+    report['TrainingSetS3Uri'] = training_set_s3_uri
+    report['SizeRatio'] = round(report['TrainingBytes'] / max(1, report['InputBytes']), 4)
+    report['BuildSeconds'] = round(time.perf_counter() - start, 3)
+    return training_set_s3_uri, report
+
+
+def put_report(s3_client, bucket, key, report):
+    s3_client.put_object(Bucket=bucket, Key=key, Body=json.dumps(report, indent=2).encode('utf-8'),
+                         ContentType='application/json')